@@ -0,0 +1,105 @@
+"""
+An asyncio interface to searching and pricing trips, for services that run on an event loop.
+
+Selenium and requests both block, so the work for each request runs on a thread of its own
+executor, sized to the pool, while the event loop only waits.  Parsing happens on those threads as
+well, so it does not stall the loop.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import threading
+from amtrakomatic import scrape_amtrak
+
+DEFAULT_TIMEOUT = 120
+DEFAULT_MAX_PENDING = 100
+
+class Overloaded(Exception):
+    """
+    Raised instead of queueing a request when max_pending requests are already waiting, so that a
+    service can turn callers away rather than build an unbounded backlog.
+    """
+
+# pylint: disable=too-many-instance-attributes
+class Searcher:
+    """
+    Runs searches and trip pricing on sessions from a DriverPool, at most concurrency at once.
+    Up to max_pending more requests wait their turn, and further ones raise Overloaded.  Requests
+    that take longer than their timeout raise asyncio.TimeoutError.
+
+    A request that is cancelled or times out before it starts never touches a session.  One that
+    is already running in a browser or waiting on the site cannot be interrupted, so its thread
+    finishes in the background and the result is dropped.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, pool, concurrency=None, max_pending=DEFAULT_MAX_PENDING,
+                 timeout=DEFAULT_TIMEOUT, cache=None, archive=None):
+        self.pool = pool
+        self.concurrency = concurrency or pool.size
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.cache = cache
+        self.archive = archive
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._slots = None
+
+    async def _run(self, timeout, function, *args):
+        with self._lock:
+            if self._pending >= self.max_pending + self.concurrency:
+                raise Overloaded("%s requests already pending" % self._pending)
+            self._pending = self._pending + 1
+        try:
+            if self._slots is None:
+                self._slots = asyncio.Semaphore(self.concurrency)
+
+            async def run():
+                async with self._slots:
+                    return await asyncio.get_running_loop().run_in_executor(
+                        self._executor, functools.partial(function, *args))
+            return await asyncio.wait_for(run(), self.timeout if timeout is None else timeout)
+        finally:
+            with self._lock:
+                self._pending = self._pending - 1
+
+    async def search(self, source, destination, date, use_points=False, refresh=False,
+                     timeout=None):
+        """
+        Gets all results for a search, the same as scrape_amtrak.get_all_fares.
+        """
+        return await self._run(timeout, scrape_amtrak.get_all_fares, source, destination, date,
+                               use_points, self.pool, self.cache, refresh, self.archive)
+
+    async def price_trip(self, source, destination, date, train_name, use_points=False,
+                         timeout=None):
+        """
+        Gets to the checkout page for one train and returns the ticket and its price as shown
+        there.  The pool must be of logged in browser sessions.
+        """
+        search_info = [source, destination, date, train_name,
+                       "points" if use_points else "dollars"]
+        return await self._run(timeout, scrape_amtrak.price_csv_trip, self.pool, search_info)
+
+    def pending(self):
+        """
+        Returns how many requests are running or waiting.
+        """
+        with self._lock:
+            return self._pending
+
+    async def close(self):
+        """
+        Waits for running requests to finish, then closes the pool.
+        """
+        await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(self._executor.shutdown, wait=True))
+        self.pool.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -2,191 +2,600 @@
 A class that gives a structured interface to Amtrak results given a raw HTML page.
 """
 
+import array
+import re
+import sys
 import typing
 import attr
-from bs4 import BeautifulSoup
+from amtrakomatic import metrics
+
+# Stands in for a missing number in the columns returned by AmtrakResults.to_columns.
+MISSING = -1
+
+DURATION_PATTERN = re.compile(r"^\s*(?:(\d+)\s*h)?\s*(?:(\d+)\s*m)?\s*$")
+
+# What parsing a page that is not laid out the way the parser expects raises, for callers that
+# carry on past a bad page.
+PARSE_ERRORS = (AttributeError, LookupError, TypeError, ValueError)
+
+
+def train_number(train_name):
+    """
+    Returns the number a train name like "5 California Zephyr" starts with, or None.
+    """
+    number = train_name.split(" ", 1)[0] if train_name else ""
+    return number if number.isdigit() else None
+
+
+def duration_minutes(duration):
+    """
+    Parses a duration like "15h 37m" into minutes, or None if it is missing or not a duration.
+    """
+    match = DURATION_PATTERN.match(duration or "")
+    if not match or not any(match.groups()):
+        return None
+    return int(match.group(1) or 0) * 60 + int(match.group(2) or 0)
+
 
 # pylint: disable=too-few-public-methods
-@attr.s(auto_attribs=True)
-class AmtrakResult:
+@attr.s(auto_attribs=True, slots=True, frozen=True)
+class Fare:
+    """
+    A fare as the site shows it, and its amount in cents, or in points for points fares.  The
+    amount is None if the fare is not available.
+    """
+    text: typing.Optional[str]
+    amount: typing.Optional[int]
+    points: bool
+
+    @classmethod
+    def parse(cls, text, points=None):
+        """
+        Parses a fare like "$93.00" or "4,002 points".  Whether it is in points is taken from the
+        text unless points is given, since the checkout page shows points without the unit.
+        """
+        if points is None:
+            points = bool(text) and "points" in text
+        amount = None
+        if text:
+            try:
+                number = float(text.replace("$", "").replace(",", "").replace("points", "").strip())
+                amount = int(round(number)) if points else int(round(number * 100))
+            except ValueError:
+                pass
+        return cls(text, amount, points)
+
+    @property
+    def value(self):
+        """
+        The fare in dollars or points, or None if it is not available.
+        """
+        if self.amount is None:
+            return None
+        return float(self.amount) if self.points else self.amount / 100
+
+
+def fare_value(fare):
+    """
+    Parses a fare like "$93.00" or "4,002 points" into a number, or None if the fare is not
+    available.
+    """
+    return Fare.parse(fare).value
+
+
+def format_fare_value(value, use_points):
+    """
+    Formats a number parsed by fare_value the way the site shows it, without cents.
+    """
+    if value is None:
+        return "-"
+    if use_points:
+        return "{:,.0f} points".format(value)
+    return "${:,.0f}".format(value) if value == int(value) else "${:,.2f}".format(value)
+
+
+# The classes below keep the fields parsed from the page as attrs attributes, so attr.asdict still
+# gives the same dicts as our JSON fixtures, and keep the numbers derived from them in slots of a
+# plain base class, which attr.asdict and eq do not look at.  Pickling goes through the default
+# slots support rather than the one attrs generates, since that one only knows about attributes.
+
+class _TransferSlots:
+    __slots__ = ("minutes",)
+
+
+@attr.s(auto_attribs=True, slots=True, getstate_setstate=False)
+class Transfer(_TransferSlots):
+    """
+    A change of trains between two legs, and how long it takes.
+    """
+    station: str
+    duration: str
+
+    def __attrs_post_init__(self):
+        # pylint: disable=attribute-defined-outside-init
+        self.minutes = duration_minutes(self.duration)
+
+
+def _to_transfer(transfer):
+    # Legs without a transfer keep the empty dict the original model used.
+    if not transfer:
+        return {}
+    if isinstance(transfer, Transfer):
+        return transfer
+    return Transfer(**transfer)
+
+
+class _LegSlots:
+    __slots__ = ("minutes",)
+
+
+@attr.s(auto_attribs=True, slots=True, getstate_setstate=False)
+class Leg(_LegSlots):
+    """
+    One train or bus of a trip, and the transfer after it if there is one.
+    """
+    train_name: str
+    departure_time: str
+    arrival_time: str
+    arrival_day: str
+    duration: str
+    transfer: typing.Union[Transfer, dict] = attr.ib(converter=_to_transfer, factory=dict)
+
+    def __attrs_post_init__(self):
+        # pylint: disable=attribute-defined-outside-init
+        self.minutes = duration_minutes(self.duration)
+
+
+def _to_legs(legs):
+    return [leg if isinstance(leg, Leg) else Leg(**leg) for leg in legs]
+
+
+class _ResultSlots:
+    __slots__ = ("total_minutes", "parsed_fares")
+
+
+@attr.s(auto_attribs=True, slots=True, getstate_setstate=False)
+class AmtrakResult(_ResultSlots):
     """
-    A single trip result from the results page.
+    A single trip result from the results page.  Legs can be given as dicts, as they are in our
+    JSON fixtures.
     """
     total_travel_time: str
-    legs: typing.List[dict]
+    legs: typing.List[Leg] = attr.ib(converter=_to_legs)
     fares: typing.List[str]
     minimum_fare_value_attribute: str
     result_id: str
     add_to_cart_button_name_attribute: str
 
-    def pretty_print(self):
+    def __attrs_post_init__(self):
+        # pylint: disable=attribute-defined-outside-init
+        self.total_minutes = duration_minutes(self.total_travel_time)
+        self.parsed_fares = tuple(Fare.parse(fare) for fare in self.fares)
+
+    def has_train(self, name):
         """
-        Pretty prints this result to the terminal.
+        Returns whether any leg is the named train, given as its full name like
+        "5 California Zephyr" or just its number.
+        """
+        return any(name in (leg.train_name, train_number(leg.train_name)) for leg in self.legs)
+
+    def cheapest(self):
+        """
+        Returns the cheapest available Fare, or None if every fare is sold out.
+        """
+        available = [fare for fare in self.parsed_fares if fare.amount is not None]
+        return min(available, key=lambda fare: fare.amount) if available else None
+
+    def cheapest_fare(self):
+        """
+        Returns the lowest available fare as a number, or None if every fare is sold out.
+        """
+        fare = self.cheapest()
+        return fare.value if fare else None
+
+    def format(self):
+        """
+        Formats this result the way pretty_print shows it: a line with the whole trip and its
+        fares, a line for each leg and transfer, and a blank line.
         """
         indent = "    "
         first_departure = None
         last_arrival = None
-        legs_string = ""
+        # Built up in place rather than as a list of lines, so that the text is only held once
+        # more, when the first line is put in front of it.
+        legs = ""
         for leg in self.legs:
-            if not first_departure:
-                first_departure = "".join(leg["departure_time"].split(" "))
-            last_arrival = "".join(leg["arrival_time"].split(" "))
-            to_print = ""
-            to_print = to_print + "%s%-30s| " % (
-                indent,
-                leg["train_name"],
-                )
-            to_print = to_print + "%s -> " % (
-                "".join(leg["departure_time"].split(" ")),
-                )
-            to_print = to_print + "%s" % (
-                "".join(leg["arrival_time"].split(" "))
-                )
-            if leg["arrival_day"]:
-                to_print = to_print + ", %s" % (
-                    leg["arrival_day"],
-                    )
-                last_arrival = last_arrival + ", " + leg["arrival_day"]
-            to_print = to_print + " (%s)" % (
-                leg["duration"],
-                )
-            if leg["transfer"]:
-                to_print = to_print + "\n%s%sTRANSFER: %s (%s)" % (
-                    indent,
-                    indent,
-                    leg["transfer"]["station"],
-                    leg["transfer"]["duration"],
-                    )
-            legs_string = legs_string + to_print + "\n"
-        print("%s -> %s (%s): %s" % (
-            first_departure,
-            last_arrival,
-            self.total_travel_time,
-            ", ".join([fare.replace(".00", "") for fare in self.fares]),
-            ))
-        print(legs_string)
+            departure = leg.departure_time.replace(" ", "")
+            arrival = leg.arrival_time.replace(" ", "")
+            first_departure = first_departure or departure
+            last_arrival = arrival
+            arrival_day = ""
+            if leg.arrival_day:
+                arrival_day = ", %s" % leg.arrival_day
+                last_arrival = arrival + arrival_day
+            legs += "%s%-30s| %s -> %s%s (%s)\n" % (indent, leg.train_name, departure, arrival,
+                                                   arrival_day, leg.duration)
+            if leg.transfer:
+                legs += "%s%sTRANSFER: %s (%s)\n" % (indent, indent, leg.transfer.station,
+                                                     leg.transfer.duration)
+        return "%s -> %s (%s): %s\n%s\n" % (
+            first_departure, last_arrival, self.total_travel_time,
+            ", ".join([fare.replace(".00", "") for fare in self.fares]), legs)
+
+    def pretty_print(self):
+        """
+        Pretty prints this result to the terminal.
+        """
+        sys.stdout.write(self.format())
+
+
+@attr.s(auto_attribs=True, slots=True)
+class StringColumn:
+    """
+    A column of strings stored the way Arrow stores them, as one buffer of UTF-8 data and the
+    offset where each string starts, plus one for where the last one ends.  Missing strings are
+    stored as empty ones.
+    """
+    offsets: array.array
+    data: bytes
+
+    @classmethod
+    def from_strings(cls, strings):
+        """
+        Builds a column from an iterable of strings.
+        """
+        offsets = array.array("q", [0])
+        chunks = []
+        end = 0
+        for string in strings:
+            chunk = (string or "").encode("utf-8")
+            chunks.append(chunk)
+            end = end + len(chunk)
+            offsets.append(end)
+        return cls(offsets, b"".join(chunks))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.data[self.offsets[index]:self.offsets[index + 1]].decode("utf-8")
+
+
+def _number(value):
+    return MISSING if value is None else value
+
+
+RESULT_TABLE_CLASS = "newFareFamilyTable"
+
+# Where each result table starts, so the page can be cut into one piece per result.
+RESULT_TABLE_START_PATTERN = re.compile(
+    r'<table\b[^>]*\bclass="[^"]*\b%s\b' % RESULT_TABLE_CLASS)
+
+PAGINATION_LINK_PATTERN = re.compile(
+    r'<a[^>]*\bclass="[^"]*\bpagination_page\b[^"]*"[^>]*>\s*(\d+)\s*</a>')
+
+
+def pagination_pages(html):
+    """
+    Returns the numbers of the pages linked from a results page, in order, or an empty list if
+    all the results are on one page.  This only scans the text, so it is cheap enough to run
+    before deciding whether to parse.
+    """
+    return sorted({int(page) for page in PAGINATION_LINK_PATTERN.findall(html)})
+
+# "scoped" only builds the result tables and reads each one in a single walk, "full" builds the
+# whole page and searches it the way the original parser did.  Both give identical results.
+PARSER_ENGINES = ("scoped", "full")
+DEFAULT_PARSER_ENGINE = "scoped"
+
+
+def _has_class(tag, class_name):
+    return class_name in tag.get("class", ())
+
+
+def _is_result_table_class(class_value):
+    # Depending on the version, BeautifulSoup hands the strainer either the raw class string or
+    # one class at a time, and a plain class name strainer does not match "a b c" in newer ones.
+    if class_value is None:
+        return False
+    if isinstance(class_value, str):
+        class_value = class_value.split()
+    return RESULT_TABLE_CLASS in class_value
+
+
+def _text(string):
+    # A NavigableString keeps its whole parse tree alive, so results only hold plain strings.
+    return None if string is None else str(string)
+
+
+def _find_duration(element):
+    duration = None
+    duration = element.find("h2", "duration_lg")
+    if duration and duration.string.replace(u'\xa0', u''):
+        return str(duration.string)
+    return element.find(
+        "span", "ff_seg_duration").string.strip().rstrip(")").lstrip("(")
+
+
+def _build_legs(legs_info_raw, legs_train_names, transfers):
+    if len(legs_info_raw) != len(transfers) + 1:
+        raise ValueError("Got invalid leg times and transfers: %s, %s" % (
+            legs_info_raw, transfers))
+    if len(legs_info_raw) != len(legs_train_names):
+        raise ValueError("Got invalid leg times and train_names: %s, %s" % (
+            legs_info_raw, legs_train_names))
+    leg_info = []
+    for leg_num, leg_info_raw in enumerate(legs_info_raw):
+        leg_times = leg_info_raw.find_all("h2", "time_lg")
+        departure_time = leg_times[0].string.strip()
+        arrival_time = leg_times[1].contents[0].strip()
+        arrival_day_element = leg_info_raw.find("div", "depart_date_sm")
+        arrival_day = ""
+        if arrival_day_element:
+            arrival_day = arrival_day_element.string.strip()
+        transfer = {}
+        if leg_num < len(legs_info_raw) - 1:
+            transfer_info = transfers[leg_num].string.split("|")
+            transfer = Transfer(station=transfer_info[0].strip().replace("\n", ""),
+                                duration=transfer_info[1].strip())
+        leg_info.append(Leg(
+            train_name=legs_train_names[leg_num].string.strip(),
+            departure_time=departure_time,
+            arrival_time=arrival_time,
+            arrival_day=arrival_day,
+            duration=_find_duration(leg_info_raw),
+            transfer=transfer,
+        ))
+    return leg_info
+
+
+def _parse_result_full(element):
+    """
+    Reads one result table by searching it once per field.
+    """
+
+    def get_total_travel_time(element):
+        total_travel_time = element.find("span", "total_travel_time")
+        if total_travel_time:
+            return total_travel_time.string.split(u'\xa0')[0]
+        return None
+
+    def get_legs(element):
+        # Yes, this is actually the most reliable predictor of where the times will be for a
+        # specific leg.
+        return _build_legs(element.find_all("div", "row_one"),
+                           element.find_all("span", id="_service_span"),
+                           element.find_all("span", "transfer_copy"))
+
+    def get_fares(element):
+        fares = element.find_all("table", "ffam-price-container")
+        # It would be nice to include the names of the fares, but that would have to be parsed
+        # elsewhere.  Plus, points pages do not have the fare names header.
+        text_fares = []
+        for fare in fares:
+            text_fares.append(_text(fare.find("span", "radio-button__text").string))
+        return text_fares
+
+    def get_minimum_fare_value_attribute(element):
+        fares = element.find_all("table", "ffam-price-container")
+        minimum_fare_value_attribute = None
+        for fare in fares:
+            if fare.find("span", "radio-button__text").string:
+                minimum_fare_value_attribute = fare.find("input").attrs["value"]
+                break
+        return minimum_fare_value_attribute
+
+    def get_add_to_cart_button_name_attribute(element):
+        addtocartbutton = element.find("input", "addtocart")
+        if addtocartbutton:
+            return addtocartbutton.attrs["name"]
+        return ""
+
+    return AmtrakResult(
+        total_travel_time=get_total_travel_time(element),
+        legs=get_legs(element),
+        fares=get_fares(element),
+        minimum_fare_value_attribute=get_minimum_fare_value_attribute(element),
+        add_to_cart_button_name_attribute=get_add_to_cart_button_name_attribute(element),
+        result_id=element.attrs["id"]
+        )
+
+
+# pylint: disable=too-many-branches
+def _parse_result_scoped(element):
+    """
+    Reads one result table in a single walk over its tags.  Only the leg rows and price containers
+    are searched again, and those are small.
+    """
+    total_travel_time = None
+    legs_info_raw = []
+    legs_train_names = []
+    transfers = []
+    fares = []
+    minimum_fare_value_attribute = None
+    add_to_cart_button_name_attribute = None
+    for tag in element.descendants:
+        if tag.name is None:
+            continue
+        if tag.name == "div":
+            if _has_class(tag, "row_one"):
+                legs_info_raw.append(tag)
+        elif tag.name == "span":
+            if tag.get("id") == "_service_span":
+                legs_train_names.append(tag)
+            if _has_class(tag, "transfer_copy"):
+                transfers.append(tag)
+            if total_travel_time is None and _has_class(tag, "total_travel_time"):
+                total_travel_time = tag.string.split(u'\xa0')[0]
+        elif tag.name == "table":
+            if _has_class(tag, "ffam-price-container"):
+                # It would be nice to include the names of the fares, but that would have to be
+                # parsed elsewhere.  Plus, points pages do not have the fare names header.
+                fare = _text(tag.find("span", "radio-button__text").string)
+                fares.append(fare)
+                if fare and minimum_fare_value_attribute is None:
+                    minimum_fare_value_attribute = tag.find("input").attrs["value"]
+        elif tag.name == "input":
+            if add_to_cart_button_name_attribute is None and _has_class(tag, "addtocart"):
+                add_to_cart_button_name_attribute = tag.attrs["name"]
+    return AmtrakResult(
+        total_travel_time=total_travel_time,
+        legs=_build_legs(legs_info_raw, legs_train_names, transfers),
+        fares=fares,
+        minimum_fare_value_attribute=minimum_fare_value_attribute,
+        add_to_cart_button_name_attribute=add_to_cart_button_name_attribute or "",
+        result_id=element.attrs["id"]
+        )
+
+
+def _to_results(results):
+    return [result if isinstance(result, AmtrakResult) else AmtrakResult(**result)
+            for result in results]
+
+
+# The train index is a cache rather than something parsed from the page, so it is kept in a slot,
+# like the numbers derived from the fields of the classes above.
+class _ResultsSlots:
+    __slots__ = ("_train_index",)
 
 
 @attr.s(auto_attribs=True)
-class AmtrakResults:
+class AmtrakResults(_ResultsSlots):
     """
-    A list of all results from the results page.
+    A list of all results from the results page.  Results can be given as dicts, as attr.asdict
+    gives them.
     """
-    results: typing.List[AmtrakResult] = []
+    results: typing.List[AmtrakResult] = attr.ib(default=[], converter=_to_results)
+
+    def __attrs_post_init__(self):
+        # pylint: disable=attribute-defined-outside-init
+        self._train_index = None
 
     @classmethod
-    def from_html(cls, html):
+    def from_html(cls, html, engine=DEFAULT_PARSER_ENGINE):
         """
-        Parses the html into a list of AmtrakResult objects.
+        Parses the html into a list of AmtrakResult objects.  See PARSER_ENGINES for the choices
+        of engine.
         """
-        soup = BeautifulSoup(html, 'html.parser')
-        raw_results = soup.find_all("table", "newFareFamilyTable")
+        # BeautifulSoup is slow to import, and most commands never parse a page.
+        # pylint: disable=import-outside-toplevel
+        from bs4 import BeautifulSoup, SoupStrainer
+        if engine not in PARSER_ENGINES:
+            raise ValueError("Unknown parser engine %s, expected one of %s" % (
+                engine, ", ".join(PARSER_ENGINES)))
+        with metrics.span("from_html"):
+            if engine == "scoped":
+                soup = BeautifulSoup(html, 'html.parser',
+                                     parse_only=SoupStrainer(
+                                         "table", attrs={"class": _is_result_table_class}))
+                parse_result = _parse_result_scoped
+            else:
+                soup = BeautifulSoup(html, 'html.parser')
+                parse_result = _parse_result_full
+            raw_results = soup.find_all("table", RESULT_TABLE_CLASS)
+            results = cls([parse_result(raw_result) for raw_result in raw_results])
+        metrics.count("results", len(results.results))
+        return results
 
-        def get_total_travel_time(element):
-            total_travel_time = element.find("span", "total_travel_time")
-            if total_travel_time:
-                return total_travel_time.string.split(u'\xa0')[0]
-            return None
+    @staticmethod
+    def iter_html(html):
+        """
+        Yields the results on a page one at a time, parsing each only when it is asked for, so
+        that a caller looking for one result can stop without parsing the rest.  Gives the same
+        results as from_html.
+        """
+        # pylint: disable=import-outside-toplevel
+        from bs4 import BeautifulSoup, SoupStrainer
+        if not isinstance(html, str):
+            html = html.read()
+        strainer = SoupStrainer("table", attrs={"class": _is_result_table_class})
+        starts = [match.start() for match in RESULT_TABLE_START_PATTERN.finditer(html)]
+        # Each piece runs from the start of one result table to the start of the next, so it
+        # holds the whole of its table and nothing of any other.
+        for start, end in zip(starts, starts[1:] + [len(html)]):
+            soup = BeautifulSoup(html[start:end], 'html.parser', parse_only=strainer)
+            for raw_result in soup.find_all("table", RESULT_TABLE_CLASS):
+                yield _parse_result_scoped(raw_result)
 
-        def get_legs(element):
-
-            def find_duration(element):
-                duration = None
-                duration = element.find("h2", "duration_lg")
-                if duration and duration.string.replace(u'\xa0', u''):
-                    return duration.string
-                return element.find(
-                    "span", "ff_seg_duration").string.strip().rstrip(")").lstrip("(")
-
-            # Yes, this is actually the most reliable predictor of where the times will be for a
-            # specific leg.
-            legs_info_raw = element.find_all("div", "row_one")
-            legs_train_names = element.find_all("span", id="_service_span")
-            transfers = element.find_all("span", "transfer_copy")
-            if len(legs_info_raw) != len(transfers) + 1:
-                raise Exception("Got invalid leg times and transfers: %s, %s" % (
-                    legs_info_raw, transfers))
-            if len(legs_info_raw) != len(legs_train_names):
-                raise Exception("Got invalid leg times and train_names: %s, %s" % (
-                    legs_info_raw, legs_train_names))
-            leg_info = []
-            for leg_num, leg_info_raw in enumerate(legs_info_raw):
-                leg_times = leg_info_raw.find_all("h2", "time_lg")
-                departure_time = leg_times[0].string.strip()
-                arrival_time = leg_times[1].contents[0].strip()
-                arrival_day_element = leg_info_raw.find("div", "depart_date_sm")
-                arrival_day = ""
-                if arrival_day_element:
-                    arrival_day = arrival_day_element.string.strip()
-                transfer = {}
-                if leg_num < len(legs_info_raw) - 1:
-                    transfer_info = transfers[leg_num].string.split("|")
-                    transfer = {"station": transfer_info[0].strip().replace("\n", ""),
-                                "duration": transfer_info[1].strip()}
-                leg_info.append({
-                    "train_name": legs_train_names[leg_num].string.strip(),
-                    "departure_time": departure_time,
-                    "arrival_time": arrival_time,
-                    "arrival_day": arrival_day,
-                    "duration": find_duration(leg_info_raw),
-                    "transfer": transfer,
-                })
-            return leg_info
-
-        def get_fares(element):
-            fares = element.find_all("table", "ffam-price-container")
-            # It would be nice to include the names of the fares, but that would have to be parsed
-            # elsewhere.  Plus, points pages do not have the fare names header.
-            text_fares = []
-            for fare in fares:
-                text_fares.append(fare.find("span", "radio-button__text").string)
-            return text_fares
-
-        def get_minimum_fare_value_attribute(element):
-            fares = element.find_all("table", "ffam-price-container")
-            # It would be nice to include the names of the fares, but that would have to be parsed
-            # elsewhere.  Plus, points pages do not have the fare names header.
-            minimum_fare_value_attribute = None
-            for fare in fares:
-                if fare.find("span", "radio-button__text").string:
-                    minimum_fare_value_attribute = fare.find("input").attrs["value"]
-                    break
-            return minimum_fare_value_attribute
-
-        def get_add_to_cart_button_name_attribute(element):
-            addtocartbutton = element.find("input", "addtocart")
-            if addtocartbutton:
-                return addtocartbutton.attrs["name"]
-            return ""
-
-        results = []
-        for raw_result in raw_results:
-            results.append(AmtrakResult(
-                total_travel_time=get_total_travel_time(raw_result),
-                legs=get_legs(raw_result),
-                fares=get_fares(raw_result),
-                minimum_fare_value_attribute=get_minimum_fare_value_attribute(raw_result),
-                add_to_cart_button_name_attribute=
-                get_add_to_cart_button_name_attribute(raw_result),
-                result_id=raw_result.attrs["id"]
-                ))
-
-        return cls(results)
-
-    def get_by_train_name(self):
-        """
-        Get a specific result by train name.
+    def train_index(self):
         """
-        return self.results
+        Returns a map from every train name and train number on the page to the positions of the
+        results that include it, in order.  It is built on first use.
+        """
+        # pylint: disable=attribute-defined-outside-init
+        if self._train_index is None or self._train_index[0] != len(self.results):
+            index = {}
+            for position, result in enumerate(self.results):
+                for leg in result.legs:
+                    for key in {leg.train_name, train_number(leg.train_name)} - {None}:
+                        positions = index.setdefault(key, [])
+                        if not positions or positions[-1] != position:
+                            positions.append(position)
+            self._train_index = (len(self.results), index)
+        return self._train_index[1]
+
+    def get_by_train_name(self, name):
+        """
+        Returns the first result that includes the named train, given as its full name like
+        "5 California Zephyr" or just its number, or None if there is none.
+        """
+        positions = self.train_index().get(name)
+        return self.results[positions[0]] if positions else None
 
     def pretty_print(self):
         """
-        Pretty prints the results to the terminal.
+        Pretty prints the results to the terminal, one write per result, so that no more than one
+        result's text is held at a time.
         """
         for result in self.results:
-            result.pretty_print()
+            sys.stdout.write(result.format())
         return True
 
+    def cheapest_fare(self):
+        """
+        Returns the lowest available fare of any result as a number, or None if there are none.
+        """
+        values = [value for value in (result.cheapest_fare() for result in self.results)
+                  if value is not None]
+        return min(values) if values else None
+
+    def to_columns(self):
+        """
+        Returns the results as a dict of columns, for holding many results compactly or handing
+        them to numpy or Arrow without copying.  Per result columns have one value per result, per
+        leg and per fare columns have one value per leg or fare of every result in order, and
+        leg_offsets and fare_offsets say where each result's legs and fares start.  Numbers are
+        array.array buffers with MISSING for missing values, fares are in cents or points, and
+        durations are in minutes.
+        """
+        legs = [leg for result in self.results for leg in result.legs]
+        fares = [fare for result in self.results for fare in result.parsed_fares]
+        leg_offsets = array.array("q", [0])
+        fare_offsets = array.array("q", [0])
+        for result in self.results:
+            leg_offsets.append(leg_offsets[-1] + len(result.legs))
+            fare_offsets.append(fare_offsets[-1] + len(result.parsed_fares))
+        return {
+            "result_id": StringColumn.from_strings(result.result_id for result in self.results),
+            "total_minutes": array.array("q", (_number(result.total_minutes)
+                                               for result in self.results)),
+            "cheapest_amount": array.array("q", (
+                _number(result.cheapest().amount if result.cheapest() else None)
+                for result in self.results)),
+            "leg_offsets": leg_offsets,
+            "train_name": StringColumn.from_strings(leg.train_name for leg in legs),
+            "departure_time": StringColumn.from_strings(leg.departure_time for leg in legs),
+            "arrival_time": StringColumn.from_strings(leg.arrival_time for leg in legs),
+            "arrival_day": StringColumn.from_strings(leg.arrival_day for leg in legs),
+            "leg_minutes": array.array("q", (_number(leg.minutes) for leg in legs)),
+            "transfer_station": StringColumn.from_strings(
+                leg.transfer.station if leg.transfer else None for leg in legs),
+            "transfer_minutes": array.array("q", (
+                _number(leg.transfer.minutes if leg.transfer else None) for leg in legs)),
+            "fare_offsets": fare_offsets,
+            "fare_amount": array.array("q", (_number(fare.amount) for fare in fares)),
+        }
+
     def get_all(self):
         """
         Get all results in a list.
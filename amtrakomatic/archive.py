@@ -0,0 +1,162 @@
+"""
+A compressed, append-only archive of raw results pages, for keeping captures around for later
+analysis without keeping every page as a separate uncompressed file.
+
+Pages are appended to segment files as separate gzip members, and every page gets a line in a
+JSON lines index saying where it is, so any page can be read back without decompressing anything
+else.
+"""
+
+import gzip
+import json
+import os
+import re
+import threading
+import time
+import typing
+import zlib
+import attr
+from amtrakomatic import amtrak_results
+from amtrakomatic import fuzzy_match
+
+INDEX_FILENAME = "index.jsonl"
+SEGMENT_FILENAME = "segment-%06d.gz"
+DEFAULT_SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+
+# What reading back a page from a missing, truncated or corrupted file raises.
+READ_ERRORS = (OSError, EOFError, zlib.error)
+
+# What get_search_results used to name its dumps: <src>_<dst>_<MM>_<DD>_<YYYY>_<points>_<page>.html
+DUMP_FILENAME = re.compile(
+    r"^(?P<source>.+)_(?P<destination>[^_]+)_(?P<month>\d\d)_(?P<day>\d\d)_(?P<year>\d{4})_"
+    r"(?P<use_points>True|False)_(?P<page>\d+)\.html$")
+
+# pylint: disable=too-few-public-methods
+@attr.s(auto_attribs=True, frozen=True)
+class ArchiveEntry:
+    """
+    Where one page of one search is in the archive.  Stations are codes, and page is 0 for a search
+    with a single page.
+    """
+    source: str
+    destination: str
+    date: str
+    use_points: bool
+    page: int
+    fetched_at: float
+    segment: int
+    offset: int
+    length: int
+
+def read_page(directory, entry):
+    """
+    Returns the html of the page for an entry of the archive in directory, without loading the
+    archive's index.
+    """
+    with open(os.path.join(directory, SEGMENT_FILENAME % entry.segment), "rb") as segment:
+        segment.seek(entry.offset)
+        return gzip.decompress(segment.read(entry.length)).decode("utf-8")
+
+class PageArchive:
+    """
+    An archive of pages in a directory.  Appending from several threads is safe, appending from
+    several processes is not.
+    """
+
+    def __init__(self, directory, segment_max_bytes=DEFAULT_SEGMENT_MAX_BYTES):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._entries = []
+        index_path = os.path.join(directory, INDEX_FILENAME)
+        if os.path.exists(index_path):
+            with open(index_path) as index:
+                self._entries = [ArchiveEntry(**json.loads(line)) for line in index if line.strip()]
+        self._segment = max((entry.segment for entry in self._entries), default=1)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, SEGMENT_FILENAME % segment)
+
+    # pylint: disable=too-many-arguments,too-many-locals
+    def add(self, source, destination, date, use_points, page, html, fetched_at=None):
+        """
+        Appends one page of a search to the archive, returning its entry.
+        """
+        (_, source_code), (_, destination_code) = fuzzy_match.stations([source, destination])
+        body = gzip.compress(html.encode("utf-8"))
+        with self._lock:
+            segment_path = self._segment_path(self._segment)
+            if (os.path.exists(segment_path) and
+                    os.path.getsize(segment_path) + len(body) > self.segment_max_bytes):
+                self._segment = self._segment + 1
+                segment_path = self._segment_path(self._segment)
+            with open(segment_path, "ab") as segment:
+                offset = segment.tell()
+                segment.write(body)
+            entry = ArchiveEntry(source=source_code, destination=destination_code, date=date,
+                                 use_points=use_points, page=page,
+                                 fetched_at=time.time() if fetched_at is None else fetched_at,
+                                 segment=self._segment, offset=offset, length=len(body))
+            # The index is written after the page, so a crash never indexes a partial page.
+            with open(os.path.join(self.directory, INDEX_FILENAME), "a") as index:
+                index.write(json.dumps(attr.asdict(entry)) + "\n")
+            self._entries.append(entry)
+        return entry
+
+    def add_dump(self, path):
+        """
+        Archives a page dumped by older versions of get_search_results, using its file name for the
+        search and its modification time for when it was fetched.
+        """
+        match = DUMP_FILENAME.match(os.path.basename(path))
+        if not match:
+            raise ValueError("Not a dumped results page: %s" % path)
+        with open(path) as dump:
+            html = dump.read()
+        return self.add(match.group("source"), match.group("destination"),
+                        "%s/%s/%s" % (match.group("month"), match.group("day"),
+                                      match.group("year")),
+                        match.group("use_points") == "True", int(match.group("page")), html,
+                        os.path.getmtime(path))
+
+    # pylint: disable=too-many-arguments
+    def entries(self, source=None, destination=None, date=None, use_points=None) \
+            -> typing.List[ArchiveEntry]:
+        """
+        Returns the entries for every page matching the given search, in the order they were
+        added.  Stations can be given as any name fuzzy_match understands.
+        """
+        codes = {}
+        for name, station_name in [("source", source), ("destination", destination)]:
+            if station_name is not None:
+                codes[name] = fuzzy_match.station(station_name)[1]
+        with self._lock:
+            entries = list(self._entries)
+        return [entry for entry in entries
+                if codes.get("source", entry.source) == entry.source
+                and codes.get("destination", entry.destination) == entry.destination
+                and date in (None, entry.date)
+                and use_points in (None, entry.use_points)]
+
+    def read(self, entry):
+        """
+        Returns the html of the page for an entry.
+        """
+        return read_page(self.directory, entry)
+
+    def iter_pages(self, **search):
+        """
+        Yields (entry, html) for every page matching the search given as keyword arguments to
+        entries, one page in memory at a time.
+        """
+        for entry in self.entries(**search):
+            yield entry, self.read(entry)
+
+    def iter_results(self, **search):
+        """
+        Yields (entry, AmtrakResults) for every page matching the search given as keyword arguments
+        to entries.
+        """
+        for entry, html in self.iter_pages(**search):
+            yield entry, amtrak_results.AmtrakResults.from_html(html)
@@ -0,0 +1,132 @@
+"""
+A checkpoint journal for CSV batch runs, so that a run that dies part way through can be started
+again and only price the trips it had not finished, and retrying with backoff for trips that fail
+for a passing reason like a slow page.
+"""
+
+import json
+import logging
+import time
+import attr
+from amtrakomatic import amtrak_results
+from amtrakomatic import metrics
+from amtrakomatic import sqlite_store
+
+DEFAULT_RETRIES = 2
+# Seconds to wait before the first retry of a trip, doubling for every retry after that.
+DEFAULT_BACKOFF = 5
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS trips (
+        row INTEGER PRIMARY KEY,
+        trip TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        ticket TEXT,
+        price TEXT,
+        dollars REAL NOT NULL,
+        points INTEGER NOT NULL,
+        error TEXT,
+        updated_at REAL NOT NULL)""",
+]
+
+DONE = "done"
+FAILED = "failed"
+
+# pylint: disable=too-few-public-methods
+@attr.s(auto_attribs=True, frozen=True)
+class JournalEntry:
+    """
+    A trip the journal says was priced, with the ticket and price it got.
+    """
+    ticket: amtrak_results.AmtrakResult
+    price: str
+    attempts: int
+
+class BatchJournal(sqlite_store.SqliteStore):
+    """
+    The outcome of every row of a CSV batch run, kept in SQLite at path.  A row only counts as
+    done for the same trip, so a journal reused after the CSV has been edited prices the changed
+    rows again.  Use ":memory:" for a run that does not need to be resumed.
+    """
+
+    def __init__(self, path, clock=time.time):
+        super().__init__(path, SCHEMA)
+        self.clock = clock
+
+    def done(self, row, trip):
+        """
+        Returns the JournalEntry for row if it was priced for this trip, otherwise None.
+        """
+        with self._lock:
+            found = self._connection.execute(
+                "SELECT ticket, price, attempts FROM trips WHERE row = ? AND trip = ? AND "
+                "status = ?", (row, json.dumps(trip), DONE)).fetchone()
+        if found is None:
+            return None
+        return JournalEntry(amtrak_results.AmtrakResult(**json.loads(found[0])), found[1],
+                            found[2])
+
+    # pylint: disable=too-many-arguments
+    def record_done(self, row, trip, ticket, price, cost, attempts=1):
+        """
+        Records that row was priced, with its cost as a (dollars, points) tuple.
+        """
+        dollars, points = cost
+        self._record(row, trip, DONE, attempts, json.dumps(attr.asdict(ticket)), price, dollars,
+                     points, None)
+
+    def record_failed(self, row, trip, error, attempts=1):
+        """
+        Records that pricing row failed with error, so it is tried again when the run resumes.
+        """
+        self._record(row, trip, FAILED, attempts, None, None, 0, 0,
+                     "%s: %s" % (type(error).__name__, error))
+
+    def _record(self, row, trip, *outcome):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO trips VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (row, json.dumps(trip)) + outcome + (self.clock(),))
+
+    def failures(self, rows):
+        """
+        Returns (row, error) for every one of the first rows rows whose last attempt failed.
+        """
+        with self._lock:
+            return self._connection.execute(
+                "SELECT row, error FROM trips WHERE row < ? AND status = ? ORDER BY row",
+                (rows, FAILED)).fetchall()
+
+    def totals(self, rows):
+        """
+        Returns the total cost of the priced trips among the first rows rows, as a (dollars,
+        points) tuple.  These come from the journal, so they include trips priced by earlier runs.
+        """
+        with self._lock:
+            dollars, points = self._connection.execute(
+                "SELECT COALESCE(SUM(dollars), 0), COALESCE(SUM(points), 0) FROM trips "
+                "WHERE row < ? AND status = ?", (rows, DONE)).fetchone()
+        return dollars, points
+
+def with_retries(function, errors, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 sleep=time.sleep):
+    """
+    Calls function, calling it again up to retries more times if it raises one of the exception
+    types in errors, waiting backoff seconds before the first retry and twice as long before each
+    one after that.  Returns (result, attempts), or raises what the last attempt raised.  Other
+    exceptions are raised straight away.
+    """
+    attempt = 1
+    while True:
+        try:
+            return function(), attempt
+        except errors as exception:
+            if attempt > retries:
+                raise
+            delay = backoff * 2 ** (attempt - 1)
+            logging.warning("Attempt %s failed with %r, retrying in %ss", attempt, exception,
+                            delay)
+            metrics.count("retries")
+            sleep(delay)
+            attempt = attempt + 1
@@ -0,0 +1,259 @@
+"""
+Benchmarks for the code that runs once per page or once per search, with saved baselines so that
+regressions can fail CI.
+"""
+
+import contextlib
+import gc
+import glob
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import typing
+import attr
+from amtrakomatic import amtrak_results
+from amtrakomatic import fuzzy_match
+
+DEFAULT_PAGES = os.path.join("tests", "test_data", "*.html")
+
+# The station names we use in the fuzzy match tests, which are a fair sample of what people type.
+STATION_QUERIES = [
+    "New York", "Boston", "Vermont", "Harrisburg", "Kansas City", "Denver", "Salt Lake City",
+    "Sacramento", "Seattle", "Chico", "San Jose", "Los Angeles", "New Mexico", "Houston",
+    "Washington DC",
+]
+
+IMPORT_MODULES = ["amtrakomatic.cli", "amtrakomatic.scrape_amtrak"]
+
+# Benchmarks quicker than this fraction of the reference workload vary too much from run to run to
+# check their time, so only their memory is checked.
+MIN_RELATIVE_TIME = 0.1
+
+# Python's free lists keep a few blocks alive from one run to the next, depending on which library
+# code last freed them, so a benchmark may hold on to this many more blocks without a regression.
+BLOCK_SLACK = 2
+
+# How many times the reference workload is timed before each timed run of a benchmark.
+REFERENCE_RUNS = 3
+
+
+# pylint: disable=too-few-public-methods
+@attr.s(auto_attribs=True)
+class Measurement:
+    """
+    The cost of a single benchmark.  Wall time is the median over all runs, memory is measured on
+    a separate traced run so tracing does not skew the timings.  Wall times depend on the machine,
+    so regressions in time are found with relative_time instead: the fastest run divided by the
+    fastest run of a reference workload timed alongside it, or 0 if it was not measured.
+    """
+    name: str
+    wall_seconds: float
+    peak_kib: float = 0.0
+    allocated_blocks: int = 0
+    relative_time: float = 0.0
+
+
+def reference_workload():
+    """
+    A fixed amount of plain Python work, building and sorting strings and small dicts much like
+    parsing does, to time the other benchmarks against.
+    """
+    words = ["%s-%s" % (number, number * 7) for number in range(20000)]
+    return sorted({word.upper(): len(word) for word in words}.items())
+
+
+def time_runs(function, repeat):
+    """
+    Returns how long each of repeat runs of function took, in seconds.  Like timeit, the garbage
+    collector is off while timing, since when it happens to run varies from run to run.
+    """
+    timings = []
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+    finally:
+        if collecting:
+            gc.enable()
+    return timings
+
+
+def measure(name, function, repeat=3, reference=None):
+    """
+    Times function over repeat runs, then runs it once more under tracemalloc to get the peak
+    memory and the number of memory blocks still allocated when it returns, which is what its
+    result costs to keep around.  Given a reference workload, also records the time relative to
+    it, timing the reference a few times before each run so that both are timed while the machine
+    is equally busy.
+    """
+    timings = []
+    reference_timings = []
+    for _ in range(repeat):
+        if reference is not None:
+            reference_timings.extend(time_runs(reference, REFERENCE_RUNS))
+        timings.extend(time_runs(function, 1))
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = function()
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    allocated_blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename")
+                           if stat.count_diff > 0)
+    return Measurement(name=name, wall_seconds=statistics.median(timings),
+                       peak_kib=peak / 1024, allocated_blocks=allocated_blocks,
+                       relative_time=(min(timings) / min(reference_timings)
+                                      if reference_timings else 0.0))
+
+
+# Imports the module under tracemalloc and prints what importing it allocated.
+IMPORT_MEMORY_PROBE = """
+import json, tracemalloc
+tracemalloc.start()
+before = tracemalloc.take_snapshot()
+import %s
+after = tracemalloc.take_snapshot()
+_, peak = tracemalloc.get_traced_memory()
+print(json.dumps([peak, sum(stat.count_diff for stat in after.compare_to(before, "filename")
+                            if stat.count_diff > 0)]))
+"""
+
+
+def measure_import(module, repeat=3):
+    """
+    Times importing module in a fresh interpreter, minus the cost of starting the interpreter, and
+    measures what the import allocates in one more traced interpreter.  Start up time is too noisy
+    to compare with a reference, so only the memory of an import is checked for regressions, which
+    grows with every module it pulls in.
+    """
+
+    def run(code):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        return time.perf_counter() - start
+
+    timings = []
+    for _ in range(repeat):
+        timings.append(run("import %s" % module) - run("pass"))
+    peak, allocated_blocks = json.loads(subprocess.run(
+        [sys.executable, "-c", IMPORT_MEMORY_PROBE % module], check=True, capture_output=True,
+        text=True).stdout)
+    return Measurement(name="import:%s" % module,
+                       wall_seconds=max(statistics.median(timings), 0.0),
+                       peak_kib=peak / 1024, allocated_blocks=allocated_blocks)
+
+
+def run_benchmarks(pages=DEFAULT_PAGES, repeat=3):
+    """
+    Runs every benchmark over the pages matching the given glob, returning a list of
+    Measurements.
+    """
+    measurements = []
+    for page in sorted(glob.glob(pages)):
+        page_name = os.path.splitext(os.path.basename(page))[0]
+        with open(page) as page_file:
+            html = page_file.read()
+        measurements.append(measure(
+            "parse:%s" % page_name,
+            lambda html=html: amtrak_results.AmtrakResults.from_html(html),
+            repeat, reference=reference_workload))
+        results = amtrak_results.AmtrakResults.from_html(html)
+
+        def pretty_print(results=results):
+            with contextlib.redirect_stdout(io.StringIO()):
+                results.pretty_print()
+        measurements.append(measure("pretty_print:%s" % page_name, pretty_print, repeat,
+                                    reference=reference_workload))
+
+    def match_stations():
+        return [fuzzy_match.station(name) for name in STATION_QUERIES]
+    # The first lookup also pays for loading the station table, so keep it out of the timings.
+    match_stations()
+    measurements.append(measure("station_match", match_stations, repeat,
+                                reference=reference_workload))
+
+    def nearby_stations():
+        return [fuzzy_match.stations_within(station_info["latitude"], station_info["longitude"],
+                                            100)
+                for station_info in fuzzy_match.amtrak_stations().values()
+                if station_info["latitude"] is not None]
+    measurements.append(measure("station_nearby", nearby_stations, repeat,
+                                reference=reference_workload))
+    for module in IMPORT_MODULES:
+        measurements.append(measure_import(module, repeat))
+    return measurements
+
+
+def save_baseline(measurements, filename):
+    """
+    Saves measurements as a JSON baseline keyed by benchmark name.
+    """
+    with open(filename, "w") as baseline_file:
+        json.dump({measurement.name: attr.asdict(measurement) for measurement in measurements},
+                  baseline_file, indent=2, sort_keys=True)
+
+
+def load_baseline(filename):
+    """
+    Loads a baseline saved by save_baseline into a map of benchmark name to Measurement.
+    """
+    with open(filename) as baseline_file:
+        return {name: Measurement(**values) for name, values in json.load(baseline_file).items()}
+
+
+def find_regressions(measurements, baseline, time_tolerance=0.5, memory_tolerance=0.1) \
+        -> typing.List[str]:
+    """
+    Compares measurements against a baseline and returns a description of every metric that got
+    worse by more than the given fraction.  Times are compared relative to the reference workload,
+    never in seconds, so a baseline saved on one machine holds on another, and only for benchmarks
+    that take at least MIN_RELATIVE_TIME of it.  Allocated blocks may also grow by BLOCK_SLACK.
+    Benchmarks missing from the baseline are reported, so that a new benchmark is not silently
+    left unchecked.
+    """
+    regressions = []
+    for measurement in measurements:
+        expected = baseline.get(measurement.name)
+        if not expected:
+            regressions.append("%s is missing from the baseline" % measurement.name)
+            continue
+        for metric, tolerance in [("relative_time", time_tolerance),
+                                  ("peak_kib", memory_tolerance),
+                                  ("allocated_blocks", memory_tolerance)]:
+            current = getattr(measurement, metric)
+            allowed = getattr(expected, metric) * (1 + tolerance)
+            if metric == "allocated_blocks":
+                allowed = max(allowed, expected.allocated_blocks + BLOCK_SLACK)
+            if metric == "relative_time" and expected.relative_time < MIN_RELATIVE_TIME:
+                continue
+            if current > allowed:
+                regressions.append("%s %s: %s > %s" % (
+                    measurement.name, metric, round(current, 4), round(allowed, 4)))
+    return regressions
+
+
+def print_measurements(measurements):
+    """
+    Prints measurements as a table.
+    """
+    print("%-50s %12s %12s %12s %12s" % ("benchmark", "wall (ms)", "relative", "peak (KiB)",
+                                         "blocks"))
+    for measurement in measurements:
+        print("%-50s %12.1f %12.2f %12.1f %12d" % (
+            measurement.name,
+            measurement.wall_seconds * 1000,
+            measurement.relative_time,
+            measurement.peak_kib,
+            measurement.allocated_blocks,
+            ))
@@ -0,0 +1,181 @@
+"""
+An on-disk cache of search results, so that a route searched recently by any script is not
+searched again on the live site.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import time
+import zlib
+import attr
+from amtrakomatic import amtrak_results
+from amtrakomatic import fuzzy_match
+from amtrakomatic import sqlite_store
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "amtrakomatic",
+                                  "results.sqlite")
+DEFAULT_TTL = 60 * 60
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+SCHEMA = [
+    # Raw pages are stored once per distinct content, however many entries refer to them.
+    """CREATE TABLE IF NOT EXISTS pages (
+        digest TEXT PRIMARY KEY,
+        body BLOB NOT NULL,
+        size INTEGER NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        digests TEXT NOT NULL,
+        results BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        fetched_at REAL NOT NULL,
+        accessed_at REAL NOT NULL)""",
+    "CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)",
+]
+
+def _compress(text):
+    return zlib.compress(text.encode("utf-8"))
+
+def _decompress(blob):
+    return zlib.decompress(blob).decode("utf-8")
+
+class ResultCache(sqlite_store.SqliteStore):
+    """
+    Parsed results and the raw pages they came from, keyed by station codes, date and whether the
+    search was for points.  Entries expire ttl seconds after they were fetched, and the least
+    recently used ones are evicted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES,
+                 clock=time.time):
+        super().__init__(path, SCHEMA)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+
+    @staticmethod
+    def key(source, destination, date, use_points):
+        """
+        Returns the cache key for a search.  Stations are matched to their codes first, so that
+        any spelling of a station finds the same entry.
+        """
+        (_, source_code), (_, destination_code) = fuzzy_match.stations([source, destination])
+        return "%s|%s|%s|%s" % (source_code, destination_code, date,
+                                "points" if use_points else "dollars")
+
+    def get(self, source, destination, date, use_points):
+        """
+        Returns the cached AmtrakResults for a search, or None if there are none or they have
+        expired.
+        """
+        key = self.key(source, destination, date, use_points)
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT results, fetched_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] + self.ttl < self.clock():
+                self._connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            self._connection.execute("UPDATE entries SET accessed_at = ? WHERE key = ?",
+                                     (self.clock(), key))
+        return amtrak_results.AmtrakResults([amtrak_results.AmtrakResult(**result)
+                                             for result in json.loads(_decompress(row[0]))])
+
+    def get_pages(self, source, destination, date, use_points):
+        """
+        Returns the raw pages cached for a search, in page order, or None if there are none.
+        """
+        key = self.key(source, destination, date, use_points)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT digests FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            pages = []
+            for digest in json.loads(row[0]):
+                pages.append(_decompress(self._connection.execute(
+                    "SELECT body FROM pages WHERE digest = ?", (digest,)).fetchone()[0]))
+        return pages
+
+    # pylint: disable=too-many-arguments
+    def put(self, source, destination, date, use_points, results, pages=()):
+        """
+        Caches the results of a search along with the raw pages they were parsed from.
+        """
+        key = self.key(source, destination, date, use_points)
+        blob = _compress(json.dumps([attr.asdict(result) for result in results.results]))
+        digests = []
+        now = self.clock()
+        with self._lock, self._connection:
+            for page in pages:
+                digest = hashlib.sha256(page.encode("utf-8")).hexdigest()
+                digests.append(digest)
+                if not self._connection.execute(
+                        "SELECT 1 FROM pages WHERE digest = ?", (digest,)).fetchone():
+                    body = _compress(page)
+                    self._connection.execute("INSERT INTO pages VALUES (?, ?, ?)",
+                                             (digest, body, len(body)))
+            self._connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                                     (key, json.dumps(digests), blob, len(blob), now, now))
+            self._evict()
+
+    def size(self):
+        """
+        Returns how many bytes of compressed results and pages are stored.
+        """
+        with self._lock:
+            return self._size()
+
+    def _size(self):
+        return sum(self._connection.execute(
+            "SELECT (SELECT COALESCE(SUM(size), 0) FROM entries),"
+            " (SELECT COALESCE(SUM(size), 0) FROM pages)").fetchone())
+
+    def _delete_orphaned_pages(self):
+        referenced = set()
+        for (digests,) in self._connection.execute("SELECT digests FROM entries"):
+            referenced.update(json.loads(digests))
+        self._connection.executemany(
+            "DELETE FROM pages WHERE digest = ?",
+            [(digest,) for (digest,) in self._connection.execute("SELECT digest FROM pages")
+             if digest not in referenced])
+
+    def _least_recently_used(self, excess):
+        # The keys of the least recently used entries that free at least excess bytes between
+        # them, counting a page only once no entry that is kept refers to it.
+        entries = [(key, set(json.loads(digests)), size) for key, digests, size in
+                   self._connection.execute(
+                       "SELECT key, digests, size FROM entries ORDER BY accessed_at")]
+        references = collections.Counter()
+        for _, digests, _ in entries:
+            references.update(digests)
+        page_sizes = dict(self._connection.execute("SELECT digest, size FROM pages"))
+        # Pages left behind by entries that expired on a get go anyway.
+        excess = excess - sum(size for digest, size in page_sizes.items()
+                              if not references[digest])
+        keys = []
+        for key, digests, size in entries:
+            if excess <= 0:
+                break
+            keys.append((key,))
+            excess = excess - size
+            for digest in digests:
+                references[digest] = references[digest] - 1
+                if not references[digest]:
+                    excess = excess - page_sizes[digest]
+        return keys
+
+    def _evict(self):
+        evicted = self._connection.execute("DELETE FROM entries WHERE fetched_at + ? < ?",
+                                           (self.ttl, self.clock())).rowcount
+        excess = self._size() - self.max_bytes
+        if excess > 0:
+            keys = self._least_recently_used(excess)
+            self._connection.executemany("DELETE FROM entries WHERE key = ?", keys)
+            evicted = evicted + len(keys)
+        # Once for everything evicted, since it reads every entry.
+        if evicted or excess > 0:
+            self._delete_orphaned_pages()
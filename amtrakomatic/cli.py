@@ -2,29 +2,567 @@
 Library to automate reading and getting to the purchase page for Amtrak tickets
 """
 
+import contextlib
+import sys
 import click
-from amtrakomatic import scrape_amtrak
 
-@click.command()
+# Everything else is imported where it is used, so that commands like --help start quickly.
+# pylint: disable=import-outside-toplevel
+
+def open_cache(enabled, path=None, ttl=None):
+    """
+    Opens the result cache, or does nothing if it is not enabled.
+    """
+    if not enabled:
+        return contextlib.nullcontext()
+    from amtrakomatic import cache
+    return cache.ResultCache(path or cache.DEFAULT_CACHE_PATH,
+                             cache.DEFAULT_TTL if ttl is None else ttl)
+
+def open_history(path):
+    """
+    Opens the fare history at path, or does nothing if no path is given.
+    """
+    if not path:
+        return contextlib.nullcontext()
+    from amtrakomatic import history
+    return history.FareHistory(path)
+
+@contextlib.contextmanager
+def record_metrics(profile, metrics_file):
+    """
+    Prints a breakdown of where the time went when the with block ends if profile is set, and
+    writes the metrics to metrics_file if given: as a Prometheus text file if it ends in .prom,
+    one JSON line per span as they finish if it ends in .jsonl, and as JSON otherwise.
+    """
+    if not profile and not metrics_file:
+        yield
+        return
+    from amtrakomatic import metrics
+    with contextlib.ExitStack() as stack:
+        if metrics_file and metrics_file.endswith(".jsonl"):
+            hook = metrics.json_lines_hook(stack.enter_context(open(metrics_file, "w")))
+            metrics.REGISTRY.add_hook(hook)
+            stack.callback(metrics.REGISTRY.remove_hook, hook)
+        try:
+            yield
+        finally:
+            snapshot = metrics.REGISTRY.snapshot()
+            if metrics_file and not metrics_file.endswith(".jsonl"):
+                metrics.write_snapshot(metrics_file, snapshot)
+            if profile:
+                click.echo(metrics.format_breakdown(snapshot), err=True)
+
+@click.group(invoke_without_command=True)
 @click.option('--source', default=None, help='Source station.')
 @click.option('--destination', default=None, help='Destination station.')
 @click.option('--date', default=None, help='Date string.')
+@click.option('--date-from', default=None, help='First date of a range of dates to search.')
+@click.option('--date-to', default=None, help='Last date of a range of dates to search.')
+@click.option('--via', multiple=True,
+              help='Also price stopping here, or at several comma separated stations in order, '
+              'on separate tickets.  Can be given more than once.')
 @click.option('--csv', default=None, help='CSV with searches.')
 @click.option('--interactive/--no-interactive', default=False,
               help='Whether to pause after each csv search.')
+@click.option('--journal', default=None,
+              help='Record each csv trip here as it is priced, and skip the trips it has already '
+              'priced, so that a run that stopped can be resumed.')
+@click.option('--retries', default=2, help='How many more times to try a csv trip that fails.')
 @click.option('--use-points/--no-use-points', default=False)
-# pylint: disable=too-many-arguments
-def amtrak_search(source, destination, date, csv, interactive, use_points):
+@click.option('--headless/--no-headless', default=False, help='Run the browser without a window.')
+@click.option('--backend', default='browser', type=click.Choice(['browser', 'http']),
+              help='Search in a browser, or by posting the search form over HTTP.  CSV trips '
+              'always use a browser.')
+@click.option('--jobs', default=1, help='How many searches to run at once.')
+@click.option('--cache/--no-cache', default=False,
+              help='Reuse recent results for the same search, and save new ones.')
+@click.option('--refresh', is_flag=True, default=False,
+              help='Search again even if cached, and save the new results to the cache.')
+@click.option('--cache-path', default=None, help='Where to keep the cache.')
+@click.option('--cache-ttl', default=None, type=int, help='How many seconds results stay cached.')
+@click.option('--archive', default=None, help='Directory to archive every results page in.')
+@click.option('--history', default=None,
+              help='Fare history database to record every result searched in.')
+@click.option('--format', 'output_format', default='table',
+              type=click.Choice(['table', 'json', 'ndjson', 'csv']),
+              help='Write results and csv trips as text, a JSON array, a JSON line each or CSV.')
+@click.option('--output', default='-', type=click.File('w'),
+              help='File to write results to, stdout by default.')
+@click.option('--profile', is_flag=True, default=False,
+              help='Print how long each stage took at the end.')
+@click.option('--metrics-file', default=None,
+              help='Write timings and counters here, as Prometheus text if it ends in .prom, as '
+              'a JSON line per span if it ends in .jsonl, and as JSON otherwise.')
+@click.pass_context
+# pylint: disable=too-many-arguments,too-many-locals
+def amtrak_search(ctx, source, destination, date, date_from, date_to, via, csv, interactive,
+                  journal, retries, use_points, headless, backend, jobs, cache, refresh,
+                  cache_path, cache_ttl, archive, history, output_format, output, profile,
+                  metrics_file):
     """
     Can give you all results for a single search, or get you to the checkout page for a list of
     searches in a CSV.
     """
-    if source and destination and date:
-        scrape_amtrak.get_all_fares(source, destination, date, use_points).pretty_print()
+    if ctx.invoked_subcommand:
+        return
+    # Closed along with the click context, after the search has run.
+    ctx.with_resource(record_metrics(profile, metrics_file))
+    from amtrakomatic import output as result_output
+    from amtrakomatic import scrape_amtrak
+    page_archive = None
+    if archive:
+        from amtrakomatic.archive import PageArchive
+        page_archive = PageArchive(archive)
+    if date_from and not (date or date_to or via):
+        # A range that starts on date_from without saying where it ends is just that day.
+        date_to = date_from
+    date_from = date_from or date
+    if source and destination and date_from and (date_to or via):
+        from amtrakomatic import sweep
+        if output_format != 'table':
+            raise click.UsageError('--format only applies to single searches and csv trips.')
+        plan = sweep.SweepPlan(sweep.date_range(date_from, date_to or date_from),
+                               sweep.plan_routings(source, destination, via))
+        with scrape_amtrak.new_driver_pool(size=jobs, headless=headless,
+                                           backend=backend) as pool, \
+                open_cache(cache or refresh, cache_path, cache_ttl) as result_cache, \
+                open_history(history) as fare_history:
+            sweep.print_sweep(sweep.run_sweep(plan, pool, use_points, jobs, result_cache, refresh,
+                                              page_archive, fare_history),
+                              use_points)
+    elif source and destination and date:
+        with scrape_amtrak.new_driver_pool(headless=headless, backend=backend) as pool, \
+                open_cache(cache or refresh, cache_path, cache_ttl) as result_cache, \
+                open_history(history) as fare_history:
+            with result_output.open_writer(output_format, output) as writer:
+                # Results are written as each page is parsed, and all at once if they came
+                # from the cache instead.
+                parser = result_output.StreamingParser(writer, result_output.search_record(
+                    source, destination, date, use_points))
+                results = scrape_amtrak.get_all_fares(source, destination, date, use_points,
+                                                      pool, result_cache, refresh, page_archive,
+                                                      parser=parser, history=fare_history)
+                if not parser.written:
+                    for result in results.results:
+                        writer.write_result(result, parser.search)
     elif csv:
-        scrape_amtrak.iterate_csv_trips(csv, interactive)
+        with scrape_amtrak.new_driver_pool(size=jobs, log_in=True, headless=headless) as pool, \
+                result_output.open_writer(output_format, output) as writer:
+            failed = scrape_amtrak.iterate_csv_trips(csv, interactive, pool, jobs, journal,
+                                                     retries, writer=writer)
+        if failed:
+            ctx.exit(1)
     else:
-        click.echo('Expected source, destination, and date to all be set, or csv to be set.')
+        click.echo('Expected source, destination, and date (or date-from) to all be set, or csv to '
+                   'be set.')
+
+@amtrak_search.command()
+@click.option('--pages', default=None, help='Glob of saved result pages to benchmark against.')
+@click.option('--repeat', default=3, help='How many times to run each benchmark.')
+@click.option('--save-baseline', default=None, help='Save the measurements as a baseline.')
+@click.option('--baseline', default=None, help='Fail if worse than this baseline.')
+@click.option('--time-tolerance', default=0.5,
+              help='Allowed fractional increase in wall time over the baseline.')
+@click.option('--memory-tolerance', default=0.1,
+              help='Allowed fractional increase in memory over the baseline.')
+# pylint: disable=too-many-arguments
+def bench(pages, repeat, save_baseline, baseline, time_tolerance, memory_tolerance):
+    """
+    Benchmarks parsing, station matching, printing and import time.
+    """
+    from amtrakomatic import benchmark
+    measurements = benchmark.run_benchmarks(pages or benchmark.DEFAULT_PAGES, repeat)
+    benchmark.print_measurements(measurements)
+    if save_baseline:
+        benchmark.save_baseline(measurements, save_baseline)
+    if baseline:
+        regressions = benchmark.find_regressions(
+            measurements, benchmark.load_baseline(baseline), time_tolerance, memory_tolerance)
+        for regression in regressions:
+            click.echo("Regression: %s" % regression, err=True)
+        if regressions:
+            sys.exit(1)
+
+@amtrak_search.command(name="import-dumps")
+@click.option('--archive', required=True, help='Directory of the archive to add the pages to.')
+@click.argument('dumps', nargs=-1, type=click.Path(exists=True, dir_okay=False))
+def import_dumps(archive, dumps):
+    """
+    Adds results pages dumped by older versions to an archive.
+    """
+    from amtrakomatic.archive import PageArchive
+    page_archive = PageArchive(archive)
+    for dump in dumps:
+        entry = page_archive.add_dump(dump)
+        click.echo("%s: %s to %s on %s, page %s" % (dump, entry.source, entry.destination,
+                                                  entry.date, entry.page))
+
+@amtrak_search.command()
+@click.argument('location')
+@click.option('--output', default='-', type=click.File('w'),
+              help='JSON lines file to write the results to, one line per page.')
+@click.option('--jobs', default=None, type=int, help='How many processes to parse with.')
+@click.option('--chunksize', default=None, type=int,
+              help='How many pages to hand a process at a time.')
+def reparse(location, output, jobs, chunksize):
+    """
+    Parses saved results pages again.  LOCATION is a page archive, a directory of dumped pages,
+    or a glob of pages.
+    """
+    from amtrakomatic import reparse as reparse_pages
+    page_sources = reparse_pages.find_pages(location)
+    with click.progressbar(length=len(page_sources), label="Parsing",
+                           file=sys.stderr) as progress_bar:
+        parsed, failed = reparse_pages.reparse(
+            page_sources, output, jobs, chunksize or reparse_pages.DEFAULT_CHUNKSIZE,
+            progress=lambda page_source, succeeded: progress_bar.update(1))
+    click.echo("Parsed %s pages, %s failed" % (parsed, failed), err=True)
+    if failed:
+        sys.exit(1)
+
+@amtrak_search.command()
+@click.option('--source', required=True, help='Source station.')
+@click.option('--destination', required=True, help='Destination station.')
+@click.option('--date', 'dates', multiple=True, required=True,
+              help='Date to watch.  Can be given more than once.')
+@click.option('--use-points/--no-use-points', default=False)
+@click.option('--interval', default=15 * 60, help='Seconds between polls.')
+@click.option('--jitter', default=60, help='Up to how many more seconds to wait between polls.')
+@click.option('--polls', default=None, type=int, help='Stop after this many polls.')
+@click.option('--headless/--no-headless', default=False, help='Run the browser without a window.')
+@click.option('--backend', default='browser', type=click.Choice(['browser', 'http']),
+              help='Search in a browser, or by posting the search form over HTTP.')
+@click.option('--history', default=None,
+              help='Fare history database to record every poll in.')
+# pylint: disable=too-many-arguments,too-many-locals
+def watch(source, destination, dates, use_points, interval, jitter, polls, headless, backend,
+          history):
+    """
+    Searches again every interval and prints only the trips and fares that changed.
+    """
+    from amtrakomatic import scrape_amtrak
+    from amtrakomatic import watch as watch_fares
+    searches = [watch_fares.Search(source, destination, date, use_points) for date in dates]
+    with scrape_amtrak.new_driver_pool(headless=headless, backend=backend) as pool, \
+            open_history(history) as fare_history:
+        watcher = watch_fares.Watcher(searches, pool, interval, jitter, history=fare_history)
+        watcher.run(lambda change: click.echo(str(change)), polls)
+
+@amtrak_search.command()
+@click.option('--source', required=True, help='Source station.')
+@click.option('--destination', required=True, help='Destination station.')
+@click.option('--date-from', required=True, help='First date to leave on.')
+@click.option('--date-to', default=None, help='Last date to leave on.')
+@click.option('--via', multiple=True,
+              help='A station the trip may stop at on separate tickets.  Can be given more than '
+              'once, and any of them can be used in any order.')
+@click.option('--via-radius', default=None, type=float,
+              help='Also try every station within this many kilometers of each via station.')
+@click.option('--objective', default='cheapest', type=click.Choice(['cheapest', 'fastest']))
+@click.option('--use-points/--no-use-points', default=False)
+@click.option('--point-value', default=None, type=float,
+              help='Dollars a point is worth.  If given, both dollars and points fares are '
+              'searched, and points are compared with dollars at this value.')
+@click.option('--min-connection', default=60,
+              help='Minutes to leave between separate tickets at a via station.')
+@click.option('--max-layover-days', default=1,
+              help='How many days after arriving at a via station to look for the next train.')
+@click.option('--limit', default=5, help='How many itineraries to show.')
+@click.option('--jobs', default=1, help='How many searches to run at once.')
+@click.option('--headless/--no-headless', default=False, help='Run the browser without a window.')
+@click.option('--backend', default='browser', type=click.Choice(['browser', 'http']),
+              help='Search in a browser, or by posting the search form over HTTP.')
+@click.option('--cache/--no-cache', default=False,
+              help='Reuse recent results for the same search, and save new ones.')
+# pylint: disable=too-many-arguments,too-many-locals
+def optimize(source, destination, date_from, date_to, via, via_radius, objective, use_points,
+             point_value, min_connection, max_layover_days, limit, jobs, headless, backend, cache):
+    """
+    Finds the cheapest or fastest itineraries, possibly on separate tickets through via stations.
+    """
+    import datetime
+    from amtrakomatic import optimize as optimizer
+    from amtrakomatic import scrape_amtrak
+    from amtrakomatic import sweep
+    if via_radius is not None:
+        from amtrakomatic import fuzzy_match
+        via = [name for station in via
+               for name, _, _ in fuzzy_match.stations_near(station, via_radius)]
+    with scrape_amtrak.new_driver_pool(size=jobs, headless=headless, backend=backend) as pool, \
+            open_cache(cache) as result_cache:
+        segment_fares = optimizer.SegmentFares(pool, jobs, result_cache)
+        itineraries = optimizer.Optimizer(
+            segment_fares, source, destination, sweep.date_range(date_from, date_to or date_from),
+            via, use_points, point_value, datetime.timedelta(minutes=min_connection),
+            max_layover_days).search(objective, limit)
+    optimizer.print_itineraries(itineraries, use_points and point_value is None)
+    click.echo("%s segments searched" % len(segment_fares.searched), err=True)
+
+@amtrak_search.command(name="history")
+@click.option('--path', default=None, help='Fare history database to query.')
+@click.option('--source', default=None, help='Source station.')
+@click.option('--destination', default=None, help='Destination station.')
+@click.option('--train', default=None,
+              help='Show how the fare for this train, by name or number, changed over time.')
+@click.option('--date', default=None, help='Only show the train on this travel date.')
+@click.option('--by-days-before', is_flag=True, default=False,
+              help='Show percentiles of the fare by how many days before the trip it was seen.')
+@click.option('--percentiles', default='10,50,90', help='Comma separated percentiles to show.')
+@click.option('--use-points/--no-use-points', default=False)
+# pylint: disable=too-many-arguments,too-many-locals
+def show_history(path, source, destination, train, date, by_days_before, percentiles,
+                 use_points):
+    """
+    Shows the lowest fare seen for each date of a route, how the fare for a train changed over
+    time, or fare percentiles by days before departure.
+    """
+    import datetime
+    from amtrakomatic import amtrak_results
+    from amtrakomatic import history
+    with history.FareHistory(path or history.DEFAULT_HISTORY_PATH) as fares:
+        if train:
+            for fetched_at, travel_date, fare in fares.train_trend(train, date, use_points):
+                click.echo("%-20s%-12s%s" % (
+                    datetime.datetime.fromtimestamp(fetched_at).strftime("%m/%d/%Y %H:%M"),
+                    travel_date, amtrak_results.format_fare_value(fare, use_points)))
+        elif not (source and destination):
+            click.echo('Expected source and destination, or train, to be set.')
+            sys.exit(1)
+        elif by_days_before:
+            wanted = [int(percentile) for percentile in percentiles.split(",")]
+            click.echo("%-12s%s" % ("Days before", "".join("%12s" % ("p%s" % percentile)
+                                                          for percentile in wanted)))
+            for days_before, values in sorted(fares.fare_percentiles(
+                    source, destination, wanted, use_points).items()):
+                click.echo("%-12s%s" % (days_before, "".join(
+                    "%12s" % amtrak_results.format_fare_value(value, use_points)
+                    for value in values)))
+        else:
+            for travel_date, fare in fares.min_fare_by_date(source, destination, use_points):
+                click.echo("%-12s%s" % (travel_date,
+                                        amtrak_results.format_fare_value(fare, use_points)))
+
+def standin_site(recordings, latency, latency_jitter, error_rate, seed):
+    """
+    Returns a stand-in site replaying the pages saved in recordings, with the given faults.
+    """
+    import random
+    from amtrakomatic import standin
+    return standin.StandInSite(standin.load_recordings(recordings),
+                               standin.Faults(latency, latency_jitter, error_rate),
+                               rng=random.Random(seed))
+
+def fault_options(command):
+    """
+    Adds the options for the faults a stand-in site adds to its answers.
+    """
+    for option in reversed([
+            click.option('--latency', default=0.0, help='Seconds to wait before every answer.'),
+            click.option('--latency-jitter', default=0.0,
+                         help='Up to how many more seconds to wait before every answer.'),
+            click.option('--error-rate', default=0.0,
+                         help='Fraction of answers that fail with a 503 instead.'),
+            click.option('--seed', default=None, type=int,
+                         help='Seed for the latency and errors, to repeat a run.')]):
+        command = option(command)
+    return command
+
+@amtrak_search.command(name="standin")
+@click.argument('recordings')
+@click.option('--host', default='127.0.0.1', help='Address to listen on.')
+@click.option('--port', default=8000, help='Port to listen on.')
+@fault_options
+# pylint: disable=too-many-arguments
+def serve_standin(recordings, host, port, latency, latency_jitter, error_rate, seed):
+    """
+    Serves a stand-in for the site that replays saved results pages.  RECORDINGS is a page
+    archive, a directory of dumped pages, or a glob of pages.  Set AMTRAKOMATIC_SITE_URL to its
+    URL to search it instead of the live site.
+    """
+    from amtrakomatic import standin
+    site = standin_site(recordings, latency, latency_jitter, error_rate, seed)
+    server = standin.make_server(site, host, port)
+    click.echo("Replaying %s searches at http://%s:%s" % (len(site.recordings), host,
+                                                          server.server_address[1]), err=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+@amtrak_search.command(name="loadtest")
+@click.argument('recordings')
+@click.option('--url', default=None,
+              help='Load test the stand-in already serving at this URL instead of starting one.')
+@click.option('--requests', 'request_count', default=100, help='How many searches to run.')
+@click.option('--concurrency', default=4, help='How many searches to run at once.')
+@click.option('--backend', default='http', type=click.Choice(['browser', 'http']),
+              help='Search in browsers, or by posting the search form over HTTP.')
+@click.option('--headless/--no-headless', default=False, help='Run the browsers without a window.')
+@click.option('--percentiles', default='50,90,99',
+              help='Comma separated percentiles of latency to show.')
+@fault_options
+# pylint: disable=too-many-arguments,too-many-locals
+def load_test(recordings, url, request_count, concurrency, backend, headless, percentiles,
+              latency, latency_jitter, error_rate, seed):
+    """
+    Runs the searches saved in RECORDINGS again and again, concurrency at a time, against a
+    stand-in for the site, and shows the throughput and latency percentiles.  RECORDINGS is a
+    page archive, a directory of dumped pages, or a glob of pages.
+    """
+    from amtrakomatic import loadtest
+    from amtrakomatic import scrape_amtrak
+    from amtrakomatic import standin
+    site = standin_site(recordings, latency, latency_jitter, error_rate, seed)
+    if not site.recordings:
+        click.echo('No saved searches found in %s' % recordings)
+        sys.exit(1)
+    with contextlib.ExitStack() as stack:
+        base_url = url or stack.enter_context(standin.serve(site))
+        stack.enter_context(standin.pointed_at(base_url))
+        pool = stack.enter_context(scrape_amtrak.new_driver_pool(
+            size=concurrency, headless=headless, backend=backend))
+        report = loadtest.run_load_test(pool, sorted(site.recordings), request_count,
+                                        concurrency)
+    click.echo(report.format([int(percentile) for percentile in percentiles.split(",")]),
+               nl=False)
+
+@amtrak_search.command()
+@click.option('--broker', default=None,
+              help='Queue to add the jobs to: a SQLite file, or a redis:// URL.')
+@click.option('--source', default=None, help='Source station.')
+@click.option('--destination', default=None, help='Destination station.')
+@click.option('--date', default=None, help='Date string.')
+@click.option('--date-from', default=None, help='First date of a range of dates to search.')
+@click.option('--date-to', default=None, help='Last date of a range of dates to search.')
+@click.option('--via', multiple=True,
+              help='Also search this routing, buying a ticket per segment.  A station, or a comma '
+              'separated list of stations.  Can be given more than once.')
+@click.option('--train', default=None,
+              help='Get to the checkout page for this train instead of searching.')
+@click.option('--csv', default=None, help='CSV with trips to get to the checkout page for.')
+@click.option('--use-points/--no-use-points', default=False)
+@click.option('--wait', is_flag=True, default=False,
+              help='Wait for the jobs to finish and write their results.')
+@click.option('--poll-interval', default=5.0, help='Seconds between checks on the jobs.')
+@click.option('--format', 'output_format', default='table',
+              type=click.Choice(['table', 'json', 'ndjson', 'csv']),
+              help='Write results and trips as text, a JSON array, a JSON line each or CSV.')
+@click.option('--output', default='-', type=click.File('w'),
+              help='File to write results to, stdout by default.')
+# pylint: disable=too-many-arguments,too-many-locals,too-many-branches
+def enqueue(broker, source, destination, date, date_from, date_to, via, train, csv, use_points,
+            wait, poll_interval, output_format, output):
+    """
+    Adds searches, or trips to get to the checkout page for, to a queue for workers to run.
+    """
+    from amtrakomatic import output as result_output
+    from amtrakomatic import scrape_amtrak
+    from amtrakomatic import sweep
+    from amtrakomatic import workqueue
+    date_from = date_from or date
+    if csv:
+        jobs = [workqueue.Job.create(trip[0], trip[1], trip[2], trip[4].strip() == "points",
+                                     trip[3]) for trip in scrape_amtrak.read_csv_trips(csv)]
+    elif source and destination and date_from:
+        dates = sweep.date_range(date_from, date_to or date_from)
+        if train:
+            jobs = [workqueue.Job.create(source, destination, day, use_points, train)
+                    for day in dates]
+        else:
+            searches, _ = sweep.SweepPlan(dates, sweep.plan_routings(source, destination,
+                                                                     via)).searches()
+            jobs = [workqueue.Job(search_source, search_destination, day, use_points)
+                    for search_source, search_destination, day in searches]
+    else:
+        click.echo('Expected source, destination, and date (or date-from) to all be set, or csv to '
+                   'be set.')
+        sys.exit(1)
+    with workqueue.open_broker(broker) as queue:
+        job_ids = [queue.enqueue(job) for job in jobs]
+        click.echo("Queued %s jobs: %s" % (len(job_ids), " ".join(str(job_id)
+                                                                 for job_id in job_ids)),
+                   err=True)
+        if not wait:
+            return
+        failed = 0
+        dollars, points = 0, 0
+        with result_output.open_writer(output_format, output) as writer:
+            statuses = workqueue.wait_for(queue, job_ids, poll_interval)
+            for row, (job_id, job, status) in enumerate(zip(job_ids, jobs, statuses)):
+                # A job can be gone from the queue, for example once a Redis broker expired it.
+                if status is None:
+                    done, error = False, "no longer in the queue"
+                else:
+                    done, error = status.state == workqueue.DONE, status.error
+                if job.kind == workqueue.TRIP:
+                    if done:
+                        ticket, price = status.ticket()
+                        cost = scrape_amtrak.csv_trip_cost(job.trip(), price)
+                        dollars, points = dollars + cost[0], points + cost[1]
+                        writer.write_trip(row, job.trip(), ticket, price, cost)
+                    else:
+                        failed = failed + 1
+                        writer.write_trip(row, job.trip(), error=error)
+                elif done:
+                    for result in status.results().results:
+                        writer.write_result(result, result_output.search_record(
+                            job.source, job.destination, job.date, job.use_points))
+                else:
+                    failed = failed + 1
+                    click.echo("Job %s failed: %s" % (job_id, error), err=True)
+                writer.flush()
+            if any(job.kind == workqueue.TRIP for job in jobs):
+                writer.write_totals(dollars, points)
+    if failed:
+        sys.exit(1)
+
+@amtrak_search.command()
+@click.option('--broker', default=None,
+              help='Queue to take jobs from: a SQLite file, or a redis:// URL.')
+@click.option('--jobs', default=1, help='How many jobs to run at once.')
+@click.option('--backend', default='browser', type=click.Choice(['browser', 'http']),
+              help='Search in a browser, or by posting the search form over HTTP.')
+@click.option('--headless/--no-headless', default=False, help='Run the browser without a window.')
+@click.option('--log-in/--no-log-in', default=None,
+              help='Log the browsers in, which trips to get to the checkout page for need.  On by '
+              'default with the browser backend.')
+@click.option('--lease', 'lease_seconds', default=300,
+              help='Seconds a job is held for before another worker may take it, renewed while '
+              'it runs.')
+@click.option('--poll-interval', default=5.0, help='Seconds between checks of an empty queue.')
+@click.option('--max-jobs', default=None, type=int,
+              help='Stop after this many jobs per --jobs.')
+@click.option('--exit-when-idle', is_flag=True, default=False,
+              help='Stop once no jobs are waiting instead of waiting for more.')
+@click.option('--history', default=None,
+              help='Fare history database to record every result searched in.')
+# pylint: disable=too-many-arguments,too-many-locals
+def worker(broker, jobs, backend, headless, log_in, lease_seconds, poll_interval, max_jobs,
+           exit_when_idle, history):
+    """
+    Runs jobs from a queue with this machine's own browser sessions, writing the results back.
+    Run one on every machine to share the work.
+    """
+    import concurrent.futures
+    from amtrakomatic import scrape_amtrak
+    from amtrakomatic import workqueue
+    if log_in is None:
+        # Any job may be a trip, and trips cannot get to the checkout page without logging in.
+        log_in = backend == 'browser'
+    with workqueue.open_broker(broker) as queue, \
+            scrape_amtrak.new_driver_pool(size=jobs, log_in=log_in, headless=headless,
+                                          backend=backend) as pool, \
+            open_history(history) as fare_history, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        runs = [executor.submit(workqueue.Worker(
+            queue, pool, "%s:%s" % (workqueue.worker_name(), thread), lease_seconds,
+            poll_interval, fare_history).run, max_jobs, exit_when_idle)
+                for thread in range(jobs)]
+        ran = sum(run.result() for run in runs)
+    click.echo("Ran %s jobs" % ran, err=True)
 
 if __name__ == "__main__":
     # pylint: disable=no-value-for-parameter
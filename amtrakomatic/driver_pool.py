@@ -0,0 +1,157 @@
+"""
+A pool of warm browser sessions that searches borrow instead of starting a new browser each time.
+"""
+
+import contextlib
+import logging
+import queue
+import threading
+import attr
+from amtrakomatic import metrics
+
+DEFAULT_MAX_USES = 50
+
+class PoolClosed(Exception):
+    """
+    Raised when a session is asked for from a pool that has been closed.
+    """
+
+@metrics.timed("browser_launch")
+def firefox_driver(headless=False):
+    """
+    Starts a new Firefox session.
+    """
+    # pylint: disable=import-outside-toplevel
+    from selenium import webdriver
+    options = webdriver.FirefoxOptions()
+    if headless:
+        options.add_argument("-headless")
+    # No implicit wait, since it makes every lookup that finds nothing take the whole timeout.
+    # Steps wait for the page they need with amtrakomatic.readiness instead.
+    return webdriver.Firefox(options=options)
+
+# pylint: disable=too-few-public-methods
+@attr.s(auto_attribs=True)
+class PooledDriver:
+    """
+    A browser session owned by the pool, and how many searches it has been used for.
+    """
+    driver: object
+    uses: int = 0
+
+# pylint: disable=too-many-instance-attributes
+class DriverPool:
+    """
+    Hands out up to size browser sessions at once.  Sessions are started by factory and then
+    passed to warm_up (for example to load the homepage and log in) the first time they are
+    needed, and are thrown away after max_uses searches or after any search that fails.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, size=1, max_uses=DEFAULT_MAX_USES, factory=firefox_driver, warm_up=None):
+        self.size = size
+        self.max_uses = max_uses
+        self.factory = factory
+        self.warm_up = warm_up
+        self._idle = queue.Queue()
+        self._available = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._in_use = {}
+        self._closed = False
+
+    def _start(self):
+        metrics.count("sessions_started")
+        driver = self.factory()
+        warmed_up = False
+        try:
+            if self.warm_up:
+                self.warm_up(driver)
+            warmed_up = True
+        finally:
+            if not warmed_up:
+                driver.quit()
+        return PooledDriver(driver)
+
+    def _retire(self, pooled_driver):
+        # pylint: disable=import-outside-toplevel
+        import urllib3
+        from selenium.common import exceptions
+        try:
+            pooled_driver.driver.quit()
+        # A browser that already died fails to quit, either from the driver or on the way to it.
+        except (exceptions.WebDriverException, urllib3.exceptions.HTTPError, OSError) as exception:
+            logging.warning("Failed to quit browser session: %s", exception)
+
+    def warm(self):
+        """
+        Starts sessions until size of them are idle, so that the first searches don't pay for it.
+        """
+        while self._idle.qsize() < self.size - len(self._in_use):
+            self._idle.put(self._start())
+
+    def acquire(self):
+        """
+        Waits for a free session and returns its driver.  Every driver must be given back with
+        release, or use session instead.
+        """
+        if self._closed:
+            raise PoolClosed("Driver pool is closed")
+        self._available.acquire()
+        pooled_driver = None
+        try:
+            try:
+                pooled_driver = self._idle.get_nowait()
+            except queue.Empty:
+                pooled_driver = self._start()
+        finally:
+            if pooled_driver is None:
+                self._available.release()
+        with self._lock:
+            self._in_use[id(pooled_driver.driver)] = pooled_driver
+        return pooled_driver.driver
+
+    def release(self, driver, broken=False):
+        """
+        Gives a driver back to the pool.  Broken or worn out sessions are quit.
+        """
+        with self._lock:
+            pooled_driver = self._in_use.pop(id(driver))
+        pooled_driver.uses = pooled_driver.uses + 1
+        if broken:
+            metrics.count("sessions_broken")
+        if broken or self._closed or pooled_driver.uses >= self.max_uses:
+            self._retire(pooled_driver)
+        else:
+            self._idle.put(pooled_driver)
+        self._available.release()
+
+    @contextlib.contextmanager
+    def session(self):
+        """
+        Borrows a driver for the duration of a with block.  If the block raises, the session is
+        thrown away rather than reused.
+        """
+        driver = self.acquire()
+        broken = True
+        try:
+            yield driver
+            broken = False
+        finally:
+            self.release(driver, broken=broken)
+
+    def close(self):
+        """
+        Quits all idle sessions.  Sessions still in use are quit when they are released.
+        """
+        self._closed = True
+        while True:
+            try:
+                self._retire(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,42 +1,245 @@
 """
 Library to handle fuzzy matching of amtrak station names to get amtrak station codes.
 """
+import array
 import csv
+import collections
+import functools
+import heapq
 import pathlib
+import pickle
 import os
-from fuzzywuzzy import process
+import re
+from amtrakomatic import geo
 
 AMTRAK_STATIONS_CSV = os.path.join(pathlib.Path(__file__).parent, 'Amtrak_Stations.csv')
 
+# Optional precompiled copy of the station map and its index, written by compile_stations when the
+# package is built.  It is only used if it is newer than the CSV, or if the CSV is missing.
+AMTRAK_STATIONS_PICKLE = os.path.join(pathlib.Path(__file__).parent, 'Amtrak_Stations.pickle')
+
+# Stored in the pickle, which is ignored unless it matches.  Bump this whenever the station map or
+# StationIndex changes shape, so a pickle left over from an older version is never used.
+STATIONS_FORMAT_VERSION = 3
+
+# How many of the stations sharing the most trigrams with a query get scored by fuzzywuzzy.
+# Stations tied with the last one are scored too, so this never splits a tie.
+SHORTLIST_SIZE = 30
+
+# A typo, or a name written differently, can leave the right station off the short list, or a
+# station off it can score higher than everything on it.  When the best station on the short list
+# scores below this, with and without spaces, every station gets scored after all.
+SHORTLIST_MINIMUM_SCORE = 90
+
+def _coordinate(field):
+    return float(field) if field else None
+
 def load_stations():
     """
-    Loads the stations CSV into a map keyed by full station name.
+    Loads the stations CSV into a map keyed by full station name.  Stations the CSV has no
+    location for have None for their latitude and longitude.
     """
-    with open(AMTRAK_STATIONS_CSV) as amtrak_stations:
+    with open(AMTRAK_STATIONS_CSV) as stations_file:
         header_skipped = False
-        stations = []
-        reader = csv.reader(amtrak_stations, delimiter=',', quotechar='"')
+        station_list = []
+        reader = csv.reader(stations_file, delimiter=',', quotechar='"')
         for fields in reader:
             if not header_skipped:
                 header_skipped = True
                 continue
-            stations.append({
+            station_list.append({
                 "name": fields[4],
                 "code": fields[3],
                 "city": fields[5],
-                "state": fields[6]
+                "state": fields[6],
+                "latitude": _coordinate(fields[1]),
+                "longitude": _coordinate(fields[0]),
                 })
     station_map = {}
-    for station_info in stations:
+    for station_info in station_list:
         station_map[station_info["name"]] = station_info
     return station_map
 
-AMTRAK_STATIONS = load_stations()
+def _squash(text):
+    # The same as fuzzywuzzy's full_process with the whitespace removed, without importing it.
+    return re.sub(r"(?ui)\W", "", text).lower()
+
+def _trigrams(text):
+    squashed = _squash(text)
+    return {squashed[i:i + 3] for i in range(len(squashed) - 2)}
+
+class StationIndex:
+    """
+    Precomputed lookup tables over the station map, so a query only gets fuzzy scored against a
+    short list of stations that share trigrams with it instead of every station.  Exact station
+    codes and names always win, then a station's city, alone or followed by its state, ignoring
+    spaces and punctuation.  Otherwise matches are the same as scoring every station, unless a
+    station off the short list beats one on it that already scores SHORTLIST_MINIMUM_SCORE, or one
+    on it only scores that once spaces are ignored.  Also indexes where the stations are, keyed by
+    station name.
+    """
+
+    def __init__(self, station_map):
+        self.names = list(station_map.keys())
+        self.by_code = {}
+        self.by_name = {}
+        self.by_city = collections.defaultdict(list)
+        self.by_trigram = collections.defaultdict(list)
+        for position, (name, station_info) in enumerate(station_map.items()):
+            self.by_code[station_info["code"].upper()] = name
+            self.by_name[_squash(name)] = name
+            self.by_city[_squash(station_info["city"])].append(position)
+            self.by_city[_squash(station_info["city"] + station_info["state"])].append(position)
+            for trigram in _trigrams(name):
+                self.by_trigram[trigram].append(position)
+        self.locations = geo.GridIndex(
+            (name, station_info["latitude"], station_info["longitude"])
+            for name, station_info in station_map.items())
+
+    def shortlist(self, name):
+        """
+        Returns the names of the stations worth scoring for this query, in station map order so
+        that ties are broken the same way as scoring every station.
+        """
+        trigrams = _trigrams(name)
+        # One small counter per station rather than a dict of the stations that share trigrams,
+        # which for common trigrams like "ton" is most of them.
+        overlaps = array.array("I", bytes(4 * len(self.names)))
+        for trigram in trigrams:
+            for position in self.by_trigram.get(trigram, ()):
+                overlaps[position] += 1
+        ranked = heapq.nlargest(SHORTLIST_SIZE, overlaps)
+        if not ranked[0]:
+            return self.names
+        cutoff = max(ranked[-1], 1)
+        return [self.names[position] for position, overlap in enumerate(overlaps)
+                if overlap >= cutoff]
+
+    def match(self, name):
+        """
+        Returns the full station name that best matches a rough station name.
+        """
+        # pylint: disable=import-outside-toplevel
+        from fuzzywuzzy import process
+        stripped = name.strip()
+        if len(stripped) == 3 and stripped.upper() in self.by_code:
+            return self.by_code[stripped.upper()]
+        squashed = _squash(name)
+        if squashed in self.by_name:
+            return self.by_name[squashed]
+        if squashed in self.by_city:
+            same_city = [self.names[position] for position in self.by_city[squashed]]
+            return same_city[0] if len(same_city) == 1 else process.extractOne(name, same_city)[0]
+        if len(squashed) < 3:
+            return process.extractOne(name, self.names)[0]
+        shortlist = self.shortlist(name)
+        matched_station, score = process.extractOne(name, shortlist)
+        if score < SHORTLIST_MINIMUM_SCORE:
+            # Names run together, like "newyork", score low against the spaced out station names.
+            _, score, matched_station = process.extractOne(
+                squashed, {station_name: _squash(station_name) for station_name in shortlist})
+        # Not kept alive while every station is scored.
+        del shortlist
+        if score < SHORTLIST_MINIMUM_SCORE:
+            return process.extractOne(name, self.names)[0]
+        return matched_station
+
+def compile_stations(filename=AMTRAK_STATIONS_PICKLE):
+    """
+    Writes the station map and its index to a pickle, which loads faster than building them from
+    the CSV.
+    """
+    station_map = load_stations()
+    with open(filename, "wb") as compiled_stations:
+        pickle.dump((STATIONS_FORMAT_VERSION, station_map, StationIndex(station_map)),
+                    compiled_stations, protocol=pickle.HIGHEST_PROTOCOL)
+
+def _load_compiled_stations():
+    """
+    Returns the station map and index from the pickle, or None if it was written by a version with
+    a different STATIONS_FORMAT_VERSION.
+    """
+    with open(AMTRAK_STATIONS_PICKLE, "rb") as compiled_stations:
+        # Before the version was stored, the pickle held just the station map and index.
+        version, *tables = pickle.load(compiled_stations)
+    if version != STATIONS_FORMAT_VERSION:
+        return None
+    return tuple(tables)
+
+@functools.lru_cache(maxsize=None)
+def _station_tables():
+    if os.path.exists(AMTRAK_STATIONS_PICKLE) and (
+            not os.path.exists(AMTRAK_STATIONS_CSV) or
+            os.path.getmtime(AMTRAK_STATIONS_PICKLE) >= os.path.getmtime(AMTRAK_STATIONS_CSV)):
+        tables = _load_compiled_stations()
+        if tables is not None:
+            return tables
+    station_map = load_stations()
+    return station_map, StationIndex(station_map)
+
+def amtrak_stations():
+    """
+    Returns the map of all stations keyed by full station name, loading it the first time it is
+    needed.
+    """
+    return _station_tables()[0]
+
+def station_index():
+    """
+    Returns the station index, building it the first time it is needed.
+    """
+    return _station_tables()[1]
+
+def __getattr__(name):
+    # AMTRAK_STATIONS used to be loaded when this module was imported.
+    if name == "AMTRAK_STATIONS":
+        return amtrak_stations()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 def station(name):
     """
     Given a rough station name, does a fuzzy match on all Amtrak stations to return the proper
     station code.
     """
-    matched_station = process.extractOne(name, AMTRAK_STATIONS.keys())[0]
-    return (matched_station, AMTRAK_STATIONS[matched_station]["code"])
+    matched_station = station_index().match(name)
+    return (matched_station, amtrak_stations()[matched_station]["code"])
+
+def stations(names):
+    """
+    Matches many rough station names at once, returning a list of (name, code) tuples in the same
+    order.  Repeated names are only matched once.
+    """
+    matches = {}
+    for name in names:
+        if name not in matches:
+            matches[name] = station(name)
+    return [matches[name] for name in names]
+
+def nearest_stations(latitude, longitude, count):
+    """
+    Returns the count stations nearest to a place as (name, code, distance in km) tuples, nearest
+    first.
+    """
+    return [(name, amtrak_stations()[name]["code"], distance)
+            for distance, name in station_index().locations.nearest(latitude, longitude, count)]
+
+def stations_within(latitude, longitude, radius_km):
+    """
+    Returns every station within radius_km of a place as (name, code, distance in km) tuples,
+    nearest first.
+    """
+    return [(name, amtrak_stations()[name]["code"], distance)
+            for distance, name in station_index().locations.within(latitude, longitude,
+                                                                   radius_km)]
+
+def stations_near(name, radius_km):
+    """
+    Matches a rough station name and returns it and every other station within radius_km of it,
+    as (name, code, distance in km) tuples, nearest first.  A station with no known location is
+    returned alone.
+    """
+    matched_station, code = station(name)
+    station_info = amtrak_stations()[matched_station]
+    if station_info["latitude"] is None:
+        return [(matched_station, code, 0.0)]
+    return stations_within(station_info["latitude"], station_info["longitude"], radius_km)
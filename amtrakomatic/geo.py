@@ -0,0 +1,106 @@
+"""
+Great circle distances, and a grid index over points on the earth so that finding the points
+near somewhere only measures the distance to the points in the grid cells around it.
+"""
+
+import collections
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+# How far apart two lines of latitude one degree apart are, anywhere on the earth.
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+DEFAULT_CELL_DEGREES = 1.0
+
+def haversine_km(latitude, longitude, other_latitude, other_longitude):
+    """
+    Returns the great circle distance in kilometers between two points given in degrees.
+    """
+    latitude, longitude, other_latitude, other_longitude = map(
+        math.radians, (latitude, longitude, other_latitude, other_longitude))
+    half_chord = (math.sin((other_latitude - latitude) / 2) ** 2 +
+                  math.cos(latitude) * math.cos(other_latitude) *
+                  math.sin((other_longitude - longitude) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(half_chord)))
+
+class GridIndex:
+    """
+    Points, each with a key, bucketed into cells of cell_degrees of latitude by cell_degrees of
+    longitude.  Points given None for a coordinate are left out.
+    """
+
+    def __init__(self, points, cell_degrees=DEFAULT_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.columns = int(math.ceil(360 / cell_degrees))
+        self.keys = []
+        self.latitudes = []
+        self.longitudes = []
+        self.cells = collections.defaultdict(list)
+        for key, latitude, longitude in points:
+            if latitude is None or longitude is None:
+                continue
+            self.cells[self._cell(latitude, longitude)].append(len(self.keys))
+            self.keys.append(key)
+            self.latitudes.append(latitude)
+            self.longitudes.append(longitude)
+
+    def _column(self, longitude):
+        # Columns start at 0 degrees and go east, so when cell_degrees does not divide 360 the last
+        # one, just west of 0 degrees, is narrower than the others.
+        return int(math.floor((longitude % 360) / self.cell_degrees)) % self.columns
+
+    def _cell(self, latitude, longitude):
+        return int(math.floor(latitude / self.cell_degrees)), self._column(longitude)
+
+    def _candidates(self, latitude, longitude, radius_km):
+        """
+        Returns the positions of the points in every cell that could be within radius_km.
+        """
+        latitude_span = radius_km / KM_PER_DEGREE
+        south = max(-90.0, latitude - latitude_span)
+        north = min(90.0, latitude + latitude_span)
+        # Lines of longitude are closest together at the edge of the band nearest a pole.
+        widest = math.cos(math.radians(max(abs(south), abs(north))))
+        if widest <= 0 or radius_km / (KM_PER_DEGREE * widest) >= 180:
+            columns = range(self.columns)
+        else:
+            longitude_span = radius_km / (KM_PER_DEGREE * widest)
+            west = (longitude - longitude_span) % 360
+            east = (longitude + longitude_span) % 360
+            if west <= east:
+                columns = range(self._column(west), self._column(east) + 1)
+            else:
+                # The span crosses 0 degrees.
+                columns = (list(range(self._column(west), self.columns)) +
+                           list(range(self._column(east) + 1)))
+        positions = []
+        for row in range(int(math.floor(south / self.cell_degrees)),
+                         int(math.floor(north / self.cell_degrees)) + 1):
+            for column in columns:
+                positions.extend(self.cells.get((row, column), ()))
+        return positions
+
+    def within(self, latitude, longitude, radius_km):
+        """
+        Returns (distance in km, key) for every point within radius_km, nearest first.
+        """
+        found = []
+        for position in self._candidates(latitude, longitude, radius_km):
+            distance = haversine_km(latitude, longitude, self.latitudes[position],
+                                    self.longitudes[position])
+            if distance <= radius_km:
+                found.append((distance, self.keys[position]))
+        found.sort(key=lambda point: point[0])
+        return found
+
+    def nearest(self, latitude, longitude, count):
+        """
+        Returns (distance in km, key) for the count points nearest to a place, nearest first.
+        """
+        radius_km = self.cell_degrees * KM_PER_DEGREE
+        while True:
+            found = self.within(latitude, longitude, radius_km)
+            # Everything within the radius has been found, so if there are enough of them they
+            # are the nearest ones.
+            if len(found) >= count or radius_km >= math.pi * EARTH_RADIUS_KM:
+                return found[:count]
+            radius_km = radius_km * 2
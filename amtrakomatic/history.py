@@ -0,0 +1,163 @@
+"""
+A local history of every fare searched, so that questions about months of polling, like how
+fares for a train move as its date gets closer, are answered by indexed queries instead of by
+parsing saved pages again.
+
+Every search appends one row per result, with its cheapest available fare, one row per fare
+class and one row per train.  Rows are never updated, and the aggregates run inside SQLite.
+"""
+
+import datetime
+import os
+import time
+from amtrakomatic import amtrak_results
+from amtrakomatic import fuzzy_match
+from amtrakomatic import sqlite_store
+
+DEFAULT_HISTORY_PATH = os.path.join(os.path.expanduser("~"), ".cache", "amtrakomatic",
+                                    "history.sqlite")
+DEFAULT_PERCENTILES = (10, 50, 90)
+DATE_FORMAT = "%m/%d/%Y"
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS results (
+        id INTEGER PRIMARY KEY,
+        source TEXT NOT NULL,
+        destination TEXT NOT NULL,
+        travel_date TEXT NOT NULL,
+        use_points INTEGER NOT NULL,
+        fetched_at REAL NOT NULL,
+        days_before INTEGER NOT NULL,
+        departure TEXT NOT NULL,
+        trains TEXT NOT NULL,
+        cheapest INTEGER)""",
+    """CREATE TABLE IF NOT EXISTS fares (
+        result_id INTEGER NOT NULL,
+        fare_class INTEGER NOT NULL,
+        amount INTEGER)""",
+    """CREATE TABLE IF NOT EXISTS trains (
+        result_id INTEGER NOT NULL,
+        train_name TEXT NOT NULL,
+        train_number TEXT)""",
+    """CREATE INDEX IF NOT EXISTS results_route
+        ON results (source, destination, use_points, travel_date)""",
+    "CREATE INDEX IF NOT EXISTS fares_result ON fares (result_id)",
+    "CREATE INDEX IF NOT EXISTS trains_name ON trains (train_name)",
+    "CREATE INDEX IF NOT EXISTS trains_number ON trains (train_number)",
+]
+
+def _iso_date(date):
+    return datetime.datetime.strptime(date, DATE_FORMAT).date()
+
+def _from_iso(iso_date):
+    return datetime.date.fromisoformat(iso_date).strftime(DATE_FORMAT)
+
+def _value(amount, use_points):
+    return amtrak_results.Fare(None, amount, bool(use_points)).value
+
+class FareHistory(sqlite_store.SqliteStore):
+    """
+    Every result recorded, kept in SQLite at path.  Stations are stored by code, so any spelling
+    of a station finds the same rows.  Fares are in dollars, or points for points searches.
+    """
+
+    def __init__(self, path=DEFAULT_HISTORY_PATH, clock=time.time):
+        super().__init__(path, SCHEMA)
+        self.clock = clock
+
+    @staticmethod
+    def _route(source, destination):
+        (_, source_code), (_, destination_code) = fuzzy_match.stations([source, destination])
+        return source_code, destination_code
+
+    # pylint: disable=too-many-arguments
+    def record(self, source, destination, date, use_points, results, fetched_at=None):
+        """
+        Appends the AmtrakResults of a search, fetched at fetched_at seconds since the epoch or
+        now.
+        """
+        source, destination = self._route(source, destination)
+        fetched_at = self.clock() if fetched_at is None else fetched_at
+        travel_date = _iso_date(date)
+        days_before = (travel_date - datetime.date.fromtimestamp(fetched_at)).days
+        with self._lock, self._connection:
+            for result in results.results:
+                fares = [amtrak_results.Fare.parse(fare, use_points) for fare in result.fares]
+                available = [fare.amount for fare in fares if fare.amount is not None]
+                result_id = self._connection.execute(
+                    "INSERT INTO results (source, destination, travel_date, use_points, "
+                    "fetched_at, days_before, departure, trains, cheapest) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (source, destination, travel_date.isoformat(), int(use_points), fetched_at,
+                     days_before, result.legs[0].departure_time if result.legs else "",
+                     " + ".join(leg.train_name for leg in result.legs),
+                     min(available) if available else None)).lastrowid
+                self._connection.executemany(
+                    "INSERT INTO fares VALUES (?, ?, ?)",
+                    [(result_id, fare_class, fare.amount)
+                     for fare_class, fare in enumerate(fares, 1)])
+                self._connection.executemany(
+                    "INSERT INTO trains VALUES (?, ?, ?)",
+                    [(result_id, leg.train_name, amtrak_results.train_number(leg.train_name))
+                     for leg in result.legs])
+
+    def min_fare_by_date(self, source, destination, use_points=False, since=None):
+        """
+        Returns (travel date, lowest fare ever seen) for every date searched on a route, in date
+        order, only counting fetches since the given time if given.
+        """
+        source, destination = self._route(source, destination)
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT travel_date, MIN(cheapest) FROM results "
+                "WHERE source = ? AND destination = ? AND use_points = ? AND fetched_at >= ? "
+                "GROUP BY travel_date ORDER BY travel_date",
+                (source, destination, int(use_points), since or 0)).fetchall()
+        return [(_from_iso(travel_date), _value(cheapest, use_points))
+                for travel_date, cheapest in rows]
+
+    def train_trend(self, train, travel_date=None, use_points=False):
+        """
+        Returns (fetched at, travel date, lowest fare) for every fetch of a train, given by its
+        full name or number, oldest first, optionally only for one travel date.
+        """
+        name_column = "train_number" if train.isdigit() else "train_name"
+        query = ("SELECT r.fetched_at, r.travel_date, MIN(r.cheapest) FROM results r "
+                 "WHERE r.use_points = ? AND r.id IN "
+                 "(SELECT result_id FROM trains WHERE %s = ?)" % name_column)
+        parameters = [int(use_points), train]
+        if travel_date is not None:
+            query = query + " AND r.travel_date = ?"
+            parameters.append(_iso_date(travel_date).isoformat())
+        query = query + " GROUP BY r.fetched_at, r.travel_date ORDER BY r.fetched_at, r.travel_date"
+        with self._lock:
+            rows = self._connection.execute(query, parameters).fetchall()
+        return [(fetched_at, _from_iso(travel_date), _value(cheapest, use_points))
+                for fetched_at, travel_date, cheapest in rows]
+
+    def fare_percentiles(self, source, destination, percentiles=DEFAULT_PERCENTILES,
+                         use_points=False):
+        """
+        Returns a map of days before departure to the given percentiles (whole numbers from 0 to
+        100) of the cheapest fare of each result seen that many days before, by nearest rank.
+        """
+        source, destination = self._route(source, destination)
+        wanted = " UNION ALL ".join("SELECT %d AS percentile" % int(percentile)
+                                    for percentile in percentiles)
+        with self._lock:
+            rows = self._connection.execute(
+                "WITH ranked AS (SELECT days_before, cheapest, "
+                "ROW_NUMBER() OVER (PARTITION BY days_before ORDER BY cheapest) AS rank, "
+                "COUNT(*) OVER (PARTITION BY days_before) AS total FROM results "
+                "WHERE source = ? AND destination = ? AND use_points = ? "
+                "AND cheapest IS NOT NULL), "
+                "wanted AS (%s) "
+                "SELECT days_before, percentile, cheapest FROM ranked JOIN wanted "
+                "ON rank = MAX(1, (percentile * total + 99) / 100) "
+                "ORDER BY days_before, percentile" % wanted,
+                (source, destination, int(use_points))).fetchall()
+        by_days = {}
+        for days_before, percentile, cheapest in rows:
+            by_days.setdefault(days_before, {})[percentile] = _value(cheapest, use_points)
+        return {days_before: [values[int(percentile)] for percentile in percentiles]
+                for days_before, values in by_days.items()}
@@ -0,0 +1,99 @@
+"""
+Searches over plain HTTP instead of through a browser, by submitting the same form the fare
+finder on the homepage does.  A session is a few kilobytes of cookies and a kept-alive connection
+rather than a whole browser, so many more searches can run at once.
+"""
+
+import os
+from amtrakomatic import fuzzy_match
+from amtrakomatic import metrics
+
+HOMEPAGE_URL = "https://www.amtrak.com/home.html"
+SEARCH_URL = "https://tickets.amtrak.com/itd/amtrak"
+DEFAULT_TIMEOUT = 30
+
+# Set to the base URL of a stand-in site, such as the one standin.py serves, to search it instead
+# of the live site.
+SITE_URL_VARIABLE = "AMTRAKOMATIC_SITE_URL"
+HOMEPAGE_PATH = "/home.html"
+SEARCH_PATH = "/itd/amtrak"
+
+RAIL_WORKFLOW = "/sessionWorkflow/productWorkflow[@product='Rail']"
+SEARCH_HANDLER = ("_handler=amtrak.presentation.handler.request.rail.farefamilies."
+                  "AmtrakRailFareFamiliesSearchRequestHandler/_xpath=" + RAIL_WORKFLOW)
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:68.0) Gecko/20100101 Firefox/68.0"
+
+def site_urls():
+    """
+    Returns the URLs of the homepage and of the search form, on the live site unless
+    AMTRAKOMATIC_SITE_URL is set.
+    """
+    base_url = os.environ.get(SITE_URL_VARIABLE)
+    if not base_url:
+        return HOMEPAGE_URL, SEARCH_URL
+    return base_url.rstrip("/") + HOMEPAGE_PATH, base_url.rstrip("/") + SEARCH_PATH
+
+def search_form(source_code, destination_code, date, use_points):
+    """
+    Returns the fields of the fare finder form for a one way search for one adult, as a list of
+    (name, value) pairs in the order the page sends them.
+    """
+    return [
+        ("requestor", "amtrak.presentation.handler.page.rail.AmtrakRailFareFinderPageHandler"),
+        (RAIL_WORKFLOW + "/tripRequirements/@bookpath", "farefamilies"),
+        (RAIL_WORKFLOW + "/tripRequirements/allJourneyRequirements/@ff_tab_selected",
+         "bookatrip"),
+        (RAIL_WORKFLOW + "/tripRequirements/allJourneyRequirements/numberOfTravellers"
+         "[@key='Adult']", "1"),
+        ("wdf_TripType", "OneWay"),
+        ("xwdf_BookType_homepage", RAIL_WORKFLOW + "/tripRequirements/@booktype_homepage"),
+        ("wdf_BookType_homepage", "redeem" if use_points else ""),
+        ("xwdf_origin",
+         RAIL_WORKFLOW + "/travelSelection/journeySelection[1]/departLocation/search"),
+        ("wdf_origin", source_code),
+        ("xwdf_destination",
+         RAIL_WORKFLOW + "/travelSelection/journeySelection[1]/arriveLocation/search"),
+        ("wdf_destination", destination_code),
+        (RAIL_WORKFLOW + "/tripRequirements/journeyRequirements[1]/departDate.usdate", date),
+        (SEARCH_HANDLER, "Find Trains"),
+    ]
+
+class HttpSession:
+    """
+    A cookie jar and a kept-alive connection to the site.  It has the quit method a DriverPool
+    expects of a browser, so a pool can hand these out instead.
+    """
+
+    def __init__(self, homepage_url=None, search_url=None, timeout=DEFAULT_TIMEOUT):
+        # pylint: disable=import-outside-toplevel
+        import requests
+        default_homepage_url, default_search_url = site_urls()
+        self.homepage_url = homepage_url or default_homepage_url
+        self.search_url = search_url or default_search_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        self._visited_homepage = False
+
+    @metrics.timed("http_search_pages")
+    def search_pages(self, source, destination, date, use_points):
+        """
+        Runs a search and returns the source of its results pages.  The site paginates results in
+        the page itself, so one response holds all of them.
+        """
+        if not self._visited_homepage:
+            # The search handler wants the session cookies the homepage hands out.
+            self.session.get(self.homepage_url, timeout=self.timeout).raise_for_status()
+            self._visited_homepage = True
+        (_, source_code), (_, destination_code) = fuzzy_match.stations([source, destination])
+        response = self.session.post(
+            self.search_url, data=search_form(source_code, destination_code, date, use_points),
+            timeout=self.timeout)
+        response.raise_for_status()
+        return [response.text]
+
+    def quit(self):
+        """
+        Closes the connections.
+        """
+        self.session.close()
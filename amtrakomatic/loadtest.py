@@ -0,0 +1,110 @@
+"""
+Runs many searches at once against a site, normally a stand-in from standin.py, and reports how
+many finished per second and how long they took, for sizing how many sessions to run and for
+checking changes to concurrency.
+"""
+
+import collections
+import concurrent.futures
+import math
+import threading
+import time
+import typing
+import attr
+from amtrakomatic import scrape_amtrak
+
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+def percentile(values, wanted):
+    """
+    Returns the wanted percentile, from 0 to 100, of values by nearest rank, or None if there are
+    no values.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(wanted * len(ordered) / 100)) - 1]
+
+@attr.s(auto_attribs=True)
+class LoadTestReport:
+    """
+    How a load test went: how long it took, the seconds each search that succeeded took, and how
+    many searches failed with each kind of error.
+    """
+    concurrency: int
+    elapsed: float
+    latencies: typing.List[float]
+    errors: typing.Dict[str, int]
+
+    @property
+    def succeeded(self):
+        """
+        How many searches succeeded.
+        """
+        return len(self.latencies)
+
+    @property
+    def failed(self):
+        """
+        How many searches failed.
+        """
+        return sum(self.errors.values())
+
+    @property
+    def throughput(self):
+        """
+        Searches that succeeded per second.
+        """
+        return self.succeeded / self.elapsed if self.elapsed > 0 else 0.0
+
+    def percentiles(self, percentiles=DEFAULT_PERCENTILES):
+        """
+        Returns the given percentiles of the latency of the searches that succeeded.
+        """
+        return [percentile(self.latencies, wanted) for wanted in percentiles]
+
+    def format(self, percentiles=DEFAULT_PERCENTILES):
+        """
+        Returns the report as text.
+        """
+        lines = ["Searches: %s succeeded, %s failed, %s at once" % (
+            self.succeeded, self.failed, self.concurrency)]
+        lines.append("Elapsed: %.2fs, throughput: %.2f searches/s" % (self.elapsed,
+                                                                      self.throughput))
+        if self.latencies:
+            lines.append("Latency: " + ", ".join(
+                "p%s %.3fs" % (wanted, value)
+                for wanted, value in zip(percentiles, self.percentiles(percentiles))))
+        for error, count in sorted(self.errors.items()):
+            lines.append("%6s x %s" % (count, error))
+        return "\n".join(lines) + "\n"
+
+# pylint: disable=too-many-arguments
+def run_load_test(pool, searches, requests, concurrency, search=scrape_amtrak.get_all_fares,
+                  clock=time.perf_counter):
+    """
+    Runs requests searches, concurrency at a time, on sessions from pool, going round the given
+    (source, destination, date, use_points) searches, and returns a LoadTestReport.  The pool
+    should hand out at least concurrency sessions at once.
+    """
+    latencies = []
+    errors = collections.Counter()
+    lock = threading.Lock()
+
+    def run(request):
+        source, destination, date, use_points = searches[request % len(searches)]
+        start = clock()
+        try:
+            search(source, destination, date, use_points, pool)
+        except scrape_amtrak.search_errors() as exception:
+            with lock:
+                errors[type(exception).__name__] += 1
+            return
+        latency = clock() - start
+        with lock:
+            latencies.append(latency)
+
+    start = clock()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run, range(requests)))
+    return LoadTestReport(concurrency, clock() - start, latencies, dict(errors))
@@ -0,0 +1,229 @@
+"""
+Timing spans and counters for the stages of a run, so a slow run can be broken down into browser
+launch, login, form filling, searching, pagination, parsing and checkout.
+
+Everything is recorded in REGISTRY, which can be printed as a breakdown, written out as JSON or
+as a Prometheus text file, and passed span by span to hooks, for example to forward spans to an
+OpenTelemetry tracer.
+"""
+
+import contextlib
+import functools
+import json
+import logging
+import re
+import threading
+import time
+import attr
+
+# pylint: disable=too-few-public-methods
+@attr.s(auto_attribs=True)
+class SpanStats:
+    """
+    How many times a span ran, and how long it took in total and at most.
+    """
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+@attr.s(auto_attribs=True, frozen=True)
+class SpanEvent:
+    """
+    One finished span, as passed to hooks.  Times are nanoseconds since the epoch.
+    """
+    name: str
+    start_ns: int
+    end_ns: int
+    failed: bool
+
+    @property
+    def seconds(self):
+        """
+        How long the span took.
+        """
+        return (self.end_ns - self.start_ns) / 1e9
+
+class Metrics:
+    """
+    Span timings and counters, safe to record to from any thread.
+    """
+
+    def __init__(self, clock=time.time_ns):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._started_ns = clock()
+        self._spans = {}
+        self._counters = {}
+        self._hooks = []
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """
+        Times the with block as a span called name.
+        """
+        start_ns = self.clock()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            event = SpanEvent(name, start_ns, self.clock(), failed)
+            with self._lock:
+                stats = self._spans.setdefault(name, SpanStats())
+                stats.count = stats.count + 1
+                stats.total_seconds = stats.total_seconds + event.seconds
+                stats.max_seconds = max(stats.max_seconds, event.seconds)
+                hooks = list(self._hooks)
+            logging.debug("%s took %.3fs", name, event.seconds)
+            for hook in hooks:
+                hook(event)
+
+    def count(self, name, amount=1):
+        """
+        Adds amount to the counter called name.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def add_hook(self, hook):
+        """
+        Calls hook with a SpanEvent whenever a span finishes.
+        """
+        with self._lock:
+            self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """
+        Stops calling a hook added with add_hook.
+        """
+        with self._lock:
+            self._hooks.remove(hook)
+
+    def reset(self):
+        """
+        Forgets everything recorded so far, but keeps the hooks.
+        """
+        with self._lock:
+            self._started_ns = self.clock()
+            self._spans = {}
+            self._counters = {}
+
+    def snapshot(self):
+        """
+        Returns everything recorded so far as a dict that can be written as JSON.
+        """
+        with self._lock:
+            return {
+                "wall_seconds": (self.clock() - self._started_ns) / 1e9,
+                "spans": {name: attr.asdict(stats) for name, stats in self._spans.items()},
+                "counters": dict(self._counters),
+            }
+
+REGISTRY = Metrics()
+
+def span(name):
+    """
+    Times a with block as a span called name in REGISTRY.
+    """
+    return REGISTRY.span(name)
+
+def count(name, amount=1):
+    """
+    Adds amount to the counter called name in REGISTRY.
+    """
+    REGISTRY.count(name, amount)
+
+def timed(name):
+    """
+    Decorates a function so that every call is timed as a span called name in REGISTRY.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with REGISTRY.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def format_breakdown(snapshot):
+    """
+    Formats a snapshot as a table of spans, slowest in total first, followed by the counters.
+    Spans nest, so their shares of the wall time add up to more than all of it.
+    """
+    lines = ["%-45s%8s%12s%12s%12s%8s" % ("Span", "Count", "Total (s)", "Mean (s)", "Max (s)",
+                                          "Wall")]
+    wall_seconds = snapshot["wall_seconds"] or 1
+    for name, stats in sorted(snapshot["spans"].items(),
+                              key=lambda item: -item[1]["total_seconds"]):
+        lines.append("%-45s%8d%12.3f%12.3f%12.3f%7.0f%%" % (
+            name, stats["count"], stats["total_seconds"],
+            stats["total_seconds"] / stats["count"], stats["max_seconds"],
+            100 * stats["total_seconds"] / wall_seconds))
+    for name, value in sorted(snapshot["counters"].items()):
+        lines.append("%-45s%8d" % (name, value))
+    lines.append("%-45s%28.3f" % ("Wall time (s)", snapshot["wall_seconds"]))
+    return "\n".join(lines)
+
+def _prometheus_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name).strip("_").lower()
+
+def _prometheus_label(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_prometheus(snapshot, prefix="amtrakomatic"):
+    """
+    Formats a snapshot in the Prometheus text exposition format, for the node exporter's textfile
+    collector.
+    """
+    lines = ["# TYPE %s_span_seconds summary" % prefix]
+    for name, stats in sorted(snapshot["spans"].items()):
+        label = _prometheus_label(name)
+        lines.append('%s_span_seconds_sum{span="%s"} %r' % (prefix, label,
+                                                             stats["total_seconds"]))
+        lines.append('%s_span_seconds_count{span="%s"} %d' % (prefix, label, stats["count"]))
+    lines.append("# TYPE %s_span_max_seconds gauge" % prefix)
+    for name, stats in sorted(snapshot["spans"].items()):
+        lines.append('%s_span_max_seconds{span="%s"} %r' % (prefix, _prometheus_label(name),
+                                                             stats["max_seconds"]))
+    for name, value in sorted(snapshot["counters"].items()):
+        metric = "%s_%s_total" % (prefix, _prometheus_name(name))
+        lines.append("# TYPE %s counter" % metric)
+        lines.append("%s %d" % (metric, value))
+    return "\n".join(lines) + "\n"
+
+def write_snapshot(path, snapshot):
+    """
+    Writes a snapshot to path, in the Prometheus text format if it ends in .prom and as JSON
+    otherwise.
+    """
+    with open(path, "w") as output:
+        if path.endswith(".prom"):
+            output.write(format_prometheus(snapshot))
+        else:
+            json.dump(snapshot, output, indent=2, sort_keys=True)
+
+def json_lines_hook(output):
+    """
+    Returns a hook that writes every span to the file output as a line of JSON.
+    """
+    lock = threading.Lock()
+
+    def hook(event):
+        line = json.dumps(dict(attr.asdict(event), seconds=event.seconds), sort_keys=True)
+        with lock:
+            output.write(line + "\n")
+            output.flush()
+    return hook
+
+def opentelemetry_hook(tracer):
+    """
+    Returns a hook that reports every span to an OpenTelemetry tracer, keeping its real start and
+    end times.  The tracer is only used through start_span and end, so any compatible one works.
+    """
+
+    def hook(event):
+        otel_span = tracer.start_span(event.name, start_time=event.start_ns)
+        otel_span.set_attribute("amtrakomatic.failed", event.failed)
+        otel_span.end(end_time=event.end_ns)
+    return hook
@@ -0,0 +1,310 @@
+"""
+Finds the cheapest or fastest way from one station to another over a window of dates, allowing
+stops at candidate via stations on separate tickets, in dollars, points or a mix of both.
+
+Every ticket the site offers for a segment on a date is an edge from its departure at one station
+to its arrival at the next, so the search runs over a graph expanded in time: a ticket out of a
+via station can only be taken if it leaves long enough after the ticket into it arrived.  Each
+station keeps the labels (cost, elapsed time, arrival) that no other label there beats on all
+three, and labels are expanded best first, so the first ones to reach the destination are the
+best itineraries.  Segments are only searched when the search first needs them, and never twice.
+"""
+
+import concurrent.futures
+import datetime
+import heapq
+import itertools
+import logging
+import typing
+import attr
+from amtrakomatic import amtrak_results
+from amtrakomatic import fuzzy_match
+from amtrakomatic import metrics
+from amtrakomatic import scrape_amtrak
+from amtrakomatic import sweep
+
+CHEAPEST = "cheapest"
+FASTEST = "fastest"
+OBJECTIVES = (CHEAPEST, FASTEST)
+
+# Separate tickets do not wait for each other, so leave time to make the connection.
+DEFAULT_MIN_CONNECTION = datetime.timedelta(minutes=60)
+# How many days after arriving at a via station to look for the next ticket.
+DEFAULT_MAX_LAYOVER_DAYS = 1
+DEFAULT_LIMIT = 5
+
+TIME_FORMAT = "%I:%M %p"
+
+def departure_time(result, date):
+    """
+    Returns when a result leaves its first station, in that station's local time, for a search
+    on date, or None if the result has no legs.
+    """
+    if not result.legs:
+        return None
+    day = datetime.datetime.strptime(date, sweep.DATE_FORMAT)
+    time = datetime.datetime.strptime(result.legs[0].departure_time, TIME_FORMAT).time()
+    return datetime.datetime.combine(day.date(), time)
+
+def arrival_time(result, departure):
+    """
+    Returns when a result that leaves at departure gets to its last station, in that station's
+    local time.  The page gives the day of arrival if it is not the day of departure, but not
+    always for the last leg, so otherwise the day is the one that best matches the travel time.
+    """
+    last_leg = result.legs[-1]
+    time = datetime.datetime.strptime(last_leg.arrival_time, TIME_FORMAT).time()
+    if last_leg.arrival_day:
+        day = datetime.datetime.strptime("%s %s" % (last_leg.arrival_day, departure.year),
+                                         "%a %b %d %Y").date()
+        if day < departure.date():
+            day = day.replace(year=day.year + 1)
+        return datetime.datetime.combine(day, time)
+    expected = departure + datetime.timedelta(minutes=result.total_minutes or 0)
+    candidates = [datetime.datetime.combine(expected.date() + datetime.timedelta(days=offset),
+                                            time) for offset in (-1, 0, 1)]
+    return min((candidate for candidate in candidates if candidate >= departure),
+               key=lambda candidate: abs(candidate - expected))
+
+# pylint: disable=too-few-public-methods
+@attr.s(auto_attribs=True, frozen=True)
+class Ticket:
+    """
+    One result bought for one segment, and the fare it was bought at.
+    """
+    source: str
+    destination: str
+    date: str
+    result: amtrak_results.AmtrakResult
+    fare: amtrak_results.Fare
+    departure: datetime.datetime
+    arrival: datetime.datetime
+
+    def elapsed(self):
+        """
+        How long the ticket's trains take.
+        """
+        if self.result.total_minutes is not None:
+            return datetime.timedelta(minutes=self.result.total_minutes)
+        return self.arrival - self.departure
+
+@attr.s(auto_attribs=True, frozen=True)
+class Itinerary:
+    """
+    Tickets that get from the origin to the destination, one after the other.  Cost is in
+    dollars, with points converted at the point value the search was given, or in points if
+    only points were searched.
+    """
+    tickets: typing.Tuple[Ticket, ...]
+    cost: float
+    elapsed: datetime.timedelta
+
+    def stations(self):
+        """
+        Returns every station the itinerary stops at, in order.
+        """
+        return [self.tickets[0].source] + [ticket.destination for ticket in self.tickets]
+
+    def dollars(self):
+        """
+        Returns the dollars spent on tickets bought with dollars.
+        """
+        return sum(ticket.fare.value for ticket in self.tickets if not ticket.fare.points)
+
+    def points(self):
+        """
+        Returns the points spent on tickets bought with points.
+        """
+        return sum(ticket.fare.amount for ticket in self.tickets if ticket.fare.points)
+
+class SegmentFares:
+    """
+    Searches for segments on sessions from pool, up to jobs at once, remembering every search so
+    that none is run twice.  A search that fails counts as having no results.  See
+    scrape_amtrak.get_all_fares for cache, refresh and archive.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, pool, jobs=1, cache=None, refresh=False, archive=None,
+                 search=scrape_amtrak.get_all_fares):
+        self.pool = pool
+        self.jobs = jobs
+        self.cache = cache
+        self.refresh = refresh
+        self.archive = archive
+        self.search = search
+        self.searched = {}
+
+    def _search(self, source, destination, date, use_points):
+        try:
+            return self.search(source, destination, date, use_points, self.pool, self.cache,
+                               self.refresh, self.archive)
+        except scrape_amtrak.search_errors():
+            logging.exception("Could not search %s to %s on %s", source, destination, date)
+            return amtrak_results.AmtrakResults([])
+
+    def get(self, searches):
+        """
+        Returns a map of every (source, destination, date, use_points) search in searches to its
+        AmtrakResults, running the ones not searched yet.
+        """
+        missing = [search for search in dict.fromkeys(searches) if search not in self.searched]
+        if missing:
+            metrics.count("segment_searches", len(missing))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                for search, results in zip(missing, executor.map(
+                        lambda search: self._search(*search), missing)):
+                    self.searched[search] = results
+        return {search: self.searched[search] for search in searches}
+
+@attr.s(auto_attribs=True, frozen=True)
+class Label:
+    """
+    A way of getting to station, and what it cost so far.
+    """
+    station: str
+    arrival: typing.Optional[datetime.datetime]
+    cost: float
+    elapsed: datetime.timedelta
+    tickets: typing.Tuple[Ticket, ...]
+
+    def dominates(self, other):
+        """
+        Returns whether this label is at least as good as other in every way that matters for
+        the rest of the trip.
+        """
+        return (self.cost <= other.cost and self.elapsed <= other.elapsed
+                and self.arrival <= other.arrival)
+
+# pylint: disable=too-many-instance-attributes
+class Optimizer:
+    """
+    Searches for itineraries from origin to destination that leave on one of dates, optionally
+    stopping at any of vias in any order.  Points fares are searched if use_points is set, and
+    both dollars and points fares if point_value, the dollars a point is worth, is given.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, segment_fares, origin, destination, dates, vias=(), use_points=False,
+                 point_value=None, min_connection=DEFAULT_MIN_CONNECTION,
+                 max_layover_days=DEFAULT_MAX_LAYOVER_DAYS):
+        names = [origin, destination] + list(vias)
+        codes = [code for _, code in fuzzy_match.stations(names)]
+        self.segment_fares = segment_fares
+        self.origin = codes[0]
+        self.destination = codes[1]
+        self.vias = [code for code in dict.fromkeys(codes[2:])
+                     if code not in (self.origin, self.destination)]
+        self.dates = dates
+        self.point_value = point_value
+        if point_value is not None:
+            self.currencies = (False, True)
+        else:
+            self.currencies = (use_points,)
+        self.min_connection = min_connection
+        self.max_layover_days = max_layover_days
+
+    def _cost(self, fare):
+        if fare.points and self.point_value is not None:
+            return fare.amount * self.point_value
+        return fare.value
+
+    def _cheapest_fare(self, result, use_points):
+        fares = [amtrak_results.Fare.parse(text, use_points) for text in result.fares]
+        fares = [fare for fare in fares if fare.amount is not None]
+        return min(fares, key=self._cost) if fares else None
+
+    def _dates_after(self, label):
+        if label.arrival is None:
+            return self.dates
+        return [(label.arrival + datetime.timedelta(days=offset)).strftime(sweep.DATE_FORMAT)
+                for offset in range(self.max_layover_days + 1)]
+
+    # pylint: disable=too-many-locals
+    def _expand(self, label):
+        """
+        Returns the labels for taking one more ticket from where label is.
+        """
+        visited = {ticket.source for ticket in label.tickets}
+        targets = [station for station in self.vias + [self.destination]
+                   if station != label.station and station not in visited]
+        searches = [(label.station, target, date, use_points)
+                    for target in targets for date in self._dates_after(label)
+                    for use_points in self.currencies]
+        labels = []
+        for (source, target, date, use_points), results in self.segment_fares.get(
+                searches).items():
+            for result in results.results:
+                departure = departure_time(result, date)
+                if departure is None or (label.arrival is not None and
+                                         departure < label.arrival + self.min_connection):
+                    continue
+                fare = self._cheapest_fare(result, use_points)
+                if fare is None:
+                    continue
+                ticket = Ticket(source, target, date, result, fare, departure,
+                                arrival_time(result, departure))
+                waited = (departure - label.arrival if label.arrival is not None
+                          else datetime.timedelta(0))
+                labels.append(Label(target, ticket.arrival, label.cost + self._cost(fare),
+                                    label.elapsed + waited + ticket.elapsed(),
+                                    label.tickets + (ticket,)))
+        return labels
+
+    def search(self, objective=CHEAPEST, limit=DEFAULT_LIMIT):
+        """
+        Returns up to limit itineraries, the cheapest first or the fastest first depending on
+        objective.  Ties go to the other of the two.
+        """
+        if objective not in OBJECTIVES:
+            raise ValueError("Unknown objective %s, expected one of %s" % (
+                objective, ", ".join(OBJECTIVES)))
+
+        def key(label):
+            if objective == CHEAPEST:
+                return (label.cost, label.elapsed)
+            return (label.elapsed, label.cost)
+
+        order = itertools.count()
+        queue = [(key(label), next(order), label) for label in self._expand(
+            Label(self.origin, None, 0, datetime.timedelta(0), ()))]
+        heapq.heapify(queue)
+        settled = {}
+        itineraries = []
+        while queue and len(itineraries) < limit:
+            _, _, label = heapq.heappop(queue)
+            if label.station == self.destination:
+                itineraries.append(Itinerary(label.tickets, label.cost, label.elapsed))
+                continue
+            if any(other.dominates(label) for other in settled.get(label.station, [])):
+                continue
+            settled.setdefault(label.station, []).append(label)
+            for next_label in self._expand(label):
+                heapq.heappush(queue, (key(next_label), next(order), next_label))
+        return itineraries
+
+def format_cost(itinerary, points_only):
+    """
+    Formats what an itinerary costs, with the dollars and points it is paid in if it mixes them.
+    """
+    if points_only:
+        return amtrak_results.format_fare_value(itinerary.cost, True)
+    cost = amtrak_results.format_fare_value(itinerary.cost, False)
+    if itinerary.points():
+        cost = cost + " (%s + %s)" % (amtrak_results.format_fare_value(itinerary.dollars(), False),
+                                      amtrak_results.format_fare_value(itinerary.points(), True))
+    return cost
+
+def print_itineraries(itineraries, points_only=False):
+    """
+    Prints each itinerary with its tickets.
+    """
+    for itinerary in itineraries:
+        hours, minutes = divmod(int(itinerary.elapsed.total_seconds()) // 60, 60)
+        print("%s: %s, %sh %sm" % (" -> ".join(itinerary.stations()),
+                                   format_cost(itinerary, points_only), hours, minutes))
+        for ticket in itinerary.tickets:
+            print("    %-4s%s -> %-4s%s  %-40s%s" % (
+                ticket.source, ticket.departure.strftime("%m/%d %I:%M %p"),
+                ticket.destination, ticket.arrival.strftime("%m/%d %I:%M %p"),
+                " + ".join(leg.train_name for leg in ticket.result.legs), ticket.fare.text))
@@ -0,0 +1,251 @@
+"""
+Writers for the results of searches and CSV trips, as the text pretty_print shows or as JSON,
+JSON lines or CSV for other programs to read.  Writers emit each result as soon as they are
+given it, but collect what they write and hand it to the output in one write when flushed, so
+that a search of many results is not written a line at a time.
+"""
+
+import csv
+import io
+import json
+import attr
+from amtrakomatic import amtrak_results
+
+FORMATS = ("table", "json", "ndjson", "csv")
+DEFAULT_FORMAT = "table"
+
+def search_record(source, destination, date, use_points):
+    """
+    Returns what was searched for as a dict.
+    """
+    return {"source": source, "destination": destination, "date": date,
+            "use_points": use_points}
+
+class Writer:
+    """
+    Collects text for output until flush is called.  Subclasses say how results and trips are
+    written.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self._pending = []
+
+    def _write(self, text):
+        self._pending.append(text)
+
+    def flush(self):
+        """
+        Writes everything collected so far to the output.
+        """
+        if self._pending:
+            self.output.write("".join(self._pending))
+            self._pending = []
+        self.output.flush()
+
+    def close(self):
+        """
+        Finishes the output.  The output itself is left open.
+        """
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class TableWriter(Writer):
+    """
+    Writes the same text that pretty_print and the CSV trip report always have.
+    """
+
+    # pylint: disable=unused-argument
+    def write_result(self, result, search=None):
+        """
+        Writes one AmtrakResult, from the search described by search_record if given.
+        """
+        self._write(result.format())
+
+    # pylint: disable=too-many-arguments
+    def write_trip(self, row, search_info, ticket=None, price=None, cost=None, error=None):
+        """
+        Writes the outcome of pricing one row of a CSV: the ticket, its price and its cost as
+        a (dollars, points) tuple, or the error it failed with.
+        """
+        self._write("%s\n" % (search_info,))
+        if error is not None:
+            self._write("Failed: %s\n" % error)
+            return
+        self._write(ticket.format())
+        if search_info[4].strip() == "points":
+            self._write("Price (points): %s\n" % price)
+        else:
+            self._write("Price (dollars): %s\n" % price)
+
+    def write_totals(self, dollars, points, failed_rows=()):
+        """
+        Writes the total cost of a CSV, and which rows failed.
+        """
+        self._write("Total point cost: %s\nTotal dollar cost: %s\n" % (points, dollars))
+        if failed_rows:
+            self._write("Failed trips: %s\n" % ", ".join(str(row + 1) for row in failed_rows))
+
+class RecordWriter(Writer):
+    """
+    Writes results and trips as records, one dict each.  Subclasses say how a record is written.
+    """
+
+    def write_record(self, record):
+        """
+        Writes one record.
+        """
+        raise NotImplementedError
+
+    def result_record(self, result, search):
+        """
+        Returns the record for a result.
+        """
+        return dict(search or {}, **attr.asdict(result))
+
+    # pylint: disable=too-many-arguments
+    def trip_record(self, row, search_info, ticket, price, cost, error):
+        """
+        Returns the record for the outcome of a CSV row.
+        """
+        record = {"row": row + 1, "trip": list(search_info), "price": price,
+                  "dollars": cost[0] if cost else None, "points": cost[1] if cost else None,
+                  "error": None if error is None else str(error)}
+        record["ticket"] = attr.asdict(ticket) if ticket is not None else None
+        return record
+
+    def write_result(self, result, search=None):
+        """
+        Writes one AmtrakResult, from the search described by search_record if given.
+        """
+        self.write_record(self.result_record(result, search))
+
+    # pylint: disable=too-many-arguments
+    def write_trip(self, row, search_info, ticket=None, price=None, cost=None, error=None):
+        """
+        Writes the outcome of pricing one row of a CSV.
+        """
+        self.write_record(self.trip_record(row, search_info, ticket, price, cost, error))
+
+    def write_totals(self, dollars, points, failed_rows=()):
+        """
+        Totals can be added up from the trip records, so are not written.
+        """
+
+class NdjsonWriter(RecordWriter):
+    """
+    Writes a line of JSON per record.
+    """
+
+    def write_record(self, record):
+        self._write(json.dumps(record) + "\n")
+
+class JsonWriter(RecordWriter):
+    """
+    Writes a JSON array of the records, starting it with the first record and ending it on
+    close.
+    """
+
+    def __init__(self, output):
+        super().__init__(output)
+        self._started = False
+
+    def write_record(self, record):
+        self._write((",\n" if self._started else "[\n") + json.dumps(record))
+        self._started = True
+
+    def close(self):
+        self._write("\n]\n" if self._started else "[]\n")
+        super().close()
+
+class CsvWriter(RecordWriter):
+    """
+    Writes a CSV row per record, with a header row before the first.  Results and trips are
+    flattened: trains and fares are joined into one column each.
+    """
+
+    RESULT_COLUMNS = ["source", "destination", "date", "use_points", "departure", "arrival",
+                      "arrival_day", "duration", "trains", "transfers", "fares", "cheapest"]
+    TRIP_COLUMNS = ["row", "source", "destination", "date", "train", "currency", "price",
+                    "dollars", "points", "error"]
+
+    def __init__(self, output):
+        super().__init__(output)
+        self._buffer = io.StringIO()
+        self._csv = None
+
+    def write_record(self, record):
+        if self._csv is None:
+            self._csv = csv.DictWriter(self._buffer, fieldnames=list(record),
+                                       extrasaction="ignore", lineterminator="\n")
+            self._csv.writeheader()
+        self._csv.writerow(record)
+        self._write(self._buffer.getvalue())
+        self._buffer.seek(0)
+        self._buffer.truncate()
+
+    def result_record(self, result, search):
+        search = search or search_record(None, None, None, None)
+        cheapest = result.cheapest()
+        last_leg = result.legs[-1] if result.legs else None
+        return dict(zip(self.RESULT_COLUMNS, [
+            search["source"], search["destination"], search["date"], search["use_points"],
+            result.legs[0].departure_time if result.legs else None,
+            last_leg.arrival_time if last_leg else None,
+            last_leg.arrival_day if last_leg else None,
+            result.total_travel_time,
+            " + ".join(leg.train_name for leg in result.legs),
+            " + ".join(leg.transfer.station for leg in result.legs if leg.transfer),
+            " | ".join(result.fares),
+            amtrak_results.format_fare_value(cheapest.value, cheapest.points)
+            if cheapest else None]))
+
+    # pylint: disable=too-many-arguments
+    def trip_record(self, row, search_info, ticket, price, cost, error):
+        fields = (list(search_info) + [None] * 5)[:5]
+        return dict(zip(self.TRIP_COLUMNS, [
+            row + 1, fields[0], fields[1], fields[2], fields[3].rstrip() if fields[3] else None,
+            fields[4].strip() if fields[4] else None, price, cost[0] if cost else None,
+            cost[1] if cost else None, None if error is None else str(error)]))
+
+WRITERS = {
+    "table": TableWriter,
+    "json": JsonWriter,
+    "ndjson": NdjsonWriter,
+    "csv": CsvWriter,
+}
+
+def open_writer(output_format, output):
+    """
+    Returns a writer for one of FORMATS that writes to the file output.
+    """
+    if output_format not in WRITERS:
+        raise ValueError("Unknown format %s, expected one of %s" % (output_format,
+                                                                   ", ".join(FORMATS)))
+    return WRITERS[output_format](output)
+
+# pylint: disable=too-few-public-methods
+class StreamingParser:
+    """
+    Parses results pages for scrape_amtrak.get_all_fares, writing each result to writer as soon
+    as it is parsed, and flushing after every page.
+    """
+
+    def __init__(self, writer, search=None):
+        self.writer = writer
+        self.search = search
+        self.written = 0
+
+    def __call__(self, page_source):
+        results = []
+        for result in amtrak_results.AmtrakResults.iter_html(page_source):
+            self.writer.write_result(result, self.search)
+            results.append(result)
+        self.written = self.written + len(results)
+        self.writer.flush()
+        return results
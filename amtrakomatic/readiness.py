@@ -0,0 +1,100 @@
+"""
+Explicit waits for the pages of the amtrak site.  Each step waits until the page it needs has
+loaded, and lookups for things that may legitimately not be there return at once, instead of
+every lookup waiting out an implicit timeout.
+"""
+
+import contextlib
+import logging
+import time
+import attr
+from amtrakomatic import metrics
+
+DEFAULT_TIMEOUT = 30
+POLL_INTERVAL = 0.1
+
+ANCILLARY_HANDLER = \
+    "_handler=amtrak.presentation.handler.request.rail.AmtrakAncillaryProductsRequestHandler"
+
+# pylint: disable=too-few-public-methods
+@attr.s(auto_attribs=True, frozen=True)
+class PageMarker:
+    """
+    Something that is only on one page of the site, found with the driver's
+    find_elements_by_<kind> method.
+    """
+    kind: str
+    value: str
+
+    def find(self, driver):
+        """
+        Returns the matching elements on the current page, without waiting.
+        """
+        return getattr(driver, "find_elements_by_" + self.kind)(self.value)
+
+PAGES = {
+    "search_form": PageMarker("id", "findtrains"),
+    "sign_in": PageMarker("name", "_password"),
+    "results": PageMarker("css_selector", "table.newFareFamilyTable"),
+    "pagination": PageMarker("css_selector", "a.pagination_page"),
+    "ancillary": PageMarker("name", ANCILLARY_HANDLER),
+    "passenger_info": PageMarker(
+        "xpath", "//span[contains(text(), 'No, I choose not to protect my')]"),
+    "checkout": PageMarker("xpath", "//*[@id='amtrakTotal' or @id='total_points_redeemed']"),
+}
+
+@contextlib.contextmanager
+def timed_step(name):
+    """
+    Logs how long the with block took.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        logging.info("%s took %.2fs", name, time.perf_counter() - start)
+
+def is_loaded(driver, name):
+    """
+    Returns whether the named page is loaded right now, without waiting.
+    """
+    return bool(PAGES[name].find(driver))
+
+def wait_for_any(driver, names, timeout=DEFAULT_TIMEOUT):
+    """
+    Waits until one of the named pages is loaded and returns its name.  If several are, the first
+    one in names wins.  Raises selenium's TimeoutException if none load within timeout seconds.
+    """
+    # pylint: disable=import-outside-toplevel
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    def loaded_page(driver):
+        for name in names:
+            if is_loaded(driver, name):
+                return name
+        return False
+
+    with timed_step("Waiting for %s" % " or ".join(names)), \
+            metrics.span("wait_for:%s" % "|".join(names)):
+        return WebDriverWait(driver, timeout, poll_frequency=POLL_INTERVAL).until(
+            loaded_page, "None of %s loaded" % ", ".join(names))
+
+def wait_for(driver, name, timeout=DEFAULT_TIMEOUT):
+    """
+    Waits until the named page is loaded and returns the elements that mark it.
+    """
+    wait_for_any(driver, [name], timeout)
+    return PAGES[name].find(driver)
+
+def wait_until_text_changes(driver, element_id, text, timeout=DEFAULT_TIMEOUT):
+    """
+    Waits until the element with element_id shows something other than text, for example because
+    the page has shown other results in place.
+    """
+    # pylint: disable=import-outside-toplevel
+    from selenium.webdriver.support.ui import WebDriverWait
+    with timed_step("Waiting for %s to change" % element_id), \
+            metrics.span("wait_for_change:%s" % element_id):
+        WebDriverWait(driver, timeout, poll_frequency=POLL_INTERVAL).until(
+            lambda driver: driver.find_element_by_id(element_id).text != text,
+            "%s did not change" % element_id)
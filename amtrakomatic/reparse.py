@@ -0,0 +1,105 @@
+"""
+Parses saved results pages again in bulk, for example after the parser changes, spreading the
+pages over a pool of processes and writing the results as JSON lines.
+"""
+
+import concurrent.futures
+import glob
+import json
+import os
+import attr
+from amtrakomatic import amtrak_results
+from amtrakomatic import archive
+
+# How many pages a worker process is handed at a time.  Pages take tens of milliseconds each, so
+# this keeps the cost of passing work around small without leaving processes idle at the end.
+DEFAULT_CHUNKSIZE = 16
+
+@attr.s(auto_attribs=True, frozen=True)
+class PageSource:
+    """
+    Where to read one saved page: a file, or an entry of a PageArchive in directory.
+    """
+    path: str
+    entry: archive.ArchiveEntry = None
+
+    def name(self):
+        """
+        Identifies the page in the output.
+        """
+        if self.entry is None:
+            return self.path
+        return "%s:%s:%s" % (self.path, self.entry.segment, self.entry.offset)
+
+    def search(self):
+        """
+        Returns the search the page came from as a dict, or None if it is not known.
+        """
+        if self.entry is not None:
+            return {"source": self.entry.source, "destination": self.entry.destination,
+                    "date": self.entry.date, "use_points": self.entry.use_points,
+                    "page": self.entry.page}
+        match = archive.DUMP_FILENAME.match(os.path.basename(self.path))
+        if not match:
+            return None
+        return {"source": match.group("source"), "destination": match.group("destination"),
+                "date": "%s/%s/%s" % (match.group("month"), match.group("day"),
+                                      match.group("year")),
+                "use_points": match.group("use_points") == "True",
+                "page": int(match.group("page"))}
+
+    def read(self):
+        """
+        Returns the html of the page.
+        """
+        if self.entry is None:
+            with open(self.path) as page:
+                return page.read()
+        return archive.read_page(self.path, self.entry)
+
+def find_pages(location):
+    """
+    Returns a PageSource for every page in location, which can be a PageArchive directory, a
+    directory of .html pages like those older versions dumped, or a glob of pages.
+    """
+    if os.path.isdir(location):
+        if os.path.exists(os.path.join(location, archive.INDEX_FILENAME)):
+            return [PageSource(location, entry)
+                    for entry in archive.PageArchive(location).entries()]
+        location = os.path.join(location, "*.html")
+    return [PageSource(path) for path in sorted(glob.glob(location))]
+
+def parse_page(page_source):
+    """
+    Parses one page and returns (succeeded, JSON line).  Failures are reported in the line rather
+    than raised, so that one bad page does not stop the rest.
+    """
+    record = {"page": page_source.name(), "search": page_source.search()}
+    try:
+        results = amtrak_results.AmtrakResults.from_html(page_source.read())
+        record["results"] = [attr.asdict(result) for result in results.results]
+        succeeded = True
+    except archive.READ_ERRORS + amtrak_results.PARSE_ERRORS as exception:
+        record["error"] = "%s: %s" % (type(exception).__name__, exception)
+        succeeded = False
+    return succeeded, json.dumps(record)
+
+def reparse(page_sources, output, jobs=None, chunksize=DEFAULT_CHUNKSIZE, progress=None):
+    """
+    Parses pages on jobs processes (one per CPU by default), writing one JSON line per page to
+    the output file in the same order as page_sources.  Calls progress(page_source, succeeded)
+    after each page if given.  Returns how many pages were parsed and how many failed.
+    """
+    parsed = 0
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        for page_source, (succeeded, line) in zip(
+                page_sources, executor.map(parse_page, page_sources, chunksize=chunksize)):
+            output.write(line + "\n")
+            if succeeded:
+                parsed = parsed + 1
+            else:
+                failed = failed + 1
+            if progress is not None:
+                progress(page_source, succeeded)
+    return parsed, failed
@@ -3,33 +3,68 @@ Functions to scrape the amtrak site.
 """
 
 import csv
+import functools
 import os
 import sys
 import logging
-from selenium import webdriver
-from bs4 import BeautifulSoup
 from amtrakomatic import fuzzy_match
 from amtrakomatic import amtrak_results
+from amtrakomatic import metrics
+from amtrakomatic import readiness
 
 logging.basicConfig(level=logging.INFO)
 
+# The element saying which of the results are shown, as in "Displaying 1 - 10 results of 13".
+PAGINATION_DATA_ID = "pagination_data"
+
+# How get_all_fares fetches results: by driving Firefox, or by posting the search form over HTTP.
+BACKENDS = ("browser", "http")
+DEFAULT_BACKEND = "browser"
+
+class TrainNotFound(LookupError):
+    """
+    Raised when the train to click on is not among the results of a search.
+    """
+
+def search_errors():
+    """
+    Returns the exception types a search, or pricing a trip, fails with when the site, the browser
+    or the connection to them misbehaves, or a page is not what it should be, for callers that
+    carry on past a failed search.  Anything else is a bug, and is left to propagate.
+    """
+    # pylint: disable=import-outside-toplevel
+    import requests
+    import urllib3
+    from selenium.common import exceptions
+    from amtrakomatic import driver_pool
+    return (exceptions.WebDriverException, requests.RequestException, urllib3.exceptions.HTTPError,
+            OSError, driver_pool.PoolClosed) + amtrak_results.PARSE_ERRORS
+
+@metrics.timed("load_amtrak_site")
 def load_amtrak_site(driver):
     """
-    Load the amtrak homepage.
+    Load the amtrak homepage, or a stand-in's if AMTRAKOMATIC_SITE_URL is set.
     """
-    driver.get("https://www.amtrak.com/home.html")
+    # pylint: disable=import-outside-toplevel
+    from amtrakomatic import http_fetch
+    with readiness.timed_step("Loading the homepage"):
+        driver.get(http_fetch.site_urls()[0])
+        readiness.wait_for(driver, "search_form")
 
+@metrics.timed("login")
 def login(driver):
     """
     Log in to the configured amtrak account.
     """
     driver.find_element_by_xpath("//button[contains(text(),'Sign In')]").click()
+    readiness.wait_for(driver, "sign_in")
     driver.find_element_by_name("_password").clear()
     driver.find_element_by_name("_password").send_keys(os.environ['AMTRAK_GUEST_REWARDS_PASSWORD'])
     driver.find_element_by_name("_name").clear()
     driver.find_element_by_name("_name").send_keys(os.environ['AMTRAK_GUEST_REWARDS_USERNAME'])
     driver.find_element_by_xpath("//button[contains(text(),'SIGN IN')]").click()
 
+@metrics.timed("fill_search_parameters")
 def fill_search_parameters(driver, source, dest, date):
     """
     Perform a search with the given parematers.
@@ -47,13 +82,14 @@ def fill_search_parameters(driver, source, dest, date):
     from_field = "%s[5]/following::input[2]" % base_selector("From")
     to_field = "%s[5]/following::input[2]" % base_selector("To")
     date_field = "%s[3]/following::input[1]" % base_selector("Depart")
+    (_, source_code), (_, dest_code) = fuzzy_match.stations([source, dest])
 
     driver.find_element_by_xpath(from_field).click()
     driver.find_element_by_xpath(from_field).clear()
-    driver.find_element_by_xpath(from_field).send_keys(fuzzy_match.station(source)[1])
+    driver.find_element_by_xpath(from_field).send_keys(source_code)
     driver.find_element_by_xpath(to_field).click()
     driver.find_element_by_xpath(to_field).clear()
-    driver.find_element_by_xpath(to_field).send_keys(fuzzy_match.station(dest)[1])
+    driver.find_element_by_xpath(to_field).send_keys(dest_code)
     driver.find_element_by_xpath(date_field).click()
     driver.find_element_by_xpath(date_field).clear()
     driver.find_element_by_xpath(date_field).send_keys(date)
@@ -76,70 +112,92 @@ def select_dollars(driver):
     driver.find_element_by_xpath(
         "(.//*[contains(text(), 'Done')])[1]/following::span[4]").click()
 
+@metrics.timed("search")
 def search(driver):
     """
     Click search button to start search.
     """
     driver.find_element_by_id("findtrains").click()
+    readiness.wait_for(driver, "results")
 
+@metrics.timed("skip_dog_page")
 def skip_dog_page(driver):
     """
-    I don't have a dog.
+    I don't have a dog.  Waits for whichever of the dog page or the passenger information page
+    comes up, and only looks for the dog buttons if it is the dog page.
     """
-    dog_buttons = driver.find_elements_by_name(
-        "_handler=amtrak.presentation.handler.request.rail.AmtrakAncillaryProductsRequestHandler")
-    for dog_button in dog_buttons:
-        dog_button.click()
+    if readiness.wait_for_any(driver, ["passenger_info", "ancillary"]) == "ancillary":
+        for dog_button in readiness.PAGES["ancillary"].find(driver):
+            dog_button.click()
 
+@metrics.timed("fill_passenger_information")
 def fill_passenger_information(driver):
     """
     Just skip travel insurance.  Note this assumes your profile is complete.
     """
-    driver.find_element_by_xpath(
-        "//span[contains(text(), 'No, I choose not to protect my')]").click()
+    readiness.wait_for(driver, "passenger_info")[0].click()
     driver.find_element_by_xpath("//input[@value='Continue']").click()
 
+@metrics.timed("get_price")
 def get_price(driver, use_points):
     """
     Get price from result page.
     """
+    readiness.wait_for(driver, "checkout")
     if use_points:
         return driver.find_element_by_id("total_points_redeemed")
     return driver.find_element_by_id("amtrakTotal")
 
+@metrics.timed("load_results_page")
+def load_results_page(driver, page):
+    """
+    Shows a later page of results.  The site pages through results in the page itself, by hiding
+    and showing result tables, so this waits for the "Displaying ..." line above them to change.
+    """
+    with readiness.timed_step("Showing page %s" % page):
+        shown = driver.find_element_by_id(PAGINATION_DATA_ID).text
+        driver.find_element_by_xpath("//a[text()='%s']" % page).click()
+        readiness.wait_until_text_changes(driver, PAGINATION_DATA_ID, shown)
+
+def parse_results(page_source):
+    """
+    Parses a results page into a list of AmtrakResult.
+    """
+    return amtrak_results.AmtrakResults.from_html(page_source).results
+
 # pylint: disable=too-many-arguments,too-many-locals
+@metrics.timed("get_search_results")
 def get_search_results(driver, source, destination, date, using_points, train_name_to_click=None,
-                       dump_html_source=False):
-    """
-    Assuming we are on search results page, get all the prices.
-    """
-    logging.debug("Finding pagination links")
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
-    # Use beautiful soup to test if we have page links because it's much faster...
-    if not soup.find("a", "pagination_page"):
-        pagination_links = []
-    else:
-        pagination_links = driver.find_elements_by_xpath("//a[contains(@class, 'pagination_page')]")
-
-    def handle_page(page):
-        if dump_html_source:
-            with open("%s_%s_%s_%s_%s.html" % (source, destination, date.replace("/", "_"),
-                                               using_points, page), "w+") as source_dump:
-                source_dump.write(driver.page_source)
-        return amtrak_results.AmtrakResults.from_html(driver.page_source).results
-
-    def check_for_ticket(name, results):
-        ticket = None
-        for result in results:
-            for leg in result.legs:
-                if leg["train_name"] == name:
-                    ticket = result
-                    break
-        return ticket
+                       archive=None, pages=None, parser=None):
+    """
+    Assuming we are on search results page, get all the prices.  If given a PageArchive, the
+    results page is saved to it.  If pages is a list, the source of the results page is appended
+    to it.  The page is parsed into a list of results by parser if given, which can for example
+    skip pages it has seen before.
+
+    The site pages through results in the page itself, so the page a search lands on already
+    holds every result, with those on later pages hidden.  Its source is fetched from the browser
+    once, and that one string is parsed and archived.  Later pages are only shown to click on a
+    train that is on one of them.
+    """
+    parse = parser or parse_results
+
+    def fare_selector(ticket):
+        return "//input[@value='%s']" % ticket.minimum_fare_value_attribute
+
+    def find_ticket(page_source, name):
+        # Stops parsing at the first result with the train, since it is the one we click.
+        for result in amtrak_results.AmtrakResults.iter_html(page_source):
+            if result.has_train(name):
+                return result
+        return None
+
+    def is_shown(ticket):
+        return any(element.is_displayed()
+                   for element in driver.find_elements_by_xpath(fare_selector(ticket)))
 
     def click_on_ticket(ticket):
         add_to_cart_selector = "//input[@name=\"%s\"]" % ticket.add_to_cart_button_name_attribute
-        price_selector = "//input[@value='%s']" % ticket.minimum_fare_value_attribute
 
         # There's a weird thing when searching for points where the result page looks like it's
         # completely duplicated but one of them is hidden.  Maybe be a round trip thing?
@@ -155,84 +213,245 @@ def get_search_results(driver, source, destination, date, using_points, train_na
             if last_exception:
                 raise last_exception
 
-        try_to_click_all(driver.find_elements_by_xpath(price_selector))
+        try_to_click_all(driver.find_elements_by_xpath(fare_selector(ticket)))
         try_to_click_all(driver.find_elements_by_xpath(add_to_cart_selector))
 
-    results = []
-    # Make sure we get all pages
-    for page in range(1, len(pagination_links) + 1):
-        logging.debug("Finding page %s", page)
-        driver.find_element_by_xpath("//a[text()='%s']" % page).click()
-        current_page_results = handle_page(page)
-        if train_name_to_click:
-            ticket = check_for_ticket(train_name_to_click, current_page_results)
-            if ticket:
-                click_on_ticket(ticket)
-                return amtrak_results.AmtrakResults([ticket])
-        results.extend(current_page_results)
-    if not pagination_links:
-        current_page_results = handle_page(0)
-        if train_name_to_click:
-            ticket = check_for_ticket(train_name_to_click, current_page_results)
-            if ticket:
-                click_on_ticket(ticket)
-                return amtrak_results.AmtrakResults([ticket])
-        results.extend(current_page_results)
+    page_source = driver.page_source
+    metrics.count("pages")
+    if pages is not None:
+        pages.append(page_source)
+    # Single page results are page 0, paginated ones are numbered from 1.
+    page_numbers = amtrak_results.pagination_pages(page_source) or [0]
+    logging.debug("Found pages %s", page_numbers)
+    if archive is not None:
+        archive.add(source, destination, date, using_points, page_numbers[0], page_source)
+
     if train_name_to_click:
-        raise Exception("Attempted to click on a train but did not find it: %s" % (
-            train_name_to_click))
-    return amtrak_results.AmtrakResults(results)
+        ticket = find_ticket(page_source, train_name_to_click)
+        if ticket is None:
+            raise TrainNotFound("Attempted to click on a train but did not find it: %s" % (
+                train_name_to_click))
+        # The fare buttons of results on hidden pages cannot be clicked.
+        for page in page_numbers[1:]:
+            if is_shown(ticket):
+                break
+            load_results_page(driver, page)
+        click_on_ticket(ticket)
+        return amtrak_results.AmtrakResults([ticket])
+    return amtrak_results.AmtrakResults(parse(page_source))
 
-def get_all_fares(source, destination, date, use_points=False):
+def log_in_session(driver):
     """
-    Get all prices for a given search.
+    Warms up a new browser session by logging in from the homepage.
     """
-    driver = webdriver.Firefox()
-    driver.implicitly_wait(10)
     load_amtrak_site(driver)
-    fill_search_parameters(driver, source, destination, date)
-    if use_points:
-        select_points(driver)
-    else:
-        select_dollars(driver)
-    search(driver)
-    results = get_search_results(driver, source, destination, date, use_points)
-    driver.quit()
+    login(driver)
+    load_amtrak_site(driver)
+
+# pylint: disable=too-many-arguments
+def new_driver_pool(size=1, log_in=False, headless=False, max_uses=None,
+                    backend=DEFAULT_BACKEND):
+    """
+    Creates a pool of Firefox sessions, logged in to the configured amtrak account if log_in is
+    set.  Sessions are replaced after max_uses searches, driver_pool.DEFAULT_MAX_USES by default.
+    With the http backend, the pool holds http_fetch.HttpSessions instead, which can only be used
+    for get_all_fares.
+    """
+    # pylint: disable=import-outside-toplevel
+    from amtrakomatic import driver_pool
+    from amtrakomatic import http_fetch
+    if max_uses is None:
+        max_uses = driver_pool.DEFAULT_MAX_USES
+    if backend == "http":
+        if log_in:
+            raise ValueError("The http backend cannot log in")
+        return driver_pool.DriverPool(size=size, max_uses=max_uses,
+                                      factory=http_fetch.HttpSession)
+    if backend != "browser":
+        raise ValueError("Unknown backend %s, expected one of %s" % (backend, ", ".join(BACKENDS)))
+    return driver_pool.DriverPool(
+        size=size,
+        max_uses=max_uses,
+        factory=functools.partial(driver_pool.firefox_driver, headless=headless),
+        warm_up=log_in_session if log_in else None)
+
+# pylint: disable=too-many-arguments
+def get_all_fares(source, destination, date, use_points=False, pool=None, cache=None,
+                  refresh=False, archive=None, parser=None, history=None):
+    """
+    Get all prices for a given search.  Uses a session from pool if given, which can be a browser
+    or an HTTP session depending on the pool's backend, otherwise starts a browser just for this
+    search.  If given a cache, results from it are used unless refresh is set, and new results
+    are saved to it.  If given a PageArchive, every results page fetched is saved to it.  Pages
+    are parsed by parser if given, as in get_search_results.  If given a history.FareHistory,
+    results fetched from the site, rather than the cache, are recorded in it.
+    """
+    if cache is not None and not refresh:
+        results = cache.get(source, destination, date, use_points)
+        if results is not None:
+            logging.debug("Using cached results for %s to %s on %s", source, destination, date)
+            metrics.count("cache_hits")
+            return results
+    if pool is None:
+        with new_driver_pool(max_uses=1) as new_pool:
+            return get_all_fares(source, destination, date, use_points, new_pool, cache,
+                                 refresh=True, archive=archive, parser=parser,
+                                 history=history)
+    # pylint: disable=import-outside-toplevel
+    from amtrakomatic import http_fetch
+    pages = []
+    metrics.count("searches")
+    with pool.session() as driver:
+        # Pools made with the http backend hand out HttpSessions instead of browsers.
+        if isinstance(driver, http_fetch.HttpSession):
+            results = http_search(driver, source, destination, date, use_points, archive, pages,
+                                  parser)
+        else:
+            results = browser_search(driver, source, destination, date, use_points, archive,
+                                     pages, parser)
+    if cache is not None:
+        cache.put(source, destination, date, use_points, results, pages)
+    if history is not None:
+        history.record(source, destination, date, use_points, results)
     return results
 
+# pylint: disable=too-many-arguments
+def browser_search(driver, source, destination, date, use_points, archive=None, pages=None,
+                   parser=None):
+    """
+    Searches from the homepage in a browser session and reads all the results.
+    """
+    load_amtrak_site(driver)
+    with readiness.timed_step("Searching"):
+        fill_search_parameters(driver, source, destination, date)
+        if use_points:
+            select_points(driver)
+        else:
+            select_dollars(driver)
+        search(driver)
+    return get_search_results(driver, source, destination, date, use_points, archive=archive,
+                              pages=pages, parser=parser)
+
+# pylint: disable=too-many-arguments
+def http_search(session, source, destination, date, use_points, archive=None, pages=None,
+                parser=None):
+    """
+    Searches by posting the search form from an http_fetch.HttpSession and parses all the results.
+    """
+    with readiness.timed_step("Searching over HTTP"):
+        page_sources = session.search_pages(source, destination, date, use_points)
+    parse = parser or parse_results
+    results = []
+    metrics.count("pages", len(page_sources))
+    for page, page_source in enumerate(page_sources):
+        if archive is not None:
+            archive.add(source, destination, date, use_points, page, page_source)
+        if pages is not None:
+            pages.append(page_source)
+        results.extend(parse(page_source))
+    return amtrak_results.AmtrakResults(results)
+
 # pylint: disable=too-many-arguments
 def handle_specific_trip(driver, source, destination, date, name, use_points):
     """
     Does all the clicking an automation necessary to get the price for a specific trip.
     """
-    fill_search_parameters(driver, source, destination, date)
-    if use_points:
-        select_points(driver)
-    else:
-        select_dollars(driver)
-    search(driver)
+    with readiness.timed_step("Searching"):
+        fill_search_parameters(driver, source, destination, date)
+        if use_points:
+            select_points(driver)
+        else:
+            select_dollars(driver)
+        search(driver)
     results = get_search_results(driver, source, destination, date, use_points, name)
     skip_dog_page(driver)
     fill_passenger_information(driver)
     return results, get_price(driver, use_points).text
 
-def iterate_csv_trips(csv_trips_filename, interactive):
+def read_csv_trips(csv_trips_filename):
     """
-    Given a CSV file, iterate all the trips by loading the actual page.
+    Reads the trips in a CSV file, one list of fields per trip.
     """
     with open(csv_trips_filename) as amtrak_trips_file:
-        driver = webdriver.Firefox()
-        driver.implicitly_wait(10)
-        load_amtrak_site(driver)
-        login(driver)
+        return list(csv.reader(amtrak_trips_file, delimiter=',', quotechar='"'))
+
+def price_csv_trip(pool, search_info):
+    """
+    Gets to the checkout page for one trip from a CSV file using a session from pool, returning
+    the ticket and its price.
+    """
+    use_points = search_info[4].strip() == "points"
+    with pool.session() as driver:
         load_amtrak_site(driver)
-        reader = csv.reader(amtrak_trips_file, delimiter=',', quotechar='"')
-        total_dollars = 0
-        total_points = 0
-        for search_info in reader:
+        results, price = handle_specific_trip(driver, search_info[0], search_info[1],
+                                              search_info[2], search_info[3].rstrip(), use_points)
+    # The ticket clicked on is the only result.
+    return results.results[0], price
+
+def csv_trip_cost(search_info, price):
+    """
+    Returns what a priced trip from a CSV file costs, as a (dollars, points) tuple.
+    """
+    use_points = search_info[4].strip() == "points"
+    fare = amtrak_results.Fare.parse(price, use_points)
+    if use_points:
+        return 0, fare.amount
+    return fare.amount / 100, 0
+
+def price_csv_trips(pool, trips, jobs, retries=0, backoff=None):
+    """
+    Prices trips on up to jobs sessions from pool at once, yielding (trip, future) in the same
+    order as trips once each is done.  A future's result is ((ticket, price), attempts), where a
+    trip that fails is tried up to retries more times with backoff, or the error of its last
+    attempt, waiting batch.DEFAULT_BACKOFF before the first retry unless given.  If the caller
+    stops early, the trips that have not started yet are cancelled.
+    """
+    # pylint: disable=import-outside-toplevel
+    import concurrent.futures
+    from amtrakomatic import batch
+    if backoff is None:
+        backoff = batch.DEFAULT_BACKOFF
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(batch.with_retries,
+                                   functools.partial(price_csv_trip, pool, trip), search_errors(),
+                                   retries, backoff)
+                   for trip in trips]
+        try:
+            for trip, future in zip(trips, futures):
+                concurrent.futures.wait([future])
+                yield trip, future
+        finally:
+            for future in futures:
+                future.cancel()
+
+# pylint: disable=too-many-arguments,too-many-locals
+def iterate_csv_trips(csv_trips_filename, interactive, pool=None, jobs=1, journal=None,
+                      retries=0, backoff=None, writer=None):
+    """
+    Given a CSV file, iterate all the trips by loading the actual page.  Uses browser sessions
+    from pool if given, which must be logged in, otherwise starts browsers for this file.  Up to
+    jobs trips are priced at once, except in interactive mode which always goes one at a time.
+
+    Outside interactive mode, every row's outcome is recorded in the batch.BatchJournal at the
+    path journal if given, and rows it already has as priced are reported from it rather than
+    priced again, so a run that died can be resumed.  Trips that fail are retried up to retries
+    times, and if they still fail the other rows carry on.  Each row's outcome is written to the
+    output.Writer writer as soon as it is known, as text to stdout by default.  Returns how many
+    rows failed.
+    """
+    # pylint: disable=import-outside-toplevel
+    from amtrakomatic import batch
+    from amtrakomatic import output
+    if pool is None:
+        with new_driver_pool(size=jobs, log_in=True) as new_pool:
+            return iterate_csv_trips(csv_trips_filename, interactive, new_pool, jobs, journal,
+                                     retries, backoff, writer)
+    trips = read_csv_trips(csv_trips_filename)
+    if interactive:
+        for search_info in trips:
             use_points = search_info[4].strip() == "points"
-            load_amtrak_site(driver)
-            if interactive:
+            with pool.session() as driver:
+                load_amtrak_site(driver)
                 print(search_info)
                 print("\n")
                 ticket, price = handle_specific_trip(driver, search_info[0], search_info[1],
@@ -247,19 +466,37 @@ def iterate_csv_trips(csv_trips_filename, interactive):
                     if not go_to_next:
                         print("Exiting!")
                         sys.exit(0)
-            else:
-                ticket, price = handle_specific_trip(driver, search_info[0], search_info[1],
-                                                     search_info[2], search_info[3].rstrip(),
-                                                     use_points)
-                print(search_info)
-                if use_points:
-                    ticket.pretty_print()
-                    print("Price (points): %s" % price)
-                    total_points = total_points + int(price.replace(",", ""))
-                else:
-                    ticket.pretty_print()
-                    print("Price (dollars): %s" % price)
-                    total_dollars = total_dollars + float(price.replace("$", "").replace(",", ""))
-    print("Total point cost: %s" % total_points)
-    print("Total dollar cost: %s" % total_dollars)
-    driver.quit()
+        return 0
+    writer = writer or output.TableWriter(sys.stdout)
+    with batch.BatchJournal(journal or ":memory:") as trip_journal:
+        to_price = [trip for row, trip in enumerate(trips) if not trip_journal.done(row, trip)]
+        if len(to_price) < len(trips):
+            logging.info("Resuming from %s: %s of %s trips left to price", journal,
+                         len(to_price), len(trips))
+        priced = price_csv_trips(pool, to_price, jobs, retries, backoff)
+        for row, search_info in enumerate(trips):
+            entry = trip_journal.done(row, search_info)
+            if entry is not None:
+                writer.write_trip(row, search_info, entry.ticket, entry.price,
+                                  csv_trip_cost(search_info, entry.price))
+                writer.flush()
+                continue
+            _, future = next(priced)
+            try:
+                (ticket, price), attempts = future.result()
+            except search_errors() as exception:
+                logging.exception("Could not price %s", search_info)
+                metrics.count("failed_trips")
+                trip_journal.record_failed(row, search_info, exception, retries + 1)
+                writer.write_trip(row, search_info, error=exception)
+                writer.flush()
+                continue
+            cost = csv_trip_cost(search_info, price)
+            trip_journal.record_done(row, search_info, ticket, price, cost, attempts)
+            writer.write_trip(row, search_info, ticket, price, cost)
+            writer.flush()
+        total_dollars, total_points = trip_journal.totals(len(trips))
+        failures = trip_journal.failures(len(trips))
+    writer.write_totals(total_dollars, total_points, [row for row, _ in failures])
+    writer.flush()
+    return len(failures)
@@ -0,0 +1,37 @@
+"""
+What the stores kept in SQLite have in common: a file, in a directory made if needed, opened once
+for use from any thread, with its tables created when it is opened.
+"""
+
+import os
+import sqlite3
+import threading
+
+class SqliteStore:
+    """
+    Base for classes kept in a SQLite database at path, with the statements in schema run when it
+    is opened.  Subclasses use the connection in _connection, holding _lock while they do, and
+    options are passed on to sqlite3.connect.  The database is closed with the store.
+    """
+
+    def __init__(self, path, schema, **options):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        # Shared by every thread, one at a time under _lock.
+        self._connection = sqlite3.connect(path, check_same_thread=False, **options)
+        with self._connection:
+            for statement in schema:
+                self._connection.execute(statement)
+
+    def close(self):
+        """
+        Closes the underlying database.
+        """
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,481 @@
+"""
+A local stand-in for the Amtrak site that replays recorded results pages, so that the whole
+scraping workflow can be run, in a browser or over HTTP, and load tested without the live site.
+
+It serves a homepage with the search form fields and buttons the scraper looks for, a sign in
+page, and the recorded results pages, which page through their results in the page as the site's
+do.  It takes a trip added to the cart through the dog page and the passenger information page to
+a checkout page showing the fare that was picked.  Latency and errors can be added to its answers.
+"""
+
+import contextlib
+import functools
+import html
+import http.cookies
+import http.server
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+import typing
+import urllib.parse
+import attr
+from amtrakomatic import fuzzy_match
+from amtrakomatic import http_fetch
+from amtrakomatic import readiness
+from amtrakomatic import reparse
+
+HOMEPAGE_PATH = http_fetch.HOMEPAGE_PATH
+SEARCH_PATH = http_fetch.SEARCH_PATH
+SIGN_IN_PATH = "/login.html"
+LOG_ON_PATH = "/itd/amtrak/CMSProfileLogon"
+SESSION_COOKIE = "JSESSIONID"
+
+DATE_FIELD = http_fetch.RAIL_WORKFLOW + "/tripRequirements/journeyRequirements[1]/departDate.usdate"
+CART_HANDLER = ("_handler=amtrak.presentation.handler.request.rail.farefamilies."
+                "AmtrakRailFareFamiliesDepartAvailabilityRequestHandler")
+FARE_FIELD_SUFFIX = "@selectedPassengerFareBeanKey"
+PASSENGER_HANDLER = \
+    "_handler=amtrak.presentation.handler.request.rail.AmtrakPassengerInformationRequestHandler"
+
+# Recorded pages link and post to the live site, so these are made relative to keep a browser on
+# the stand-in.
+LIVE_SITE_URLS = ("https://www.amtrak.com", "https://tickets.amtrak.com")
+PAGINATION_DATA_PATTERN = re.compile(r'<div id="pagination_data">([^<]*)</div>')
+RESULT_FORM_PATTERN = re.compile(r'<form\b[^>]*\bid="(selectTrainForm\d+)"[^>]*>')
+# The site pages through results in the page, hiding and showing the form of each result and
+# changing the "Displaying ..." line above them when a page link is clicked.  The recorded page's
+# own scripts need the live site, so this does the same from what each recorded page shows.
+PAGINATION_SCRIPT = """<script>
+(function () {
+  var pages = %s;
+  document.querySelectorAll("a.pagination_page").forEach(function (link) {
+    link.addEventListener("click", function (event) {
+      event.preventDefault();
+      var page = pages[link.textContent.trim()];
+      if (!page) {
+        return;
+      }
+      document.getElementById("pagination_data").textContent = page.text;
+      document.querySelectorAll("form[id^=selectTrainForm]").forEach(function (form) {
+        form.style.display = page.shown.indexOf(form.id) >= 0 ? "" : "none";
+      });
+    });
+  });
+})();
+</script>
+"""
+FARE_BUTTON_PATTERN = re.compile(
+    r'%s"[^>]*\bvalue="(?P<key>[^"]+)"[^>]*>\s*<span[^>]*>\s*(?P<fare>[^<]*?)\s*</span>'
+    % re.escape(FARE_FIELD_SUFFIX))
+
+# The scraper finds the search form's fields by position, as the fifth "From", the fifth "To" and
+# the third "Depart" on the live homepage, where the other forms come first.
+OTHER_FORMS = [("Train Status", True), ("Schedules", True), ("Stations", False),
+               ("Deals", False)]
+
+def _attribute(value):
+    return html.escape(value, quote=True)
+
+def _page(title, body):
+    return ("<!DOCTYPE html>\n<html><head><title>%s</title></head><body>\n%s\n</body></html>\n"
+            % (html.escape(title), body))
+
+def homepage():
+    """
+    Returns the homepage, with the fare finder form taking the same fields the site's does.
+    """
+    fields = dict(http_fetch.search_form("", "", "", False))
+    visible = ["xwdf_origin", "wdf_origin", "xwdf_destination", "wdf_destination", DATE_FIELD,
+               "wdf_BookType_homepage", http_fetch.SEARCH_HANDLER]
+    hidden = "\n".join('<input type="hidden" name="%s" value="%s">' % (
+        _attribute(name), _attribute(value))
+                       for name, value in fields.items() if name not in visible)
+    other_forms = "\n".join(
+        '<div class="other-form" hidden><h2>%s</h2><span>From</span><span>To</span>%s</div>' % (
+            name, "<span>Depart</span>" if has_date else "")
+        for name, has_date in OTHER_FORMS)
+    return _page("Amtrak", """
+<form method="get" action="%(sign_in)s"><button type="submit">Sign In</button></form>
+%(other_forms)s
+<form method="post" action="%(search)s" name="farefinder">
+%(hidden)s
+<label>From</label>
+<input type="hidden" name="xwdf_origin" value="%(origin_path)s">
+<input type="text" name="wdf_origin">
+<label>To</label>
+<input type="hidden" name="xwdf_destination" value="%(destination_path)s">
+<input type="text" name="wdf_destination">
+<label>Depart</label>
+<input type="text" name="%(date)s">
+<button type="button">Done</button>
+<span>One-Way</span><span>Round-Trip</span><span>Multi-City</span>
+<label><input type="radio" name="wdf_BookType_homepage" value="" checked><span>Dollars</span></label>
+<label><input type="radio" name="wdf_BookType_homepage" value="redeem"><span>Points</span></label>
+<button type="submit" id="findtrains" name="%(handler)s" value="Find Trains">FIND TRAINS</button>
+</form>""" % {"sign_in": SIGN_IN_PATH, "other_forms": other_forms, "search": SEARCH_PATH,
+              "hidden": hidden, "origin_path": _attribute(fields["xwdf_origin"]),
+              "destination_path": _attribute(fields["xwdf_destination"]),
+              "date": _attribute(DATE_FIELD), "handler": _attribute(http_fetch.SEARCH_HANDLER)})
+
+def sign_in_page():
+    """
+    Returns the page with the sign in form.
+    """
+    return _page("Sign In", """
+<form method="post" action="%s" name="login">
+<input type="text" name="_name">
+<input type="password" name="_password">
+<button type="submit">SIGN IN</button>
+</form>""" % LOG_ON_PATH)
+
+def ancillary_page():
+    """
+    Returns the page asking whether a pet is coming along.
+    """
+    return _page("Traveling with a pet?", """
+<form method="post" action="%s">
+<input type="submit" name="%s" value="No, thanks">
+</form>""" % (SEARCH_PATH, _attribute(readiness.ANCILLARY_HANDLER)))
+
+def passenger_page():
+    """
+    Returns the passenger information page, which only asks about travel insurance.
+    """
+    return _page("Passenger Information", """
+<form method="post" action="%s">
+<label><input type="radio" name="insurance" value="decline">
+<span>No, I choose not to protect my trip.</span></label>
+<input type="submit" name="%s" value="Continue">
+</form>""" % (SEARCH_PATH, _attribute(PASSENGER_HANDLER)))
+
+def checkout_page(fare, use_points):
+    """
+    Returns the checkout page showing the total for a fare.
+    """
+    return _page("Review and Pay", '<span id="%s">%s</span>' % (
+        "total_points_redeemed" if use_points else "amtrakTotal", html.escape(fare)))
+
+def prepare_page(page_source):
+    """
+    Returns a recorded results page with its links made relative.
+    """
+    for live_site_url in LIVE_SITE_URLS:
+        page_source = page_source.replace(live_site_url, "")
+    return page_source
+
+def shown_results(page_source):
+    """
+    Returns the "Displaying ..." line of a recorded results page and the ids of the forms of the
+    results it shows.
+    """
+    text = PAGINATION_DATA_PATTERN.search(page_source)
+    shown = [match.group(1) for match in RESULT_FORM_PATTERN.finditer(page_source)
+             if not re.search(r"display:\s*none", match.group(0))]
+    return text.group(1) if text else "", shown
+
+@attr.s(auto_attribs=True)
+class Recording:
+    """
+    The pages of one recorded search by page number, which is 0 for a search with a single page,
+    the fare shown next to each fare button on them, and the page a search lands on: the first
+    page, with a script that pages through the results the way the site does.
+    """
+    pages: typing.Dict[int, str]
+    fares: typing.Dict[str, str]
+    landing_page: str
+
+    @classmethod
+    def from_pages(cls, pages):
+        """
+        Prepares the recorded pages of a search, given by page number, for replaying.
+        """
+        prepared = {page: prepare_page(page_source) for page, page_source in pages.items()}
+        fares = {}
+        for page_source in prepared.values():
+            fares.update((match.group("key"), html.unescape(match.group("fare")))
+                         for match in FARE_BUTTON_PATTERN.finditer(page_source))
+        landing_page = prepared[min(prepared)]
+        if len(prepared) > 1:
+            script = PAGINATION_SCRIPT % json.dumps({
+                str(page): dict(zip(["text", "shown"], shown_results(page_source)))
+                for page, page_source in prepared.items()})
+            end = landing_page.rfind("</body>")
+            end = len(landing_page) if end < 0 else end
+            landing_page = landing_page[:end] + script + landing_page[end:]
+        return cls(prepared, fares, landing_page)
+
+    def first_page(self):
+        """
+        Returns the page a search lands on.
+        """
+        return self.landing_page
+
+def load_recordings(location):
+    """
+    Returns a map of (source code, destination code, date, use_points) to the Recording of every
+    search saved in location, which can be a PageArchive directory, a directory of dumped pages or
+    a glob of them, as for reparse.  The last capture of a page in an archive wins.
+    """
+    searches = {}
+    for page_source in reparse.find_pages(location):
+        search = page_source.search()
+        if search is None:
+            continue
+        key = (search["source"], search["destination"], search["date"], search["use_points"])
+        searches.setdefault(key, {})[search["page"]] = page_source.read()
+    names = sorted({name for source, destination, _, _ in searches
+                    for name in [source, destination]})
+    codes = dict(zip(names, [code for _, code in fuzzy_match.stations(names)]))
+    return {(codes[source], codes[destination], date, use_points): Recording.from_pages(pages)
+            for (source, destination, date, use_points), pages in searches.items()}
+
+# pylint: disable=too-few-public-methods
+@attr.s(auto_attribs=True, frozen=True)
+class Faults:
+    """
+    What to add to every answer other than static files: a delay of latency seconds plus up to
+    latency_jitter more, and failing with error_status instead for error_rate of them.
+    """
+    latency: float = 0.0
+    latency_jitter: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 503
+
+# pylint: disable=too-few-public-methods
+@attr.s(auto_attribs=True)
+class SiteSession:
+    """
+    What the stand-in remembers about one visitor.
+    """
+    search: typing.Optional[tuple] = None
+    fare: typing.Optional[str] = None
+    signed_in: bool = False
+
+# pylint: disable=too-many-instance-attributes
+class StandInSite:
+    """
+    The state of a stand-in site: the recordings it replays, by search, the faults it adds, and
+    its visitors' sessions.  Every request is appended to requests_log as (method, path, client
+    port), so callers can see, for example, whether connections were kept alive.  Files in
+    static_directory are served as they are.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, recordings, faults=None, requests_log=None, static_directory=None,
+                 rng=None, sleep=time.sleep):
+        self.recordings = recordings
+        self.faults = faults or Faults()
+        self.requests_log = requests_log if requests_log is not None else []
+        self.static_directory = static_directory
+        self.rng = rng or random.Random()
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._session_ids = itertools.count(1)
+
+    def new_session(self):
+        """
+        Starts a session and returns its id.
+        """
+        with self._lock:
+            session_id = str(next(self._session_ids))
+            self._sessions[session_id] = SiteSession()
+        return session_id
+
+    def session(self, session_id):
+        """
+        Returns the session with the given id, or None.
+        """
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def fault(self):
+        """
+        Waits out the latency for an answer, and returns the status to fail it with, or None.
+        """
+        with self._lock:
+            delay = self.faults.latency + self.rng.uniform(0, self.faults.latency_jitter)
+            failed = self.rng.random() < self.faults.error_rate
+        if delay > 0:
+            self.sleep(delay)
+        return self.faults.error_status if failed else None
+
+class StandInHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Answers requests for the StandInSite of its server.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def site(self):
+        """
+        The site being served.
+        """
+        return self.server.site
+
+    def send_body(self, status, body, headers=()):
+        """
+        Sends a complete response with a body.
+        """
+        body = body.encode("utf-8")
+        self.send_response(status)
+        for header in headers:
+            self.send_header(*header)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def session_id(self):
+        """
+        Returns the id of the visitor's session, or None if they do not have one.
+        """
+        cookie = http.cookies.SimpleCookie(self.headers.get("Cookie", ""))
+        if SESSION_COOKIE in cookie and self.site.session(cookie[SESSION_COOKIE].value):
+            return cookie[SESSION_COOKIE].value
+        return None
+
+    def failed(self):
+        """
+        Applies the site's faults, and returns whether the request has been answered with an
+        error.
+        """
+        status = self.site.fault()
+        if status is None:
+            return False
+        self.send_body(status, "Service unavailable")
+        return True
+
+    # pylint: disable=invalid-name
+    def do_GET(self):
+        """
+        Serves the homepage, the sign in page, or a static file.
+        """
+        self.site.requests_log.append(("GET", self.path, self.client_address[1]))
+        path = urllib.parse.urlparse(self.path).path
+        if path not in (HOMEPAGE_PATH, SIGN_IN_PATH):
+            if self.site.static_directory is None:
+                self.send_body(404, "Not found")
+            else:
+                super().do_GET()
+            return
+        if self.failed():
+            return
+        session_id = self.session_id()
+        if path == HOMEPAGE_PATH:
+            # The homepage hands out the session cookie searches need.
+            headers = []
+            if session_id is None:
+                headers.append(("Set-Cookie", "%s=%s; Path=/" % (SESSION_COOKIE,
+                                                                 self.site.new_session())))
+            self.send_body(200, homepage(), headers)
+        else:
+            self.send_body(200, sign_in_page())
+
+    # pylint: disable=invalid-name
+    def do_POST(self):
+        """
+        Answers a sign in, a search, a trip added to the cart, or the pages after it.
+        """
+        self.site.requests_log.append(("POST", self.path, self.client_address[1]))
+        length = int(self.headers.get("Content-Length", 0))
+        form = urllib.parse.parse_qs(self.rfile.read(length).decode("utf-8"),
+                                     keep_blank_values=True)
+        if self.path not in (SEARCH_PATH, LOG_ON_PATH):
+            self.send_body(404, "Not found")
+            return
+        if self.failed():
+            return
+        session_id = self.session_id()
+        if session_id is None:
+            self.send_body(403, "No session")
+            return
+        session = self.site.session(session_id)
+        if self.path == LOG_ON_PATH:
+            session.signed_in = bool(form.get("_name", [""])[0] and
+                                     form.get("_password", [""])[0])
+            self.send_body(303, "", [("Location", HOMEPAGE_PATH)])
+        elif any(name.startswith(CART_HANDLER) for name in form):
+            self.add_to_cart(session, form)
+        elif readiness.ANCILLARY_HANDLER in form:
+            self.send_body(200, passenger_page())
+        elif PASSENGER_HANDLER in form:
+            if session.fare is None:
+                self.send_body(400, "Nothing in the cart")
+                return
+            self.send_body(200, checkout_page(session.fare, session.search[3]))
+        else:
+            self.search(session, form)
+
+    def search(self, session, form):
+        """
+        Answers a search with the first page of its recording.
+        """
+        search = (form.get("wdf_origin", [""])[0], form.get("wdf_destination", [""])[0],
+                  form.get(DATE_FIELD, [""])[0],
+                  form.get("wdf_BookType_homepage", [""])[0] == "redeem")
+        if search not in self.site.recordings:
+            self.send_body(404, "No recorded page for %s" % (search,))
+            return
+        session.search = search
+        session.fare = None
+        self.send_body(200, self.site.recordings[search].first_page())
+
+    def add_to_cart(self, session, form):
+        """
+        Remembers the fare picked for a trip, and answers with the dog page.
+        """
+        fare_keys = [values[0] for name, values in form.items()
+                     if name.endswith(FARE_FIELD_SUFFIX)]
+        recording = self.site.recordings.get(session.search)
+        if not fare_keys or recording is None or fare_keys[0] not in recording.fares:
+            self.send_body(400, "No fare selected")
+            return
+        session.fare = recording.fares[fare_keys[0]]
+        self.send_body(200, ancillary_page())
+
+def make_server(site, host="127.0.0.1", port=0):
+    """
+    Returns an HTTP server for site on host and port, or a free port if port is 0.
+    """
+    handler = functools.partial(StandInHandler, directory=site.static_directory or os.curdir)
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.site = site
+    return server
+
+@contextlib.contextmanager
+def serve(site, host="127.0.0.1", port=0):
+    """
+    Serves site for the duration of a with block, yielding its base URL.
+    """
+    server = make_server(site, host, port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield "http://%s:%s" % server.server_address[:2]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+@contextlib.contextmanager
+def pointed_at(base_url):
+    """
+    Makes searches in this process go to the site at base_url for the duration of a with block,
+    by setting AMTRAKOMATIC_SITE_URL.
+    """
+    previous = os.environ.get(http_fetch.SITE_URL_VARIABLE)
+    os.environ[http_fetch.SITE_URL_VARIABLE] = base_url
+    try:
+        yield base_url
+    finally:
+        if previous is None:
+            del os.environ[http_fetch.SITE_URL_VARIABLE]
+        else:
+            os.environ[http_fetch.SITE_URL_VARIABLE] = previous
@@ -0,0 +1,156 @@
+"""
+Searches a whole matrix of dates and routings in one process, sharing browser sessions and station
+matching, to find the cheapest day and the cheapest way to travel.
+"""
+
+import concurrent.futures
+import datetime
+import typing
+import attr
+from amtrakomatic import amtrak_results
+from amtrakomatic import fuzzy_match
+from amtrakomatic import scrape_amtrak
+
+DATE_FORMAT = "%m/%d/%Y"
+
+def date_range(date_from, date_to):
+    """
+    Returns every date from date_from to date_to inclusive, in the same MM/DD/YYYY format the
+    search form takes.
+    """
+    start = datetime.datetime.strptime(date_from, DATE_FORMAT).date()
+    end = datetime.datetime.strptime(date_to, DATE_FORMAT).date()
+    if end < start:
+        raise ValueError("Date range ends before it starts: %s to %s" % (date_from, date_to))
+    return [(start + datetime.timedelta(days=offset)).strftime(DATE_FORMAT)
+            for offset in range((end - start).days + 1)]
+
+@attr.s(auto_attribs=True, frozen=True)
+class Routing:
+    """
+    A way of getting from the first station to the last one, buying a separate ticket for each
+    segment between consecutive stations.
+    """
+    stations: typing.Tuple[str, ...]
+
+    def segments(self):
+        """
+        Returns the (source, destination) pairs that need a ticket.
+        """
+        return list(zip(self.stations, self.stations[1:]))
+
+    def __str__(self):
+        return " -> ".join(self.stations)
+
+def plan_routings(source, destination, vias=()):
+    """
+    Returns the direct routing followed by one routing per via.  Each via is a station, or a comma
+    separated list of stations to stop at in order.
+    """
+    routings = [Routing((source, destination))]
+    for via in vias:
+        stops = tuple(stop.strip() for stop in via.split(",") if stop.strip())
+        routings.append(Routing((source,) + stops + (destination,)))
+    return routings
+
+# pylint: disable=too-few-public-methods
+@attr.s(auto_attribs=True)
+class SweepPlan:
+    """
+    Every routing on every date.
+    """
+    dates: typing.List[str]
+    routings: typing.List[Routing]
+
+    def searches(self):
+        """
+        Returns the distinct (source code, destination code, date) searches the plan needs, in a
+        stable order.  Station names are matched once, so differently spelled names for the same
+        station share a search.
+        """
+        names = sorted({name for routing in self.routings for name in routing.stations})
+        codes = dict(zip(names, [code for _, code in fuzzy_match.stations(names)]))
+        searches = []
+        for date in self.dates:
+            for routing in self.routings:
+                for source, destination in routing.segments():
+                    search = (codes[source], codes[destination], date)
+                    if search not in searches:
+                        searches.append(search)
+        return searches, codes
+
+@attr.s(auto_attribs=True)
+class SweepRow:
+    """
+    The cheapest fare for each segment of a routing on one date, and their total.  The total is
+    None if any segment has no available fare.
+    """
+    date: str
+    routing: Routing
+    segment_fares: typing.List[typing.Optional[float]]
+    total: typing.Optional[float]
+
+# pylint: disable=too-many-arguments
+def run_searches(searches, pool, use_points=False, jobs=1, cache=None, refresh=False,
+                 archive=None, history=None):
+    """
+    Runs up to jobs searches at once on sessions from pool, returning a map of search to
+    AmtrakResults.  See scrape_amtrak.get_all_fares for cache, refresh, archive and history.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {search: executor.submit(scrape_amtrak.get_all_fares, search[0], search[1],
+                                           search[2], use_points, pool, cache, refresh, archive,
+                                           history=history)
+                   for search in searches}
+        return {search: future.result() for search, future in futures.items()}
+
+# pylint: disable=too-many-arguments,too-many-locals
+def run_sweep(plan, pool, use_points=False, jobs=1, cache=None, refresh=False, archive=None,
+              history=None):
+    """
+    Searches everything in the plan and returns a SweepRow for every routing on every date.
+    """
+    searches, codes = plan.searches()
+    results = run_searches(searches, pool, use_points, jobs, cache, refresh, archive, history)
+    rows = []
+    for date in plan.dates:
+        for routing in plan.routings:
+            segment_fares = [results[(codes[source], codes[destination], date)].cheapest_fare()
+                             for source, destination in routing.segments()]
+            total = None if None in segment_fares else sum(segment_fares)
+            rows.append(SweepRow(date, routing, segment_fares, total))
+    return rows
+
+def cheapest(rows):
+    """
+    Returns the cheapest row that has a fare, or None.
+    """
+    priced = [row for row in rows if row.total is not None]
+    return min(priced, key=lambda row: row.total) if priced else None
+
+def print_sweep(rows, use_points=False):
+    """
+    Prints every row, then the cheapest routing on each date and the cheapest date for each
+    routing.
+    """
+
+    def print_row(row):
+        price = amtrak_results.format_fare_value(row.total, use_points)
+        if len(row.segment_fares) > 1:
+            price = price + " (%s)" % " + ".join(
+                amtrak_results.format_fare_value(fare, use_points) for fare in row.segment_fares)
+        print("%-12s%-50s%s" % (row.date, row.routing, price))
+
+    print("%-12s%-50s%s" % ("Date", "Routing", "Cheapest"))
+    for row in rows:
+        print_row(row)
+    print("\nCheapest per date:")
+    for date in dict.fromkeys(row.date for row in rows):
+        best = cheapest([row for row in rows if row.date == date])
+        if best:
+            print_row(best)
+    print("\nCheapest per routing:")
+    for routing in dict.fromkeys(row.routing for row in rows):
+        best = cheapest([row for row in rows if row.routing == routing])
+        if best:
+            print_row(best)
@@ -0,0 +1,192 @@
+"""
+Polls the same searches over and over to catch fare changes, reporting only what changed since
+the last poll rather than every result again.  Pages that have not changed since they were last
+seen are not parsed again.
+"""
+
+import collections
+import hashlib
+import logging
+import random
+import threading
+import time
+import typing
+import attr
+from amtrakomatic import metrics
+from amtrakomatic import scrape_amtrak
+
+DEFAULT_INTERVAL = 15 * 60
+DEFAULT_JITTER = 60
+# Enough for every page of a few hundred searches.
+DEFAULT_MAX_PAGES = 1024
+
+ADDED = "added"
+REMOVED = "removed"
+FARE_CHANGED = "fare changed"
+SOLD_OUT = "sold out"
+AVAILABLE = "available again"
+
+# pylint: disable=too-few-public-methods
+@attr.s(auto_attribs=True, frozen=True)
+class Search:
+    """
+    One search to watch.
+    """
+    source: str
+    destination: str
+    date: str
+    use_points: bool = False
+
+    def __str__(self):
+        return "%s -> %s on %s" % (self.source, self.destination, self.date)
+
+@attr.s(auto_attribs=True, frozen=True)
+class FareChange:
+    """
+    Something that changed about one trip of a search between two polls.  For fare changes,
+    fare_class is the index of the fare among the trip's fares, counting from 1.
+    """
+    search: Search
+    trip: str
+    kind: str
+    fare_class: typing.Optional[int] = None
+    old: typing.Optional[str] = None
+    new: typing.Optional[str] = None
+
+    def __str__(self):
+        change = "%s: %s %s" % (self.search, self.trip, self.kind)
+        if self.fare_class is not None:
+            change = change + " in class %s" % self.fare_class
+        if self.old is not None or self.new is not None:
+            change = change + " (%s -> %s)" % (self.old or "-", self.new or "-")
+        return change
+
+def trip_key(result):
+    """
+    Identifies the same trip across polls by its trains and departure time.  The result_id on the
+    page is tied to the session it was fetched in, so it changes from one poll to the next.
+    """
+    trains = " + ".join(leg.train_name for leg in result.legs)
+    departure = result.legs[0].departure_time if result.legs else ""
+    return "%s at %s" % (trains, departure)
+
+def diff_fares(search, trip, old_fares, new_fares):
+    """
+    Returns a FareChange for every fare class whose fare changed, went out or came back.
+    """
+    changes = []
+    for fare_class, (old, new) in enumerate(zip(old_fares, new_fares), 1):
+        if old.text == new.text:
+            continue
+        if new.amount is None and old.amount is not None:
+            kind = SOLD_OUT
+        elif old.amount is None and new.amount is not None:
+            kind = AVAILABLE
+        elif old.amount == new.amount:
+            continue
+        else:
+            kind = FARE_CHANGED
+        changes.append(FareChange(search, trip, kind, fare_class, old.text, new.text))
+    return changes
+
+def diff_results(search, old_results, new_results):
+    """
+    Returns what changed between two sets of results of search, as a list of FareChange: trips
+    that were added or removed, and fares that changed, sold out or came back.
+    """
+    old_trips = {trip_key(result): result for result in old_results}
+    new_trips = {trip_key(result): result for result in new_results}
+    changes = []
+    for trip, result in new_trips.items():
+        if trip not in old_trips:
+            cheapest = result.cheapest()
+            changes.append(FareChange(search, trip, ADDED, new=cheapest.text if cheapest else None))
+            continue
+        changes.extend(diff_fares(search, trip, old_trips[trip].parsed_fares,
+                                  result.parsed_fares))
+    for trip in old_trips:
+        if trip not in new_trips:
+            changes.append(FareChange(search, trip, REMOVED))
+    return changes
+
+class PageMemo:
+    """
+    Parses results pages, remembering the results of the last max_pages distinct pages by a hash
+    of their content so that a page seen before is not parsed again.  Can be passed as the parser
+    to scrape_amtrak.get_all_fares.
+    """
+
+    def __init__(self, max_pages=DEFAULT_MAX_PAGES):
+        self.max_pages = max_pages
+        self._lock = threading.Lock()
+        self._parsed = collections.OrderedDict()
+
+    def __call__(self, page_source):
+        digest = hashlib.sha256(page_source.encode("utf-8")).digest()
+        with self._lock:
+            if digest in self._parsed:
+                self._parsed.move_to_end(digest)
+                metrics.count("pages_unchanged")
+                return self._parsed[digest]
+        results = scrape_amtrak.parse_results(page_source)
+        with self._lock:
+            self._parsed[digest] = results
+            while len(self._parsed) > self.max_pages:
+                self._parsed.popitem(last=False)
+        return results
+
+# pylint: disable=too-many-instance-attributes
+class Watcher:
+    """
+    Searches for every one of searches on each poll using sessions from pool, and reports what
+    changed since the previous poll.  The first poll only records the results to compare against.
+    Every poll is recorded in history if given a history.FareHistory.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, searches, pool, interval=DEFAULT_INTERVAL, jitter=DEFAULT_JITTER,
+                 memo=None, sleep=time.sleep, rng=None, history=None):
+        self.searches = searches
+        self.pool = pool
+        self.interval = interval
+        self.jitter = jitter
+        self.memo = memo or PageMemo()
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+        self.history = history
+        self.previous = {}
+
+    def poll(self):
+        """
+        Searches everything once and returns the changes since the last poll.  A search that fails
+        is logged and compared again on the next poll that succeeds.
+        """
+        changes = []
+        for search in self.searches:
+            try:
+                results = scrape_amtrak.get_all_fares(
+                    search.source, search.destination, search.date, search.use_points,
+                    self.pool, parser=self.memo, history=self.history).results
+            except scrape_amtrak.search_errors():
+                logging.exception("Could not search %s", search)
+                continue
+            if search in self.previous:
+                changes.extend(diff_results(search, self.previous[search], results))
+            else:
+                logging.info("Watching %s trips for %s", len(results), search)
+            self.previous[search] = results
+        metrics.count("fare_changes", len(changes))
+        return changes
+
+    def run(self, report, polls=None):
+        """
+        Polls every interval seconds, plus up to jitter more so that polls do not all land at the
+        same moment, calling report with each change.  Stops after polls polls if given.
+        """
+        done = 0
+        while polls is None or done < polls:
+            if done:
+                self.sleep(self.interval + self.rng.uniform(0, self.jitter))
+            for change in self.poll():
+                report(change)
+            done = done + 1
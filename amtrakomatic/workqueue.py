@@ -0,0 +1,604 @@
+"""
+A work queue for spreading searches and trip pricing over workers on many machines, each with
+its own browser sessions.  Producers enqueue jobs with a broker and workers lease them, run them
+and write the results back to it.
+
+A leased job belongs to its worker until its lease runs out, which a worker keeps pushing back
+while the job runs.  A worker that dies loses its lease, and the job is handed to another worker.
+A job that fails is queued again after a backoff until it has been tried max_attempts times.
+Enqueueing a job identical to one that is queued or running returns that job instead of adding
+another.
+
+The default broker keeps the queue in SQLite, which is enough for workers on one machine or on
+machines sharing a filesystem whose locks work.  With the redis package installed, a redis://
+URL keeps it in Redis instead.
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import typing
+import attr
+from amtrakomatic import amtrak_results
+from amtrakomatic import fuzzy_match
+from amtrakomatic import metrics
+from amtrakomatic import scrape_amtrak
+from amtrakomatic import sqlite_store
+
+DEFAULT_QUEUE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "amtrakomatic",
+                                  "queue.sqlite")
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+# Seconds before a failed job is tried again, doubling for every attempt after that.
+DEFAULT_BACKOFF = 30
+DEFAULT_POLL_INTERVAL = 5
+
+SEARCH = "search"
+TRIP = "trip"
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+@attr.s(auto_attribs=True, frozen=True)
+class Job:
+    """
+    A search, or with a train name, getting to the checkout page for that train.  Stations are
+    stored as codes, so that differently spelled jobs for the same search are identical.
+    """
+    source: str
+    destination: str
+    date: str
+    use_points: bool = False
+    train: typing.Optional[str] = None
+
+    @classmethod
+    def create(cls, source, destination, date, use_points=False, train=None):
+        """
+        Returns a job with its stations matched to their codes.
+        """
+        (_, source_code), (_, destination_code) = fuzzy_match.stations([source, destination])
+        return cls(source_code, destination_code, date, bool(use_points),
+                   train.strip() if train else None)
+
+    @property
+    def kind(self):
+        """
+        SEARCH or TRIP.
+        """
+        return TRIP if self.train else SEARCH
+
+    def to_json(self):
+        """
+        Returns the job as JSON.
+        """
+        return json.dumps(attr.asdict(self), sort_keys=True)
+
+    def dedupe_key(self):
+        """
+        Returns a key that identical jobs share.
+        """
+        return hashlib.sha256(self.to_json().encode("utf-8")).hexdigest()
+
+    def trip(self):
+        """
+        Returns the job as a row of a CSV of trips.
+        """
+        return [self.source, self.destination, self.date, self.train,
+                "points" if self.use_points else "dollars"]
+
+# pylint: disable=too-few-public-methods
+@attr.s(auto_attribs=True, frozen=True)
+class Lease:
+    """
+    A job handed to a worker, and how many times it has been handed out, counting this one.
+    """
+    job_id: int
+    job: Job
+    attempts: int
+
+@attr.s(auto_attribs=True, frozen=True)
+class JobStatus:
+    """
+    Where a job is, and once it is done, its result as JSON, or the last error if it failed.
+    """
+    job_id: int
+    job: Job
+    state: str
+    attempts: int
+    result: typing.Optional[str] = None
+    error: typing.Optional[str] = None
+
+    @property
+    def finished(self):
+        """
+        Whether the job is done or has failed for good.
+        """
+        return self.state in (DONE, FAILED)
+
+    def results(self):
+        """
+        Returns the AmtrakResults of a search job that is done.
+        """
+        return amtrak_results.AmtrakResults(
+            [amtrak_results.AmtrakResult(**result) for result in json.loads(self.result)])
+
+    def ticket(self):
+        """
+        Returns (ticket, price) for a trip job that is done.
+        """
+        priced = json.loads(self.result)
+        return amtrak_results.AmtrakResult(**priced["ticket"]), priced["price"]
+
+def run_job(job, pool, history=None):
+    """
+    Runs a job on a session from pool and returns its result as JSON: the results of a search, or
+    the ticket and price of a trip.
+    """
+    if job.kind == TRIP:
+        ticket, price = scrape_amtrak.price_csv_trip(pool, job.trip())
+        return json.dumps({"ticket": attr.asdict(ticket), "price": price})
+    results = scrape_amtrak.get_all_fares(job.source, job.destination, job.date, job.use_points,
+                                          pool, history=history)
+    return json.dumps([attr.asdict(result) for result in results.results])
+
+def backoff_delay(backoff, attempts):
+    """
+    Returns how long to wait before trying a job again that has failed attempts times.
+    """
+    return backoff * 2 ** (attempts - 1)
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY,
+        dedupe_key TEXT NOT NULL,
+        job TEXT NOT NULL,
+        state TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        worker TEXT,
+        available_at REAL NOT NULL,
+        lease_until REAL,
+        result TEXT,
+        error TEXT,
+        enqueued_at REAL NOT NULL,
+        finished_at REAL)""",
+    """CREATE UNIQUE INDEX IF NOT EXISTS jobs_in_flight ON jobs (dedupe_key)
+        WHERE state IN ('queued', 'leased')""",
+    "CREATE INDEX IF NOT EXISTS jobs_available ON jobs (state, available_at)",
+    "CREATE INDEX IF NOT EXISTS jobs_leased ON jobs (state, lease_until)",
+]
+
+class SqliteBroker(sqlite_store.SqliteStore):
+    """
+    A queue of jobs kept in SQLite at path.  Every change happens in one immediate transaction,
+    so any number of threads and processes can share the file.
+    """
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 backoff=DEFAULT_BACKOFF, clock=time.time):
+        # Transactions are begun by hand, so that they take the write lock up front.
+        super().__init__(path, SCHEMA, timeout=60, isolation_level=None)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.clock = clock
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def enqueue(self, job):
+        """
+        Queues a job and returns its id, or the id of the identical job already queued or
+        running.
+        """
+        with self._transaction() as connection:
+            found = connection.execute(
+                "SELECT id FROM jobs WHERE dedupe_key = ? AND state IN (?, ?)",
+                (job.dedupe_key(), QUEUED, LEASED)).fetchone()
+            if found is not None:
+                metrics.count("jobs_deduplicated")
+                return found[0]
+            now = self.clock()
+            metrics.count("jobs_enqueued")
+            return connection.execute(
+                "INSERT INTO jobs (dedupe_key, job, state, available_at, enqueued_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (job.dedupe_key(), job.to_json(), QUEUED, now, now)).lastrowid
+
+    def _expire_leases(self, connection, now):
+        connection.execute(
+            "UPDATE jobs SET state = ?, error = ?, worker = NULL, finished_at = ? "
+            "WHERE state = ? AND lease_until <= ? AND attempts >= ?",
+            (FAILED, "Lease expired", now, LEASED, now, self.max_attempts))
+        connection.execute(
+            "UPDATE jobs SET state = ?, worker = NULL, available_at = ? "
+            "WHERE state = ? AND lease_until <= ?", (QUEUED, now, LEASED, now))
+
+    def lease(self, worker, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """
+        Hands the job that has been waiting longest to worker for lease_seconds, returning a
+        Lease, or None if no job is waiting.  Jobs whose lease has run out are queued again first,
+        or fail if they have been tried max_attempts times.
+        """
+        with self._transaction() as connection:
+            now = self.clock()
+            self._expire_leases(connection, now)
+            found = connection.execute(
+                "SELECT id, job, attempts FROM jobs WHERE state = ? AND available_at <= ? "
+                "ORDER BY available_at, id LIMIT 1", (QUEUED, now)).fetchone()
+            if found is None:
+                return None
+            job_id, job, attempts = found
+            connection.execute(
+                "UPDATE jobs SET state = ?, worker = ?, lease_until = ?, attempts = ? "
+                "WHERE id = ?", (LEASED, worker, now + lease_seconds, attempts + 1, job_id))
+        return Lease(job_id, Job(**json.loads(job)), attempts + 1)
+
+    def _held(self, connection, job_id, worker):
+        found = connection.execute(
+            "SELECT attempts FROM jobs WHERE id = ? AND state = ? AND worker = ?",
+            (job_id, LEASED, worker)).fetchone()
+        return None if found is None else found[0]
+
+    def extend(self, job_id, worker, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """
+        Pushes back the end of worker's lease on a job, returning whether it still held it.
+        """
+        with self._transaction() as connection:
+            if self._held(connection, job_id, worker) is None:
+                return False
+            connection.execute("UPDATE jobs SET lease_until = ? WHERE id = ?",
+                               (self.clock() + lease_seconds, job_id))
+        return True
+
+    def complete(self, job_id, worker, result):
+        """
+        Records the result of a job, returning whether worker still held it.  A worker that lost
+        its lease has its result dropped, since the job has been handed to another.
+        """
+        with self._transaction() as connection:
+            if self._held(connection, job_id, worker) is None:
+                return False
+            connection.execute(
+                "UPDATE jobs SET state = ?, result = ?, error = NULL, finished_at = ? "
+                "WHERE id = ?", (DONE, result, self.clock(), job_id))
+        return True
+
+    def fail(self, job_id, worker, error):
+        """
+        Records that a job failed, queueing it again after a backoff unless it has been tried
+        max_attempts times.  Returns the job's new state, or None if worker no longer held it.
+        """
+        with self._transaction() as connection:
+            attempts = self._held(connection, job_id, worker)
+            if attempts is None:
+                return None
+            now = self.clock()
+            if attempts >= self.max_attempts:
+                connection.execute(
+                    "UPDATE jobs SET state = ?, error = ?, finished_at = ? WHERE id = ?",
+                    (FAILED, error, now, job_id))
+                return FAILED
+            connection.execute(
+                "UPDATE jobs SET state = ?, error = ?, worker = NULL, available_at = ? "
+                "WHERE id = ?",
+                (QUEUED, error, now + backoff_delay(self.backoff, attempts), job_id))
+        return QUEUED
+
+    def status(self, job_id):
+        """
+        Returns the JobStatus of a job, or None if there is no such job.
+        """
+        with self._lock:
+            found = self._connection.execute(
+                "SELECT job, state, attempts, result, error FROM jobs WHERE id = ?",
+                (job_id,)).fetchone()
+        if found is None:
+            return None
+        job, state, attempts, result, error = found
+        return JobStatus(job_id, Job(**json.loads(job)), state, attempts, result, error)
+
+    def counts(self):
+        """
+        Returns how many jobs are in each state.
+        """
+        with self._lock:
+            return dict(self._connection.execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+# Each script runs atomically in Redis.  Jobs are hashes at <prefix>:job:<id>, the ids of
+# queued jobs are in a sorted set by when they can run, the ids of leased jobs in another by
+# when their lease runs out, and the ids of queued and leased jobs by dedupe key in a hash.
+REDIS_ENQUEUE = """
+local existing = redis.call('HGET', KEYS[2], ARGV[1])
+if existing then return {tonumber(existing), 0} end
+local id = redis.call('INCR', KEYS[1])
+redis.call('HSET', ARGV[4] .. ':job:' .. id, 'job', ARGV[2], 'key', ARGV[1], 'state', 'queued',
+           'attempts', 0)
+redis.call('HSET', KEYS[2], ARGV[1], id)
+redis.call('ZADD', KEYS[3], ARGV[3], id)
+return {id, 1}
+"""
+
+REDIS_LEASE = """
+local now = tonumber(ARGV[1])
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+  local job_key = ARGV[4] .. ':job:' .. id
+  redis.call('ZREM', KEYS[2], id)
+  if tonumber(redis.call('HGET', job_key, 'attempts')) >= tonumber(ARGV[5]) then
+    redis.call('HSET', job_key, 'state', 'failed', 'error', 'Lease expired', 'worker', '')
+    redis.call('HDEL', KEYS[3], redis.call('HGET', job_key, 'key'))
+  else
+    redis.call('HSET', job_key, 'state', 'queued', 'worker', '')
+    redis.call('ZADD', KEYS[1], now, id)
+  end
+end
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, 1)
+if #ids == 0 then return false end
+local id = ids[1]
+local job_key = ARGV[4] .. ':job:' .. id
+redis.call('ZREM', KEYS[1], id)
+redis.call('ZADD', KEYS[2], ARGV[2], id)
+redis.call('HSET', job_key, 'state', 'leased', 'worker', ARGV[3])
+local attempts = redis.call('HINCRBY', job_key, 'attempts', 1)
+return {tonumber(id), redis.call('HGET', job_key, 'job'), attempts}
+"""
+
+REDIS_HELD = """
+local job_key = ARGV[4] .. ':job:' .. ARGV[1]
+if redis.call('HGET', job_key, 'state') ~= 'leased' or
+    redis.call('HGET', job_key, 'worker') ~= ARGV[2] then
+  return false
+end
+"""
+
+REDIS_EXTEND = REDIS_HELD + """
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+return 1
+"""
+
+# ARGV[3] is the result, or the error if ARGV[5] is 'failed'.  A failed job is queued again at
+# ARGV[6] unless it has been tried ARGV[7] times.
+REDIS_FINISH = REDIS_HELD + """
+redis.call('ZREM', KEYS[1], ARGV[1])
+local state = ARGV[5]
+if state == 'failed' and tonumber(redis.call('HGET', job_key, 'attempts')) < tonumber(ARGV[7]) then
+  redis.call('HSET', job_key, 'state', 'queued', 'error', ARGV[3], 'worker', '')
+  redis.call('ZADD', KEYS[3], ARGV[6], ARGV[1])
+  return 'queued'
+end
+redis.call('HDEL', KEYS[2], redis.call('HGET', job_key, 'key'))
+if state == 'done' then
+  redis.call('HSET', job_key, 'state', state, 'result', ARGV[3])
+else
+  redis.call('HSET', job_key, 'state', state, 'error', ARGV[3])
+end
+return state
+"""
+
+# pylint: disable=too-many-instance-attributes
+class RedisBroker:
+    """
+    The same queue as SqliteBroker, kept in Redis at url under keys starting with prefix, for
+    workers on machines that share nothing else.  Needs the redis package.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, url, prefix="amtrakomatic", max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 backoff=DEFAULT_BACKOFF, clock=time.time):
+        # pylint: disable=import-outside-toplevel,import-error
+        import redis
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.clock = clock
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self._enqueue = self._client.register_script(REDIS_ENQUEUE)
+        self._lease = self._client.register_script(REDIS_LEASE)
+        self._extend = self._client.register_script(REDIS_EXTEND)
+        self._finish = self._client.register_script(REDIS_FINISH)
+
+    def _key(self, name):
+        return "%s:%s" % (self.prefix, name)
+
+    def enqueue(self, job):
+        """
+        Queues a job and returns its id, or the id of the identical job already queued or
+        running.
+        """
+        job_id, added = self._enqueue(
+            keys=[self._key("ids"), self._key("in_flight"), self._key("queued")],
+            args=[job.dedupe_key(), job.to_json(), self.clock(), self.prefix])
+        metrics.count("jobs_enqueued" if added else "jobs_deduplicated")
+        return int(job_id)
+
+    def lease(self, worker, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """
+        Hands the job that has been waiting longest to worker, as SqliteBroker.lease does.
+        """
+        now = self.clock()
+        found = self._lease(
+            keys=[self._key("queued"), self._key("leased"), self._key("in_flight")],
+            args=[now, now + lease_seconds, worker, self.prefix, self.max_attempts])
+        if not found:
+            return None
+        job_id, job, attempts = found
+        return Lease(int(job_id), Job(**json.loads(job)), int(attempts))
+
+    def extend(self, job_id, worker, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """
+        Pushes back the end of worker's lease on a job, returning whether it still held it.
+        """
+        return bool(self._extend(keys=[self._key("leased")],
+                                 args=[job_id, worker, self.clock() + lease_seconds,
+                                       self.prefix]))
+
+    def _finish_job(self, job_id, worker, value, state, attempts_so_far=0):
+        return self._finish(
+            keys=[self._key("leased"), self._key("in_flight"), self._key("queued")],
+            args=[job_id, worker, value, self.prefix, state,
+                  self.clock() + backoff_delay(self.backoff, max(attempts_so_far, 1)),
+                  self.max_attempts])
+
+    def complete(self, job_id, worker, result):
+        """
+        Records the result of a job, returning whether worker still held it.
+        """
+        return bool(self._finish_job(job_id, worker, result, DONE))
+
+    def fail(self, job_id, worker, error):
+        """
+        Records that a job failed, as SqliteBroker.fail does.
+        """
+        attempts = self._client.hget(self._key("job:%s" % job_id), "attempts")
+        return self._finish_job(job_id, worker, error, FAILED, int(attempts or 0)) or None
+
+    def status(self, job_id):
+        """
+        Returns the JobStatus of a job, or None if there is no such job.
+        """
+        found = self._client.hgetall(self._key("job:%s" % job_id))
+        if not found:
+            return None
+        return JobStatus(job_id, Job(**json.loads(found["job"])), found["state"],
+                         int(found["attempts"]), found.get("result"), found.get("error"))
+
+    def counts(self):
+        """
+        Returns how many jobs are queued and leased.  Finished jobs are not counted.
+        """
+        return {QUEUED: self._client.zcard(self._key("queued")),
+                LEASED: self._client.zcard(self._key("leased"))}
+
+    def close(self):
+        """
+        Closes the connections.
+        """
+        self._client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_broker(location=None, **options):
+    """
+    Opens a RedisBroker for a redis:// or rediss:// URL, and otherwise a SqliteBroker at the
+    given path, or at the default path.
+    """
+    if location and location.startswith(("redis://", "rediss://")):
+        return RedisBroker(location, **options)
+    return SqliteBroker(location or DEFAULT_QUEUE_PATH, **options)
+
+def worker_name():
+    """
+    Returns a name for a worker that is unique across machines and processes.
+    """
+    return "%s:%s:%s" % (socket.gethostname(), os.getpid(), threading.get_ident())
+
+# pylint: disable=too-many-instance-attributes
+class Worker:
+    """
+    Leases jobs from broker and runs them with job_runner on sessions from pool, writing the
+    results back.  While a job runs, its lease is pushed back every third of lease_seconds.  A job
+    that fails with one of scrape_amtrak.search_errors() is failed with the broker; anything else
+    is raised, and the job goes to another worker once its lease runs out.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, broker, pool, name=None, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 poll_interval=DEFAULT_POLL_INTERVAL, history=None, job_runner=run_job,
+                 sleep=time.sleep):
+        self.broker = broker
+        self.pool = pool
+        self.name = name or worker_name()
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.history = history
+        self.job_runner = job_runner
+        self.sleep = sleep
+
+    @contextlib.contextmanager
+    def _keep_leased(self, job_id):
+        stopped = threading.Event()
+
+        def extend():
+            while not stopped.wait(self.lease_seconds / 3):
+                if not self.broker.extend(job_id, self.name, self.lease_seconds):
+                    return
+
+        thread = threading.Thread(target=extend, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+
+    def run_once(self):
+        """
+        Runs one job if any is waiting, returning its id, or None.
+        """
+        lease = self.broker.lease(self.name, self.lease_seconds)
+        if lease is None:
+            return None
+        logging.info("%s running job %s (attempt %s): %s", self.name, lease.job_id,
+                     lease.attempts, lease.job)
+        try:
+            with self._keep_leased(lease.job_id), metrics.span("job:%s" % lease.job.kind):
+                result = self.job_runner(lease.job, self.pool, self.history)
+        except scrape_amtrak.search_errors() as exception:
+            logging.exception("Job %s failed", lease.job_id)
+            metrics.count("jobs_failed")
+            self.broker.fail(lease.job_id, self.name, "%s: %s" % (type(exception).__name__,
+                                                                  exception))
+            return lease.job_id
+        if not self.broker.complete(lease.job_id, self.name, result):
+            logging.warning("Lost the lease on job %s, dropping its result", lease.job_id)
+            metrics.count("jobs_dropped")
+            return lease.job_id
+        metrics.count("jobs_done")
+        return lease.job_id
+
+    def run(self, max_jobs=None, exit_when_idle=False):
+        """
+        Runs jobs until max_jobs have run, or with exit_when_idle until none are waiting,
+        otherwise forever, waiting poll_interval between checks of an empty queue.  Returns how
+        many jobs ran.
+        """
+        ran = 0
+        while max_jobs is None or ran < max_jobs:
+            if self.run_once() is not None:
+                ran = ran + 1
+            elif exit_when_idle:
+                break
+            else:
+                self.sleep(self.poll_interval)
+        return ran
+
+def wait_for(broker, job_ids, poll_interval=DEFAULT_POLL_INTERVAL, sleep=time.sleep):
+    """
+    Yields the JobStatus of every job, in the order given, as soon as it and those before it have
+    finished.
+    """
+    for job_id in job_ids:
+        while True:
+            status = broker.status(job_id)
+            if status is None or status.finished:
+                break
+            sleep(poll_interval)
+        yield status
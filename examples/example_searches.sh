@@ -26,6 +26,9 @@ run python main.py --source Harrisburg --destination pittsburgh --date 08/31/201
 run python main.py --source pittsburgh --destination chicago --date 08/31/2019
 run python main.py --source chicago --destination kansascity --date 09/01/2019
 
+echo "Cheapest harrisburg -> kansascity, direct or through pittsburgh and chicago"
+run amtrakomatic optimize --source Harrisburg --destination kansascity --date-from 08/31/2019 --via pittsburgh --via chicago
+
 
 
 # Comparing multi stage kansas city to Denver!
@@ -44,6 +47,10 @@ run python main.py --source galesburg --destination denver --date  09/17/2019
 run python main.py --source galesburg --destination denver --date  09/18/2019
 run python main.py --source galesburg --destination denver --date  09/19/2019
 
+# The same comparison in one process, with shared browser sessions
+echo "Running date range price comparison between galesburg and denver as a sweep"
+run amtrakomatic --source galesburg --destination denver --date-from 09/15/2019 --date-to 09/19/2019 --jobs 3
+
 # Two legs between denver and sacramento
 echo "Running searches between denver and sacramento"
 run python amtrakomatic/main.py --source denver --destination saltlakecity --date  09/30/2019
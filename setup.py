@@ -16,6 +16,7 @@ import sys
 from shutil import rmtree
 
 from setuptools import find_packages, setup, Command
+from setuptools.command.build_py import build_py
 
 # Used for looking up "<NAME>/__version__.py
 NAME = 'amtrakomatic'
@@ -30,6 +31,7 @@ REQUIRED = [
         'pytest',
         'pylint',
         'bs4',
+        'requests',
         'tox',
 ]
 
@@ -124,6 +126,23 @@ class UploadCommand(Command):
         sys.exit()
 
 
+class BuildPyCommand(build_py):
+    """Also precompiles the station table into the built package."""
+
+    def run(self):
+        """
+        Builds the package as usual, then writes the precompiled station table next to the CSV.
+        """
+        build_py.run(self)
+        if self.dry_run:
+            return
+        sys.path.insert(0, here)
+        # pylint: disable=import-outside-toplevel
+        from amtrakomatic import fuzzy_match
+        fuzzy_match.compile_stations(
+            os.path.join(self.build_lib, NAME, os.path.basename(fuzzy_match.AMTRAK_STATIONS_PICKLE)))
+
+
 # Where the magic happens:
 setup(
     name=NAME,
@@ -159,5 +178,6 @@ setup(
     # $ setup.py publish support.
     cmdclass={
         'upload': UploadCommand,
+        'build_py': BuildPyCommand,
     },
 )
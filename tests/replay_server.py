@@ -0,0 +1,36 @@
+"""
+Serves the recorded pages in tests/test_data from a stand-in for the Amtrak site.
+"""
+import functools
+import os
+import pathlib
+from amtrakomatic import standin
+
+TEST_DATA_DIR = os.path.join(pathlib.Path(__file__).parent, 'test_data')
+
+HOMEPAGE_PATH = standin.HOMEPAGE_PATH
+SEARCH_PATH = standin.SEARCH_PATH
+
+# The recorded page answering each (origin code, destination code, date, points) search.
+RECORDED_SEARCHES = {
+    ("BOS", "NYP", "08/24/2019", False): "boston_newyork_08_24_2019_False_1.html",
+    ("BOS", "ESX", "08/18/2019", False): "Boston_vermont_08_18_2019_False_0.html",
+    ("ELP", "HOS", "12/01/2019", False): "elpaso_houston_12_01_2019_False_0.html",
+    ("SEA", "CHI", "08/24/2019", False): "seattle_chicago_08_24_2019_False_0.html",
+}
+
+@functools.lru_cache(maxsize=None)
+def test_data_recordings():
+    """
+    Returns the recordings of every search in tests/test_data, loaded once.
+    """
+    return standin.load_recordings(TEST_DATA_DIR)
+
+def serve_test_data(requests_log=None, **options):
+    """
+    Serves tests/test_data on a free local port for the duration of a with block, yielding the base
+    URL.  Searches are answered from the recorded pages, and the pages are also served as files.
+    Other options are passed to standin.StandInSite.
+    """
+    return standin.serve(standin.StandInSite(test_data_recordings(), requests_log=requests_log,
+                                             static_directory=TEST_DATA_DIR, **options))
@@ -0,0 +1,103 @@
+"""
+Test for the asyncio interface.
+"""
+import asyncio
+import os
+import pathlib
+import threading
+import time
+import unittest
+from unittest import mock
+from amtrakomatic import aio
+from amtrakomatic import amtrak_results
+from amtrakomatic import driver_pool
+from amtrakomatic import http_fetch
+from amtrakomatic import scrape_amtrak
+from tests import replay_server
+
+TEST_DATA_DIR = os.path.join(pathlib.Path(__file__).parent, 'test_data')
+
+# pylint: disable=too-few-public-methods
+class SlowSearches:
+    """
+    Stands in for get_all_fares, taking delay seconds and counting how many run at once.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most_running = 0
+        self.calls = 0
+
+    # pylint: disable=unused-argument
+    def __call__(self, *args):
+        with self.lock:
+            self.calls = self.calls + 1
+            self.running = self.running + 1
+            self.most_running = max(self.most_running, self.running)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running = self.running - 1
+        return args[:3]
+
+class TestSearcher(unittest.TestCase):
+    """
+    Tests that the searcher bounds, times out and cancels requests.
+    """
+
+    def test_search(self):
+        """
+        Tests searching from the event loop through the http backend.
+        """
+
+        async def search(base_url):
+            pool = driver_pool.DriverPool(size=2, factory=lambda: http_fetch.HttpSession(
+                base_url + replay_server.HOMEPAGE_PATH, base_url + replay_server.SEARCH_PATH))
+            async with aio.Searcher(pool) as searcher:
+                return await asyncio.gather(
+                    *[searcher.search(*search) for search in replay_server.RECORDED_SEARCHES])
+
+        with replay_server.serve_test_data() as base_url:
+            all_results = asyncio.run(search(base_url))
+        for results, page_file in zip(all_results, replay_server.RECORDED_SEARCHES.values()):
+            with open(os.path.join(TEST_DATA_DIR, page_file)) as html:
+                self.assertEqual(results, amtrak_results.AmtrakResults.from_html(html))
+
+    def test_limits(self):
+        """
+        Tests concurrency, backpressure, timeouts and cancellation.
+        """
+        slow_searches = SlowSearches(0.2)
+
+        async def run():
+            searcher = aio.Searcher(driver_pool.DriverPool(size=2), max_pending=2)
+            searches = [asyncio.ensure_future(searcher.search("a", "b", str(day)))
+                        for day in range(4)]
+            await asyncio.sleep(0.05)
+            self.assertEqual(searcher.pending(), 4)
+            with self.assertRaises(aio.Overloaded):
+                await searcher.search("a", "b", "overloaded")
+            self.assertEqual([result[2] for result in await asyncio.gather(*searches)],
+                             ["0", "1", "2", "3"])
+            self.assertEqual(slow_searches.most_running, 2)
+
+            with self.assertRaises(asyncio.TimeoutError):
+                await searcher.search("a", "b", "slow", timeout=0.05)
+            waiting = [asyncio.ensure_future(searcher.search("a", "b", str(day)))
+                       for day in range(4)]
+            await asyncio.sleep(0.05)
+            for search in waiting:
+                search.cancel()
+            await asyncio.gather(*waiting, return_exceptions=True)
+            await searcher.close()
+
+        with mock.patch.object(scrape_amtrak, "get_all_fares", slow_searches):
+            asyncio.run(run())
+        # The timed out search still ran, but of the cancelled ones only those already running
+        # did, so never more than the concurrency.
+        self.assertLessEqual(slow_searches.calls, 4 + 1 + 2)
+        self.assertEqual(slow_searches.running, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,9 @@ Test for amtrak results parser.
 import os
 import json
 import pathlib
+import pickle
 import unittest
+from unittest import mock
 import attr
 from amtrakomatic import amtrak_results
 
@@ -51,6 +53,107 @@ class TestAmtrakResults(unittest.TestCase):
         run_example(PAGE3, PAGE3_EXPECTED)
         run_example(PAGE4, PAGE4_EXPECTED)
 
+    def test_parser_engines(self):
+        """
+        Tests that every parser engine gives the same results on our pages.
+        """
+
+        def run_example(html_page):
+            with open(html_page) as html:
+                html = html.read()
+            expected = amtrak_results.AmtrakResults.from_html(html, engine="full")
+            for engine in amtrak_results.PARSER_ENGINES:
+                self.assertEqual(amtrak_results.AmtrakResults.from_html(html, engine=engine),
+                                 expected)
+        run_example(PAGE3)
+        run_example(PAGE5)
+        with self.assertRaises(ValueError):
+            amtrak_results.AmtrakResults.from_html("", engine="nonexistent")
+
+    def test_fare_values(self):
+        """
+        Tests that fares are parsed into numbers and formatted back.
+        """
+        self.assertEqual(amtrak_results.fare_value("$1,093.50"), 1093.5)
+        self.assertEqual(amtrak_results.fare_value("4,002 points"), 4002)
+        self.assertIsNone(amtrak_results.fare_value(None))
+        self.assertEqual(amtrak_results.format_fare_value(93.0, False), "$93")
+        self.assertEqual(amtrak_results.format_fare_value(1093.5, False), "$1,093.50")
+        self.assertEqual(amtrak_results.format_fare_value(4002, True), "4,002 points")
+        results = amtrak_results.AmtrakResults.from_html(open(PAGE4))
+        self.assertEqual(results.cheapest_fare(), 105.0)
+
+    def test_compact_model(self):
+        """
+        Tests that results are slotted, carry their parsed numbers through pickling and rebuilding
+        from dicts, and export to columns.
+        """
+        results = amtrak_results.AmtrakResults.from_html(open(PAGE4))
+        first = next(result for result in results.results if len(result.legs) > 1)
+        leg = first.legs[0]
+        for model in (first, leg, leg.transfer, first.parsed_fares[0]):
+            self.assertFalse(hasattr(model, "__dict__"))
+        self.assertEqual(amtrak_results.duration_minutes("15h 37m"), 937)
+        self.assertEqual(amtrak_results.duration_minutes("0h 45m"), 45)
+        self.assertIsNone(amtrak_results.duration_minutes(None))
+        self.assertEqual(leg.minutes, amtrak_results.duration_minutes(leg.duration))
+        self.assertEqual(leg.transfer.minutes, amtrak_results.duration_minutes(
+            leg.transfer.duration))
+        self.assertEqual(first.legs[-1].transfer, {})
+        self.assertEqual(amtrak_results.Fare.parse("$1,093.50").amount, 109350)
+        self.assertEqual(amtrak_results.Fare.parse("4,002 points").amount, 4002)
+        self.assertIsNone(amtrak_results.Fare.parse(None).amount)
+
+        for copy in (pickle.loads(pickle.dumps(first)),
+                     amtrak_results.AmtrakResult(**attr.asdict(first))):
+            self.assertEqual(copy, first)
+            self.assertEqual(copy.total_minutes, first.total_minutes)
+            self.assertEqual(copy.parsed_fares, first.parsed_fares)
+            self.assertEqual(copy.legs[0].transfer.minutes, leg.transfer.minutes)
+
+        columns = results.to_columns()
+        self.assertEqual(len(columns["result_id"]), len(results.results))
+        self.assertEqual(columns["result_id"][1], results.results[1].result_id)
+        first_index = results.results.index(first)
+        self.assertEqual(min(amount for amount in columns["cheapest_amount"]
+                             if amount != amtrak_results.MISSING), 10500)
+        self.assertEqual(columns["leg_offsets"][-1], len(columns["train_name"]))
+        first_leg = columns["leg_offsets"][first_index]
+        self.assertEqual(columns["train_name"][first_leg], leg.train_name)
+        self.assertEqual(columns["transfer_minutes"][first_leg], leg.transfer.minutes)
+        self.assertEqual(columns["fare_offsets"][-1], len(columns["fare_amount"]))
+
+    def test_train_lookup(self):
+        """
+        Tests that results can be streamed one at a time and looked up by train.
+        """
+        with open(PAGE1) as html:
+            html = html.read()
+        results = amtrak_results.AmtrakResults.from_html(html)
+        self.assertEqual(list(amtrak_results.AmtrakResults.iter_html(html)), results.results)
+        # pylint: disable=protected-access
+        with mock.patch.object(amtrak_results, "_parse_result_scoped",
+                               wraps=amtrak_results._parse_result_scoped) as parse_result:
+            self.assertEqual(next(amtrak_results.AmtrakResults.iter_html(html)),
+                             results.results[0])
+            self.assertEqual(parse_result.call_count, 1)
+
+        train_name = results.results[-1].legs[0].train_name
+        first = next(result for result in results.results if result.has_train(train_name))
+        self.assertIs(results.get_by_train_name(train_name), first)
+        self.assertIs(results.get_by_train_name(amtrak_results.train_number(train_name)), first)
+        self.assertIsNone(results.get_by_train_name("No Such Train"))
+        # The index built by the lookups is not a field, so it does not get in the way of
+        # rebuilding results from dicts.
+        self.assertEqual(list(attr.asdict(results)), ["results"])
+        for copy in (amtrak_results.AmtrakResults(**attr.asdict(results)),
+                     pickle.loads(pickle.dumps(results))):
+            self.assertEqual(copy, results)
+            self.assertIs(copy.get_by_train_name(train_name), copy.results[results.results.index(
+                first)])
+        self.assertEqual(amtrak_results.train_number("5 California Zephyr"), "5")
+        self.assertIsNone(amtrak_results.train_number("Thruway Bus"))
+
     def test_pretty_print(self):
         """
         Tests that amtrak results pretty print can at least run.
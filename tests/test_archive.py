@@ -0,0 +1,54 @@
+"""
+Test for the compressed page archive.
+"""
+import os
+import pathlib
+import tempfile
+import unittest
+from amtrakomatic import amtrak_results
+from amtrakomatic import archive
+
+TEST_DATA_DIR = os.path.join(pathlib.Path(__file__).parent, 'test_data')
+PAGE1 = os.path.join(TEST_DATA_DIR, 'Boston_vermont_08_18_2019_False_0.html')
+PAGE2 = os.path.join(TEST_DATA_DIR, 'elpaso_houston_12_01_2019_False_0.html')
+
+class TestPageArchive(unittest.TestCase):
+    """
+    Tests that pages go into the archive compressed and come back out unchanged.
+    """
+
+    def test_round_trip(self):
+        """
+        Tests that pages can be looked up, read and parsed straight from the archive, including
+        after reopening it and rolling over to a new segment.
+        """
+        with open(PAGE2) as page:
+            html = page.read()
+        with tempfile.TemporaryDirectory() as directory:
+            page_archive = archive.PageArchive(directory, segment_max_bytes=1)
+            dump_entry = page_archive.add_dump(PAGE1)
+            self.assertEqual((dump_entry.source, dump_entry.destination, dump_entry.date,
+                              dump_entry.use_points, dump_entry.page),
+                             ("BOS", "ESX", "08/18/2019", False, 0))
+            page_archive.add("El Paso", "Houston", "12/01/2019", False, 0, html, 1.0)
+            page_archive = archive.PageArchive(directory, segment_max_bytes=1)
+            page_archive.add("elpaso", "houston", "12/01/2019", True, 0, html, 2.0)
+            self.assertEqual(len(os.listdir(directory)), 4)
+            segments = [filename for filename in os.listdir(directory)
+                        if filename.startswith("segment")]
+            self.assertLess(sum(os.path.getsize(os.path.join(directory, segment))
+                                for segment in segments), os.path.getsize(PAGE2))
+
+            entries = page_archive.entries(source="elpaso")
+            self.assertEqual([(entry.use_points, entry.fetched_at) for entry in entries],
+                             [(False, 1.0), (True, 2.0)])
+            self.assertEqual(page_archive.read(entries[1]), html)
+            self.assertEqual(len(page_archive.entries(date="08/18/2019")), 1)
+            self.assertEqual(len(page_archive.entries(use_points=False)), 2)
+            parsed = list(page_archive.iter_results(destination="houston", use_points=False))
+            self.assertEqual(parsed, [(entries[0], amtrak_results.AmtrakResults.from_html(html))])
+        with self.assertRaises(ValueError):
+            archive.PageArchive(tempfile.gettempdir()).add_dump("not_a_dump.html")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""
+Test for the benchmark suite.
+"""
+import os
+import tempfile
+import unittest
+from amtrakomatic import benchmark
+
+class TestBenchmark(unittest.TestCase):
+    """
+    Tests that benchmarks are measured, saved and compared against baselines.
+    """
+
+    def test_measure(self):
+        """
+        Tests that a measurement records time and memory.
+        """
+        measurement = benchmark.measure("build", lambda: [str(i) for i in range(10000)], 2)
+        self.assertEqual(measurement.name, "build")
+        self.assertGreater(measurement.wall_seconds, 0)
+        self.assertGreater(measurement.peak_kib, 0)
+        self.assertGreaterEqual(measurement.allocated_blocks, 10000)
+        self.assertEqual(measurement.relative_time, 0)
+        relative = benchmark.measure("build", lambda: [str(i) for i in range(10000)], 2,
+                                     reference=benchmark.reference_workload)
+        self.assertGreater(relative.relative_time, 0)
+
+    def test_measure_import(self):
+        """
+        Tests that an import is measured by what it allocates, which grows with what it loads.
+        """
+        light = benchmark.measure_import("amtrakomatic", 1)
+        heavy = benchmark.measure_import("amtrakomatic.scrape_amtrak", 1)
+        self.assertEqual(light.name, "import:amtrakomatic")
+        self.assertGreater(heavy.peak_kib, light.peak_kib)
+        self.assertGreater(heavy.allocated_blocks, light.allocated_blocks)
+
+    def test_find_regressions(self):
+        """
+        Tests that only metrics beyond the tolerance count as regressions, that times count
+        relative to the reference workload, that a few more blocks are not a regression, and that
+        baselines survive a round trip to disk.
+        """
+        baseline = [benchmark.Measurement("parse", 1.0, 100.0, 1000, 10.0),
+                    benchmark.Measurement("import", 1.0, 2000.0, 20000),
+                    benchmark.Measurement("print", 0.001, 2.0, 4, 0.01)]
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "baseline.json")
+            benchmark.save_baseline(baseline, filename)
+            loaded = benchmark.load_baseline(filename)
+        self.assertEqual(loaded["parse"], baseline[0])
+        self.assertEqual(benchmark.find_regressions(baseline, loaded), [])
+        # A slower machine takes longer on everything, the reference too.
+        slower = [benchmark.Measurement("parse", 3.0, 105.0, 1050, 14.0),
+                  benchmark.Measurement("import", 9.0, 2100.0, 20500),
+                  benchmark.Measurement("print", 0.01, 2.0, 6, 0.05)]
+        self.assertEqual(benchmark.find_regressions(slower, loaded), [])
+        worse = [benchmark.Measurement("parse", 1.0, 100.0, 1000, 16.0),
+                 benchmark.Measurement("import", 1.0, 2500.0, 20000),
+                 benchmark.Measurement("new", 100.0)]
+        self.assertEqual(benchmark.find_regressions(worse, loaded), [
+            "parse relative_time: 16.0 > 15.0", "import peak_kib: 2500.0 > 2200.0",
+            "new is missing from the baseline"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+Test for the on-disk result cache.
+"""
+import os
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+from amtrakomatic import amtrak_results
+from amtrakomatic import cache
+
+TEST_DATA_DIR = os.path.join(pathlib.Path(__file__).parent, 'test_data')
+PAGE = os.path.join(TEST_DATA_DIR, 'elpaso_houston_12_01_2019_False_0.html')
+
+# pylint: disable=too-few-public-methods
+class FakeClock:
+    """
+    A clock that only moves when told to.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class TestResultCache(unittest.TestCase):
+    """
+    Tests that results are cached, expire, and get evicted.
+    """
+
+    def setUp(self):
+        with open(PAGE) as page:
+            self.page = page.read()
+        self.results = amtrak_results.AmtrakResults.from_html(self.page)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "cache", "results.sqlite")
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        """
+        Tests that cached results and pages come back the same, under any spelling of the
+        stations, and expire after the ttl.
+        """
+        with cache.ResultCache(self.path, ttl=60, clock=self.clock) as result_cache:
+            self.assertIsNone(result_cache.get("elpaso", "houston", "12/01/2019", False))
+            result_cache.put("elpaso", "houston", "12/01/2019", False, self.results,
+                             [self.page, self.page])
+            self.assertEqual(result_cache.get("El Paso", "Houston", "12/01/2019", False),
+                             self.results)
+            self.assertIsNone(result_cache.get("elpaso", "houston", "12/01/2019", True))
+            self.assertEqual(result_cache.get_pages("elpaso", "houston", "12/01/2019", False),
+                             [self.page, self.page])
+            self.clock.now = self.clock.now + 61
+            self.assertIsNone(result_cache.get("elpaso", "houston", "12/01/2019", False))
+
+    def test_eviction(self):
+        """
+        Tests that the least recently used entries go first once the cache is too big, that
+        identical pages are only stored once, and that pages left without entries are looked for
+        once per eviction, however many entries it takes.
+        """
+        with cache.ResultCache(self.path, clock=self.clock) as result_cache:
+            for date in ["12/01/2019", "12/02/2019"]:
+                result_cache.put("elpaso", "houston", date, False, self.results, [self.page])
+                self.clock.now = self.clock.now + 1
+            one_page_size = result_cache.size()
+            result_cache.get("elpaso", "houston", "12/01/2019", False)
+            result_cache.max_bytes = one_page_size
+            self.clock.now = self.clock.now + 1
+            # pylint: disable=protected-access
+            with mock.patch.object(result_cache, "_delete_orphaned_pages",
+                                   wraps=result_cache._delete_orphaned_pages) as orphans:
+                result_cache.put("elpaso", "houston", "12/03/2019", False, self.results,
+                                 [self.page + " "])
+            orphans.assert_called_once()
+            self.assertLessEqual(result_cache.size(), one_page_size)
+            self.assertIsNone(result_cache.get("elpaso", "houston", "12/02/2019", False))
+            self.assertIsNotNone(result_cache.get("elpaso", "houston", "12/03/2019", False))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+Test for the browser session pool.
+"""
+import threading
+import unittest
+import urllib.request
+from unittest import mock
+from selenium.common import exceptions
+from amtrakomatic import amtrak_results
+from amtrakomatic import driver_pool
+from tests import replay_server
+
+class UrlDriver:
+    """
+    Just enough of a WebDriver to load pages from the replay server.
+    """
+
+    def __init__(self):
+        self.page_source = None
+        self.pages_loaded = 0
+        self.quit_called = False
+
+    def get(self, url):
+        """
+        Loads a page.
+        """
+        with urllib.request.urlopen(url) as response:
+            self.page_source = response.read().decode("utf-8")
+        self.pages_loaded = self.pages_loaded + 1
+
+    def quit(self):
+        """
+        Ends the session.
+        """
+        self.quit_called = True
+
+class TestDriverPool(unittest.TestCase):
+    """
+    Tests that the pool reuses, recycles and limits browser sessions.
+    """
+
+    def test_reuse_and_recycle(self):
+        """
+        Tests that sessions are warmed up once, reused, and quit after max_uses or an error.
+        """
+        started = []
+
+        def factory():
+            started.append(UrlDriver())
+            return started[-1]
+
+        with replay_server.serve_test_data() as base_url:
+            page = base_url + "/elpaso_houston_12_01_2019_False_0.html"
+            pool = driver_pool.DriverPool(size=1, max_uses=2, factory=factory,
+                                          warm_up=lambda driver: driver.get(page))
+            with pool:
+                for _ in range(3):
+                    with pool.session() as driver:
+                        driver.get(page)
+                        results = amtrak_results.AmtrakResults.from_html(driver.page_source)
+                        self.assertEqual(len(results.results), 2)
+                self.assertEqual(len(started), 2)
+                self.assertTrue(started[0].quit_called)
+                self.assertEqual(started[0].pages_loaded, 3)
+                with self.assertRaises(ValueError):
+                    with pool.session() as driver:
+                        raise ValueError("Search failed")
+                self.assertTrue(started[1].quit_called)
+                with pool.session() as driver:
+                    self.assertIs(driver, started[2])
+            self.assertTrue(started[2].quit_called)
+
+    def test_size_limit(self):
+        """
+        Tests that no more than size sessions are handed out at once.
+        """
+        pool = driver_pool.DriverPool(size=2, factory=UrlDriver)
+        pool.warm()
+        first = pool.acquire()
+        second = pool.acquire()
+        self.assertIsNot(first, second)
+        acquired = []
+        waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+        waiter.start()
+        waiter.join(0.1)
+        self.assertEqual(acquired, [])
+        pool.release(first)
+        waiter.join(5)
+        self.assertEqual(acquired, [first])
+        pool.release(second)
+        pool.release(first)
+        pool.close()
+        self.assertTrue(first.quit_called)
+
+    def test_closed(self):
+        """
+        Tests that a closed pool hands out no more sessions, and that a session that fails to quit
+        is still let go.
+        """
+        driver = UrlDriver()
+        driver.quit = mock.Mock(side_effect=exceptions.WebDriverException("Browser is gone"))
+        pool = driver_pool.DriverPool(factory=lambda: driver)
+        pool.warm()
+        pool.close()
+        driver.quit.assert_called_once_with()
+        with self.assertRaises(driver_pool.PoolClosed):
+            pool.acquire()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,8 @@ Test for fuzzy matcher library.
 """
 import unittest
 import collections
+from unittest import mock
+from fuzzywuzzy import process
 from amtrakomatic import fuzzy_match
 
 class TestStationMatch(unittest.TestCase):
@@ -38,6 +40,49 @@ class TestStationMatch(unittest.TestCase):
         for test_example in test_examples:
             print("\"%s\", %s" % (test_example.input, fuzzy_match.station(test_example.input)))
             self.assertEqual(fuzzy_match.station(test_example.input), test_example.expected_result)
+        self.assertEqual(fuzzy_match.stations([example.input for example in test_examples]),
+                         [example.expected_result for example in test_examples])
+
+    def test_station_index(self):
+        """
+        Tests that the station index agrees with scoring every station.
+        """
+        index = fuzzy_match.station_index()
+        for name in ["kansascity", "saltlakecity", "washingtondistrict", "galesburg", "elpaso",
+                     "Dadis", "Rhno", "Pittsburgh", "Chicago (Union Station), Illinois"]:
+            self.assertEqual(index.match(name),
+                             process.extractOne(name, fuzzy_match.AMTRAK_STATIONS.keys())[0])
+        # Station codes are looked up directly, where scoring every station gets them wrong.
+        self.assertEqual(fuzzy_match.station("nyp"), ('New York (Penn Station), New York', 'NYP'))
+
+    def test_station_index_cities(self):
+        """
+        Tests that every station's city matches a station in that city, with or without its state,
+        where scoring every station can prefer a longer name containing it.
+        """
+        index = fuzzy_match.station_index()
+        stations = fuzzy_match.amtrak_stations()
+        for station_info in stations.values():
+            for query in [station_info["city"], "%s %s" % (station_info["city"],
+                                                           station_info["state"])]:
+                with self.subTest(query=query):
+                    self.assertEqual(stations[index.match(query)]["city"], station_info["city"])
+
+    def test_station_index_squashed(self):
+        """
+        Tests that names run together are matched from the station index without scoring every
+        station.
+        """
+        index = fuzzy_match.station_index()
+        for name, expected in [("newyork", "New York (Penn Station), New York"),
+                               ("elpaso", "El Paso, Texas"),
+                               ("Washington DC", "Washington, District of Columbia"),
+                               ("newyorkpenn", "New York (Penn Station), New York")]:
+            with self.subTest(name=name), \
+                    mock.patch.object(process, "extractOne", wraps=process.extractOne) as scored:
+                self.assertEqual(index.match(name), expected)
+                self.assertLess(sum(len(call.args[1]) for call in scored.call_args_list),
+                                len(index.names))
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,79 @@
+"""
+Test for distances and the station location index.
+"""
+import random
+import unittest
+from amtrakomatic import fuzzy_match
+from amtrakomatic import geo
+
+class TestGeo(unittest.TestCase):
+    """
+    Tests that the grid index finds the same points as measuring to every point.
+    """
+
+    def test_haversine(self):
+        """
+        Tests distances against known ones.
+        """
+        self.assertAlmostEqual(geo.haversine_km(0, 0, 0, 180), 20015.1, places=0)
+        # New York Penn Station to Washington Union Station.
+        self.assertAlmostEqual(geo.haversine_km(40.7503, -73.9945, 38.8970, -77.0064), 329.6,
+                               delta=0.1)
+
+    def test_grid_index(self):
+        """
+        Tests radius and nearest queries against a linear scan, including across the date line
+        and near the poles.
+        """
+        rng = random.Random(1)
+        points = [(position, rng.uniform(-90, 90), rng.uniform(-180, 180))
+                  for position in range(2000)]
+        index = geo.GridIndex(points + [("nowhere", None, None)], cell_degrees=5)
+        for latitude, longitude, radius_km in [(39.1, -94.6, 800), (0, 179.9, 1500),
+                                               (89, 0, 2000), (-45, -180, 3000), (10, 10, 1)]:
+            expected = sorted(
+                (geo.haversine_km(latitude, longitude, point_latitude, point_longitude), key)
+                for key, point_latitude, point_longitude in points)
+            self.assertEqual(index.within(latitude, longitude, radius_km),
+                             [point for point in expected if point[0] <= radius_km])
+            self.assertEqual(index.nearest(latitude, longitude, 7), expected[:7])
+        self.assertEqual(len(index.nearest(0, 0, 5000)), len(points))
+
+    def test_uneven_cells(self):
+        """
+        Tests radius queries against a linear scan with cells that do not divide 360 degrees, so
+        that the column just west of 0 degrees is narrower than the others.
+        """
+        rng = random.Random(2)
+        points = [(position, rng.uniform(-60, 60), longitude)
+                  for position, longitude in enumerate(
+                      [rng.uniform(-5, 5) for _ in range(1000)] +
+                      [rng.uniform(-180, 180) for _ in range(1000)])]
+        index = geo.GridIndex(points, cell_degrees=7)
+        for latitude, longitude, radius_km in [(0, -3.5, 100), (-30, -1, 500), (0, 2, 300),
+                                               (0, 179.5, 200), (10, -179.5, 300)]:
+            expected = sorted(
+                (geo.haversine_km(latitude, longitude, point_latitude, point_longitude), key)
+                for key, point_latitude, point_longitude in points)
+            self.assertEqual(index.within(latitude, longitude, radius_km),
+                             [point for point in expected if point[0] <= radius_km])
+
+    def test_stations(self):
+        """
+        Tests finding stations near a place and near another station.
+        """
+        nearest = fuzzy_match.nearest_stations(39.1, -94.6, 2)
+        self.assertEqual([(name, code) for name, code, _ in nearest],
+                         [("Kansas City, Missouri", "KCY"), ("Independence, Missouri", "IDP")])
+        near = fuzzy_match.stations_near("Kansas City", 30)
+        self.assertEqual([code for _, code, _ in near], ["KCY", "IDP", "LEE"])
+        for _, _, distance in near:
+            self.assertLessEqual(distance, 30)
+        self.assertEqual(
+            [code for _, code, _ in fuzzy_match.stations_within(39.1, -94.6, 30)],
+            [code for _, code, _ in fuzzy_match.nearest_stations(39.1, -94.6, 3)])
+        self.assertEqual(fuzzy_match.stations_near("ACD", 1000),
+                         [("Arcadia, Missouri", "ACD", 0.0)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+Test for the fare history.
+"""
+import datetime
+import json
+import math
+import os
+import pathlib
+import tempfile
+import unittest
+from click.testing import CliRunner
+from amtrakomatic import amtrak_results
+from amtrakomatic import cli
+from amtrakomatic import history
+
+TEST_DATA_DIR = os.path.join(pathlib.Path(__file__).parent, 'test_data')
+
+def load_results(adjust=0):
+    """
+    Loads the boston to new york results, with adjust dollars added to every available fare.
+    """
+    with open(os.path.join(TEST_DATA_DIR, 'boston_newyork_08_24_2019_False_1.json')) as expected:
+        results = json.load(expected)
+    for result in results:
+        result["fares"] = [
+            "$%.2f" % (amtrak_results.fare_value(fare) + adjust)
+            if amtrak_results.fare_value(fare) is not None else fare
+            for fare in result["fares"]]
+    return amtrak_results.AmtrakResults(
+        [amtrak_results.AmtrakResult(**result) for result in results])
+
+def timestamp(date):
+    """
+    Returns noon on a MM/DD/YYYY date as seconds since the epoch.
+    """
+    return datetime.datetime.strptime(date + " 12:00", "%m/%d/%Y %H:%M").timestamp()
+
+class TestFareHistory(unittest.TestCase):
+    """
+    Tests recording results and querying them.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "history.sqlite")
+        with history.FareHistory(self.path) as fares:
+            # Polled on three days before each of two travel dates, getting pricier each time.
+            for travel_date in ["08/24/2019", "08/25/2019"]:
+                for poll, fetched_on in enumerate(["08/10/2019", "08/17/2019", "08/22/2019"]):
+                    fares.record("boston", "New York", travel_date, False,
+                                 load_results(adjust=10 * poll), timestamp(fetched_on))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_queries(self):
+        """
+        Tests the lowest fare per date, the trend for a train and percentiles by days before.
+        """
+        cheapest = min(result.cheapest_fare() for result in load_results().results)
+        with history.FareHistory(self.path) as fares:
+            self.assertEqual(fares.min_fare_by_date("BOS", "NYP"),
+                             [("08/24/2019", cheapest), ("08/25/2019", cheapest)])
+            self.assertEqual(fares.min_fare_by_date("BOS", "NYP",
+                                                    since=timestamp("08/20/2019")),
+                             [("08/24/2019", cheapest + 20), ("08/25/2019", cheapest + 20)])
+            self.assertEqual(fares.min_fare_by_date("BOS", "NYP", use_points=True), [])
+
+            train = load_results().results[0]
+            expected = [(timestamp(fetched_on), "08/24/2019", train.cheapest_fare() + adjust)
+                        for fetched_on, adjust in [("08/10/2019", 0), ("08/17/2019", 10),
+                                                   ("08/22/2019", 20)]]
+            self.assertEqual(fares.train_trend(train.legs[0].train_name, "08/24/2019"), expected)
+            number = amtrak_results.train_number(train.legs[0].train_name)
+            self.assertEqual(fares.train_trend(number, "08/24/2019"), expected)
+            self.assertEqual(len(fares.train_trend(number)), 6)
+
+            percentiles = fares.fare_percentiles("boston", "newyork", [0, 50, 100])
+            self.assertEqual(sorted(percentiles), [2, 3, 7, 8, 14, 15])
+            values = sorted(result.cheapest_fare() + 10 for result in load_results().results
+                            if result.cheapest_fare() is not None)
+            self.assertEqual(percentiles[7], [
+                values[max(1, math.ceil(percentile * len(values) / 100)) - 1]
+                for percentile in [0, 50, 100]])
+
+    def test_command(self):
+        """
+        Tests showing the history from the command line.
+        """
+        runner = CliRunner()
+        result = runner.invoke(cli.amtrak_search, ["history", "--path", self.path,
+                                                   "--source", "boston", "--destination", "NYP"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(len(result.output.splitlines()), 2)
+        result = runner.invoke(cli.amtrak_search, ["history", "--path", self.path,
+                                                   "--source", "boston", "--destination", "NYP",
+                                                   "--by-days-before"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(len(result.output.splitlines()), 7)
+
+if __name__ == '__main__':
+    unittest.main()
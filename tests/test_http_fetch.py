@@ -0,0 +1,46 @@
+"""
+Test for searching over plain HTTP.
+"""
+import os
+import pathlib
+import unittest
+from amtrakomatic import amtrak_results
+from amtrakomatic import scrape_amtrak
+from amtrakomatic import http_fetch
+from tests import replay_server
+
+TEST_DATA_DIR = os.path.join(pathlib.Path(__file__).parent, 'test_data')
+
+class TestHttpFetch(unittest.TestCase):
+    """
+    Tests that the http backend gets the same results as parsing the recorded pages.
+    """
+
+    def test_get_all_fares(self):
+        """
+        Tests searches through a pool of HTTP sessions against the stand-in site.
+        """
+        requests_log = []
+        with replay_server.serve_test_data(requests_log) as base_url:
+            pool = scrape_amtrak.new_driver_pool(backend="http")
+            pool.factory = lambda: http_fetch.HttpSession(
+                base_url + replay_server.HOMEPAGE_PATH, base_url + replay_server.SEARCH_PATH)
+            with pool:
+                for (source, destination, date, use_points), page_file in \
+                        replay_server.RECORDED_SEARCHES.items():
+                    results = scrape_amtrak.get_all_fares(source, destination, date, use_points,
+                                                          pool)
+                    with open(os.path.join(TEST_DATA_DIR, page_file)) as html:
+                        self.assertEqual(results, amtrak_results.AmtrakResults.from_html(html))
+                with self.assertRaises(Exception):
+                    scrape_amtrak.get_all_fares("boston", "chicago", "01/01/2020", False, pool)
+        # The homepage is only loaded once per session, and the connection is kept alive until
+        # the failed search throws the session away.
+        self.assertEqual([method for method, _, _ in requests_log],
+                         ["GET"] + ["POST"] * (len(replay_server.RECORDED_SEARCHES) + 1))
+        self.assertEqual(len({port for _, _, port in requests_log}), 1)
+        with self.assertRaises(ValueError):
+            scrape_amtrak.new_driver_pool(backend="http", log_in=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+"""
+Test for the timing spans and counters.
+"""
+import io
+import json
+import os
+import tempfile
+import unittest
+from click.testing import CliRunner
+from amtrakomatic import cli
+from amtrakomatic import metrics
+
+# pylint: disable=too-few-public-methods
+class FakeClock:
+    """
+    A clock that moves one second forward every time it is read.
+    """
+
+    def __init__(self):
+        self.now_ns = 0
+
+    def __call__(self):
+        self.now_ns = self.now_ns + 10**9
+        return self.now_ns
+
+class FakeTracer:
+    """
+    Records the spans started through it the way an OpenTelemetry tracer would be called.
+    """
+
+    def __init__(self):
+        self.spans = []
+
+    def start_span(self, name, start_time):
+        """
+        Starts recording a span.
+        """
+        otel_span = FakeSpan(name, start_time)
+        self.spans.append(otel_span)
+        return otel_span
+
+class FakeSpan:
+    """
+    A span started by FakeTracer.
+    """
+
+    def __init__(self, name, start_time):
+        self.name = name
+        self.start_time = start_time
+        self.end_time = None
+        self.attributes = {}
+
+    def set_attribute(self, key, value):
+        """
+        Records an attribute.
+        """
+        self.attributes[key] = value
+
+    def end(self, end_time):
+        """
+        Records the end time.
+        """
+        self.end_time = end_time
+
+class TestMetrics(unittest.TestCase):
+    """
+    Tests recording and writing out metrics.
+    """
+
+    def record(self):
+        """
+        Records a few spans and counters on a fake clock.
+        """
+        registry = metrics.Metrics(clock=FakeClock())
+        events = []
+        registry.add_hook(events.append)
+        with registry.span("search"):
+            registry.count("pages", 3)
+        with self.assertRaises(ValueError):
+            with registry.span("search"):
+                raise ValueError("no results")
+        registry.count("pages")
+        return registry, events
+
+    def test_spans_and_counters(self):
+        """
+        Tests that spans are timed, failures noted, and counters added up.
+        """
+        registry, events = self.record()
+        self.assertEqual([(event.name, event.seconds, event.failed) for event in events],
+                         [("search", 1.0, False), ("search", 1.0, True)])
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot["spans"], {"search": {"count": 2, "total_seconds": 2.0,
+                                                        "max_seconds": 1.0}})
+        self.assertEqual(snapshot["counters"], {"pages": 4})
+        self.assertEqual(snapshot["wall_seconds"], 5.0)
+        breakdown = metrics.format_breakdown(snapshot)
+        self.assertIn("search", breakdown)
+        self.assertIn("pages", breakdown)
+
+        registry.reset()
+        self.assertEqual(registry.snapshot()["spans"], {})
+        with registry.span("after_reset"):
+            pass
+        self.assertEqual(len(events), 3)
+
+    def test_timed(self):
+        """
+        Tests that decorated functions are timed in the registry.
+        """
+        metrics.REGISTRY.reset()
+
+        @metrics.timed("decorated")
+        def decorated(value):
+            return value * 2
+
+        self.assertEqual(decorated(2), 4)
+        self.assertEqual(metrics.REGISTRY.snapshot()["spans"]["decorated"]["count"], 1)
+
+    def test_output_formats(self):
+        """
+        Tests the Prometheus, JSON, JSON lines and OpenTelemetry outputs.
+        """
+        registry, _ = self.record()
+        snapshot = registry.snapshot()
+        prometheus = metrics.format_prometheus(snapshot)
+        self.assertIn('amtrakomatic_span_seconds_sum{span="search"} 2.0\n', prometheus)
+        self.assertIn('amtrakomatic_span_seconds_count{span="search"} 2\n', prometheus)
+        self.assertIn("amtrakomatic_pages_total 4\n", prometheus)
+
+        with tempfile.TemporaryDirectory() as directory:
+            json_path = os.path.join(directory, "metrics.json")
+            metrics.write_snapshot(json_path, snapshot)
+            with open(json_path) as written:
+                self.assertEqual(json.load(written), snapshot)
+            prometheus_path = os.path.join(directory, "metrics.prom")
+            metrics.write_snapshot(prometheus_path, snapshot)
+            with open(prometheus_path) as written:
+                self.assertEqual(written.read(), prometheus)
+
+        output = io.StringIO()
+        tracer = FakeTracer()
+        registry.add_hook(metrics.json_lines_hook(output))
+        registry.add_hook(metrics.opentelemetry_hook(tracer))
+        with registry.span("login"):
+            pass
+        line = json.loads(output.getvalue())
+        self.assertEqual((line["name"], line["seconds"], line["failed"]), ("login", 1.0, False))
+        self.assertEqual([(otel_span.name, otel_span.start_time, otel_span.end_time)
+                          for otel_span in tracer.spans],
+                         [("login", line["start_ns"], line["end_ns"])])
+        self.assertEqual(tracer.spans[0].attributes, {"amtrakomatic.failed": False})
+
+    def test_cli(self):
+        """
+        Tests that --profile prints the breakdown and --metrics-file writes the metrics.
+        """
+        metrics.REGISTRY.reset()
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            result = runner.invoke(cli.amtrak_search,
+                                   ["--profile", "--metrics-file", "metrics.json"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("Wall time", result.output)
+            with open("metrics.json") as written:
+                self.assertIn("spans", json.load(written))
+
+if __name__ == '__main__':
+    unittest.main()
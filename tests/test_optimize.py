@@ -0,0 +1,119 @@
+"""
+Test for finding the cheapest and fastest itineraries.
+"""
+import contextlib
+import datetime
+import io
+import unittest
+from selenium.common import exceptions
+from amtrakomatic import amtrak_results
+from amtrakomatic import optimize
+
+def result(train_name, departure, arrival, arrival_day, duration, *fares):
+    """
+    Builds a single leg result.
+    """
+    return amtrak_results.AmtrakResult(duration, [{
+        "train_name": train_name, "departure_time": departure, "arrival_time": arrival,
+        "arrival_day": arrival_day, "duration": duration, "transfer": {}}], list(fares), "", "",
+                                       train_name)
+
+SEGMENTS = {
+    ("HAR", "KCY", "08/31/2019", False): [
+        result("1 Direct", "6:00 am", "12:00 pm", "Sun Sep 1", "30h 0m", "$300.00")],
+    ("HAR", "PGH", "08/31/2019", False): [
+        result("43 Pennsylvanian", "1:00 pm", "6:30 pm", "", "5h 30m", "$40.00", "$90.00")],
+    ("HAR", "PGH", "08/31/2019", True): [
+        result("43 Pennsylvanian", "1:00 pm", "6:30 pm", "", "5h 30m", "1,000 points")],
+    ("PGH", "CHI", "08/31/2019", False): [
+        # Leaves too soon after the Pennsylvanian gets in to be caught.
+        result("Too Tight", "6:45 pm", "3:30 am", "Sun Sep 1", "9h 45m", "$10.00"),
+        # Chicago is an hour behind, so the clock says an hour less than the duration.
+        result("29 Capitol Limited", "11:59 pm", "8:45 am", "Sun Sep 1", "9h 46m", "$60.00",
+               "Sold Out")],
+    ("CHI", "KCY", "09/01/2019", False): [
+        result("3 Southwest Chief", "3:00 pm", "10:00 pm", "", "7h 0m", "Sold Out", "$50.00")],
+}
+
+# pylint: disable=too-few-public-methods
+class FakeSearches:
+    """
+    Stands in for get_all_fares, answering from SEGMENTS and recording every search.
+    """
+
+    def __init__(self):
+        self.searched = []
+
+    # pylint: disable=too-many-arguments,unused-argument
+    def __call__(self, source, destination, date, use_points, pool, cache, refresh, archive):
+        self.searched.append((source, destination, date, use_points))
+        if (source, destination) == ("PGH", "KCY"):
+            raise exceptions.TimeoutException("No trains found")
+        return amtrak_results.AmtrakResults(
+            SEGMENTS.get((source, destination, date, use_points), []))
+
+class TestOptimize(unittest.TestCase):
+    """
+    Tests searching the time expanded graph of segment fares.
+    """
+
+    def optimizer(self, searches, **kwargs):
+        """
+        Returns an optimizer from Harrisburg to Kansas City over the fake segments.
+        """
+        return optimize.Optimizer(optimize.SegmentFares(None, jobs=2, search=searches),
+                                  "Harrisburg", "kansascity", ["08/31/2019"],
+                                  ["pittsburgh", "chicago"], **kwargs)
+
+    def test_times(self):
+        """
+        Tests working out departure and arrival times from the legs.
+        """
+        overnight = result("5 California Zephyr", "2:10 pm", "7:15 am", "", "18h 5m", "$1.00")
+        departure = optimize.departure_time(overnight, "12/31/2019")
+        self.assertEqual(departure, datetime.datetime(2019, 12, 31, 14, 10))
+        self.assertEqual(optimize.arrival_time(overnight, departure),
+                         datetime.datetime(2020, 1, 1, 7, 15))
+        new_year = result("5 California Zephyr", "2:10 pm", "7:15 am", "Wed Jan 1", "18h 5m",
+                          "$1.00")
+        self.assertEqual(optimize.arrival_time(new_year, departure),
+                         datetime.datetime(2020, 1, 1, 7, 15))
+
+    def test_search(self):
+        """
+        Tests that connections are respected, that each segment is searched once, and that the
+        objective picks the order.
+        """
+        searches = FakeSearches()
+        optimizer = self.optimizer(searches)
+        cheapest = optimizer.search(optimize.CHEAPEST)
+        self.assertEqual([itinerary.stations() for itinerary in cheapest],
+                         [["HAR", "PGH", "CHI", "KCY"], ["HAR", "KCY"]])
+        self.assertEqual([itinerary.cost for itinerary in cheapest], [150.0, 300.0])
+        self.assertEqual([ticket.result.legs[0].train_name for ticket in cheapest[0].tickets],
+                         ["43 Pennsylvanian", "29 Capitol Limited", "3 Southwest Chief"])
+        self.assertEqual(cheapest[0].elapsed, datetime.timedelta(hours=34))
+        self.assertEqual(len(searches.searched), len(set(searches.searched)))
+
+        fastest = optimizer.search(optimize.FASTEST, limit=1)
+        self.assertEqual([itinerary.stations() for itinerary in fastest], [["HAR", "KCY"]])
+        self.assertEqual(len(searches.searched), len(set(searches.searched)))
+        with self.assertRaises(ValueError):
+            optimizer.search("scenic")
+
+    def test_points(self):
+        """
+        Tests mixing dollars and points fares at a point value.
+        """
+        optimizer = self.optimizer(FakeSearches(), point_value=0.02)
+        best = optimizer.search(optimize.CHEAPEST, limit=1)[0]
+        self.assertEqual(best.cost, 130.0)
+        self.assertEqual((best.dollars(), best.points()), (110.0, 1000))
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            optimize.print_itineraries([best])
+        self.assertIn("HAR -> PGH -> CHI -> KCY: $130 ($110 + 1,000 points), 34h 0m\n",
+                      output.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
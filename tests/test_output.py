@@ -0,0 +1,160 @@
+"""
+Test for the output formats.
+"""
+import csv
+import io
+import json
+import os
+import pathlib
+import unittest
+from unittest import mock
+import attr
+from click.testing import CliRunner
+from amtrakomatic import amtrak_results
+from amtrakomatic import cli
+from amtrakomatic import output
+from amtrakomatic import scrape_amtrak
+
+TEST_DATA_DIR = os.path.join(pathlib.Path(__file__).parent, 'test_data')
+
+PAGE_FILES = ["boston_newyork_08_24_2019_False_1.html", "boston_newyork_08_24_2019_False_2.html"]
+
+SEARCH = output.search_record("boston", "New York", "08/24/2019", False)
+
+def load_pages():
+    """
+    Returns the sources of both pages of the boston to new york results.
+    """
+    sources = []
+    for page_file in PAGE_FILES:
+        with open(os.path.join(TEST_DATA_DIR, page_file)) as html:
+            sources.append(html.read())
+    return sources
+
+class CountingOutput(io.StringIO):
+    """
+    An output that counts how many times it is written to.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, text):
+        self.writes = self.writes + 1
+        return super().write(text)
+
+class TestOutput(unittest.TestCase):
+    """
+    Tests that every format writes the results it is given, and that they can be read back.
+    """
+
+    def setUp(self):
+        self.results = [result for page_source in load_pages()
+                        for result in amtrak_results.AmtrakResults.from_html(page_source).results]
+
+    def write(self, output_format):
+        """
+        Writes the results in output_format and returns what was written.
+        """
+        written = io.StringIO()
+        with output.open_writer(output_format, written) as writer:
+            for result in self.results:
+                writer.write_result(result, SEARCH)
+        return written.getvalue()
+
+    def test_formats(self):
+        """
+        Tests reading back results written as JSON lines, JSON, CSV and text.
+        """
+        records = [json.loads(line) for line in self.write("ndjson").splitlines()]
+        self.assertEqual(records, json.loads(self.write("json")))
+        for record in records:
+            self.assertEqual({key: record.pop(key) for key in SEARCH}, SEARCH)
+        self.assertEqual([amtrak_results.AmtrakResult(**record) for record in records],
+                         self.results)
+
+        rows = list(csv.DictReader(io.StringIO(self.write("csv"))))
+        self.assertEqual([row["trains"] for row in rows],
+                         [" + ".join(leg.train_name for leg in result.legs)
+                          for result in self.results])
+        self.assertEqual([row["fares"].split(" | ") for row in rows],
+                         [result.fares for result in self.results])
+
+        self.assertEqual(self.write("table"),
+                         "".join(result.format() for result in self.results))
+        empty = io.StringIO()
+        with output.open_writer("json", empty):
+            pass
+        self.assertEqual(json.loads(empty.getvalue()), [])
+        with self.assertRaises(ValueError):
+            output.open_writer("xml", io.StringIO())
+
+    def test_trips(self):
+        """
+        Tests writing priced and failed CSV rows.
+        """
+        ticket = self.results[0]
+        trip = ["chicago", "kansascity", "09/01/2019", "3 Southwest Chief ", "dollars"]
+        written = io.StringIO()
+        with output.CsvWriter(written) as writer:
+            writer.write_trip(0, trip, ticket, "$55.00", (55.0, 0))
+            writer.write_trip(1, trip, error=RuntimeError("No such train"))
+            writer.write_totals(55.0, 0, [1])
+        rows = list(csv.DictReader(io.StringIO(written.getvalue())))
+        self.assertEqual([(row["row"], row["train"], row["dollars"], row["error"]) for row in rows],
+                         [("1", "3 Southwest Chief", "55.0", ""), ("2", "3 Southwest Chief", "",
+                                                                   "No such train")])
+
+        written = io.StringIO()
+        with output.NdjsonWriter(written) as writer:
+            writer.write_trip(0, trip, ticket, "$55.00", (55.0, 0))
+        record = json.loads(written.getvalue())
+        self.assertEqual(record["ticket"], attr.asdict(ticket))
+        self.assertEqual((record["row"], record["trip"], record["price"]), (1, trip, "$55.00"))
+
+    def test_streaming(self):
+        """
+        Tests that a streaming parser writes each page's results in one write as it is parsed.
+        """
+        written = CountingOutput()
+        parser = output.StreamingParser(output.NdjsonWriter(written), SEARCH)
+        parsed = []
+        for page, page_source in enumerate(load_pages(), 1):
+            parsed.extend(parser(page_source))
+            self.assertEqual(written.writes, page)
+            self.assertEqual(len(written.getvalue().splitlines()), len(parsed))
+        self.assertEqual(parsed, self.results)
+        self.assertEqual(parser.written, len(self.results))
+
+    def test_command(self):
+        """
+        Tests that a search writes the results parsed while searching, or the cached results if
+        nothing was parsed.
+        """
+
+        # pylint: disable=unused-argument,too-many-arguments
+        def searched(source, destination, date, use_points, pool, *args, parser=None, **options):
+            return amtrak_results.AmtrakResults(
+                [result for page_source in load_pages() for result in parser(page_source)])
+
+        # pylint: disable=unused-argument
+        def cached(*args, **options):
+            return amtrak_results.AmtrakResults(self.results)
+
+        runner = CliRunner()
+        arguments = ["--source", "boston", "--destination", "New York", "--date", "08/24/2019",
+                     "--backend", "http", "--format", "ndjson"]
+        outputs = []
+        for search in [searched, cached]:
+            with mock.patch.object(scrape_amtrak, "get_all_fares", search):
+                result = runner.invoke(cli.amtrak_search, arguments)
+            self.assertEqual(result.exit_code, 0, result.output)
+            outputs.append(result.output)
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(len(outputs[0].splitlines()), len(self.results))
+        result = runner.invoke(cli.amtrak_search, arguments + ["--date-to", "08/25/2019"])
+        self.assertNotEqual(result.exit_code, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+"""
+Test for page readiness detection.
+"""
+import time
+import unittest
+from unittest import mock
+from selenium.common.exceptions import TimeoutException
+from amtrakomatic import readiness
+from amtrakomatic import scrape_amtrak
+
+# pylint: disable=too-few-public-methods
+class ScriptedDriver:
+    """
+    Just enough of a WebDriver for pages whose markers show up a while after it is created.
+    """
+
+    def __init__(self, appear_after):
+        self.started = time.monotonic()
+        self.appear_after = appear_after
+        self.elements = {name: mock.Mock() for name in appear_after}
+
+    def __getattr__(self, method):
+        if not method.startswith("find_elements_by_"):
+            raise AttributeError(method)
+        kind = method[len("find_elements_by_"):]
+
+        def find_elements(value):
+            for name, delay in self.appear_after.items():
+                marker = readiness.PAGES[name]
+                if (marker.kind, marker.value) == (kind, value):
+                    if time.monotonic() - self.started >= delay:
+                        return [self.elements[name]]
+            return []
+        return find_elements
+
+class TestReadiness(unittest.TestCase):
+    """
+    Tests that waits end as soon as the page they need is loaded.
+    """
+
+    def test_wait_for_any(self):
+        """
+        Tests that the first loaded page is detected without waiting for the others.
+        """
+        driver = ScriptedDriver({"ancillary": 0.2, "passenger_info": 5})
+        start = time.monotonic()
+        self.assertEqual(readiness.wait_for_any(driver, ["passenger_info", "ancillary"]),
+                         "ancillary")
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertTrue(readiness.is_loaded(driver, "ancillary"))
+        self.assertFalse(readiness.is_loaded(driver, "passenger_info"))
+        driver = ScriptedDriver({"ancillary": 0, "passenger_info": 0})
+        self.assertEqual(readiness.wait_for_any(driver, ["passenger_info", "ancillary"]),
+                         "passenger_info")
+        with self.assertRaises(TimeoutException):
+            readiness.wait_for(driver, "checkout", timeout=0.3)
+
+    def test_skip_dog_page(self):
+        """
+        Tests that the dog page is only clicked through when it is the page that loads.
+        """
+        driver = ScriptedDriver({"passenger_info": 0})
+        with self.assertLogs(level="INFO") as logs:
+            scrape_amtrak.skip_dog_page(driver)
+        self.assertIn("Waiting for passenger_info or ancillary took", logs.output[0])
+        driver = ScriptedDriver({"ancillary": 0})
+        scrape_amtrak.skip_dog_page(driver)
+        driver.elements["ancillary"].click.assert_called_once_with()
+
+if __name__ == '__main__':
+    unittest.main()
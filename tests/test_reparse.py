@@ -0,0 +1,73 @@
+"""
+Test for reparsing saved pages in bulk.
+"""
+import io
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+import attr
+from click.testing import CliRunner
+from amtrakomatic import amtrak_results
+from amtrakomatic import archive
+from amtrakomatic import cli
+from amtrakomatic import reparse
+
+TEST_DATA_DIR = os.path.join(pathlib.Path(__file__).parent, 'test_data')
+PAGES = ["Boston_vermont_08_18_2019_False_0.html", "elpaso_houston_12_01_2019_False_0.html",
+         "seattle_chicago_08_24_2019_False_0.html"]
+
+class TestReparse(unittest.TestCase):
+    """
+    Tests that pages are reparsed in order, with failures kept to their own page.
+    """
+
+    def test_reparse(self):
+        """
+        Tests reparsing a directory of dumped pages, including a broken one, and an archive.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            dumps = os.path.join(directory, "dumps")
+            os.mkdir(dumps)
+            for page in PAGES:
+                shutil.copy(os.path.join(TEST_DATA_DIR, page), dumps)
+            with open(os.path.join(dumps, "broken_page_01_01_2020_False_0.html"), "w") as broken:
+                broken.write('<table class="newFareFamilyTable" id="x"></table>')
+            page_archive = archive.PageArchive(os.path.join(directory, "archive"))
+            for page in PAGES:
+                page_archive.add_dump(os.path.join(TEST_DATA_DIR, page))
+
+            page_sources = reparse.find_pages(dumps)
+            output = io.StringIO()
+            progress = []
+            self.assertEqual(reparse.reparse(page_sources, output, jobs=2, chunksize=1,
+                                             progress=lambda *args: progress.append(args)),
+                             (3, 1))
+            self.assertEqual(len(progress), 4)
+            records = [json.loads(line) for line in output.getvalue().splitlines()]
+            self.assertEqual([os.path.basename(record["page"]) for record in records],
+                             sorted(os.listdir(dumps)))
+            self.assertIn("error", records[1])
+            self.assertEqual(records[1]["search"]["destination"], "page")
+            expected = {}
+            for page in PAGES:
+                with open(os.path.join(TEST_DATA_DIR, page)) as html:
+                    expected[page] = [attr.asdict(result) for result in
+                                      amtrak_results.AmtrakResults.from_html(html).results]
+            for record in records[:1] + records[2:]:
+                self.assertEqual(record["results"], expected[os.path.basename(record["page"])])
+
+            result = CliRunner().invoke(
+                cli.amtrak_search, ["reparse", os.path.join(directory, "archive"), "--output",
+                                    os.path.join(directory, "archive.jsonl"), "--jobs", "2"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            with open(os.path.join(directory, "archive.jsonl")) as lines:
+                records = [json.loads(line) for line in lines]
+            self.assertEqual([record["results"] for record in records],
+                             [expected[page] for page in PAGES])
+            self.assertEqual(records[1]["search"]["destination"], "HOS")
+
+if __name__ == '__main__':
+    unittest.main()
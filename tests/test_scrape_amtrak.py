@@ -0,0 +1,299 @@
+"""
+Test for the scraping workflow, without a browser.
+"""
+import contextlib
+import io
+import json
+import os
+import pathlib
+import random
+import re
+import tempfile
+import time
+import unittest
+from unittest import mock
+from selenium.common.exceptions import ElementNotInteractableException
+from amtrakomatic import amtrak_results
+from amtrakomatic import batch
+from amtrakomatic import driver_pool
+from amtrakomatic import scrape_amtrak
+from tests.test_driver_pool import UrlDriver
+
+TEST_DATA_DIR = os.path.join(pathlib.Path(__file__).parent, 'test_data')
+
+TRIPS = [
+    ["Harrisburg", "pittsburgh", "08/31/2019", "43 Pennsylvanian", "dollars"],
+    ["pittsburgh", "chicago", "08/31/2019", "29 Capitol Limited", "points"],
+    ["chicago", "kansascity", "09/01/2019", "3 Southwest Chief", "dollars"],
+    ["kansascity", "galesburg", "09/15/2019", "4 Southwest Chief", "dollars"],
+]
+
+with open(os.path.join(TEST_DATA_DIR, "boston_newyork_08_24_2019_False_1.json")) as json_file:
+    TICKET = amtrak_results.AmtrakResult(**json.load(json_file)[0])
+
+PRICES = {"43 Pennsylvanian": "$42.00", "29 Capitol Limited": "2,484",
+          "3 Southwest Chief": "$55.00", "4 Southwest Chief": "$1,011.50"}
+
+# pylint: disable=too-many-arguments,unused-argument
+def fake_specific_trip(driver, source, destination, date, name, use_points):
+    """
+    Prices a trip after a random delay, so that trips finish out of order.
+    """
+    time.sleep(random.uniform(0, 0.05))
+    return amtrak_results.AmtrakResults([TICKET]), PRICES[name]
+
+# pylint: disable=too-few-public-methods
+class FlakyTrips:
+    """
+    Prices trips like fake_specific_trip, but fails the first failures times each train in
+    failing is priced.
+    """
+
+    def __init__(self, failing, failures):
+        self.failing = failing
+        self.failures = failures
+        self.calls = []
+
+    # pylint: disable=too-many-arguments
+    def __call__(self, driver, source, destination, date, name, use_points):
+        self.calls.append(name)
+        if name in self.failing and self.calls.count(name) <= self.failures:
+            raise scrape_amtrak.TrainNotFound("Attempted to click on a train but did not find it")
+        return amtrak_results.AmtrakResults([TICKET]), PRICES[name]
+
+PAGE_FILES = ["boston_newyork_08_24_2019_False_1.html", "boston_newyork_08_24_2019_False_2.html"]
+
+class PagedElement:
+    """
+    An element on a results page, which can be clicked, and shown or hidden by the page it is on.
+    """
+
+    def __init__(self, driver, text="", shown=True, on_click=None):
+        self.driver = driver
+        self.text = text
+        self.shown = shown
+        self.on_click = on_click
+
+    def is_displayed(self):
+        """
+        Whether the element is on the page of results shown.
+        """
+        return self.shown
+
+    def click(self):
+        """
+        Does what clicking the element does, refusing if it is hidden like a browser would.
+        """
+        if not self.shown:
+            raise ElementNotInteractableException()
+        self.driver.clicks.append(self.text)
+        if self.on_click:
+            self.on_click()
+
+class PagedDriver:
+    """
+    Just enough of a WebDriver to page through results the way the site does: every result is in
+    the page, and clicking a page link hides some and shows others, which the recorded pages, one
+    per page shown, differ in.  Counts how often the page's source is fetched.
+    """
+
+    def __init__(self, page_files):
+        self.sources = {}
+        for page, page_file in enumerate(page_files, 1):
+            with open(os.path.join(TEST_DATA_DIR, page_file)) as html:
+                self.sources[page] = html.read()
+        self.current_page = 1
+        self.source_fetches = []
+        self.clicks = []
+
+    @property
+    def page_source(self):
+        """
+        The source of the page, with the current page of results shown.
+        """
+        self.source_fetches.append(self.current_page)
+        return self.sources[self.current_page]
+
+    def quit(self):
+        """
+        Ends the session.
+        """
+
+    def find_element_by_id(self, element_id):
+        """
+        Finds the line saying which results are shown.
+        """
+        source = self.sources[self.current_page]
+        return PagedElement(self, re.search(r'<div id="%s">([^<]*)<' % element_id,
+                                            source).group(1))
+
+    def find_element_by_xpath(self, xpath):
+        """
+        Finds a page link.
+        """
+        page = int(xpath.split("'")[1])
+
+        def show_page():
+            self.current_page = page
+        return PagedElement(self, "page %s" % page, on_click=show_page)
+
+    def find_elements_by_xpath(self, xpath):
+        """
+        Finds the fare button or add to cart button of a result, shown if its form is.
+        """
+        value = re.match(r"""//input\[@\w+=(['"])(.*)\1\]$""", xpath).group(2)
+        source = self.sources[self.current_page]
+        form = source[:source.index('"%s"' % value)].rindex("<form ")
+        form_tag = source[form:source.index(">", form)]
+        return [PagedElement(self, value, "display: none" not in form_tag)]
+
+class TestSearchResults(unittest.TestCase):
+    """
+    Tests that search results are read from the page a search lands on.
+    """
+
+    def test_pagination(self):
+        """
+        Tests that the page is fetched from the browser once and holds every result, without
+        showing later pages.
+        """
+        driver = PagedDriver(PAGE_FILES)
+        pages = []
+        results = scrape_amtrak.get_search_results(driver, "boston", "newyork", "08/24/2019",
+                                                   False, pages=pages)
+        self.assertEqual(driver.source_fetches, [1])
+        self.assertEqual(pages, [driver.sources[1]])
+        self.assertEqual(driver.clicks, [])
+        self.assertEqual(results, amtrak_results.AmtrakResults.from_html(driver.sources[1]))
+        self.assertEqual(len(results.results), 13)
+
+    def test_click_on_later_page(self):
+        """
+        Tests that a train on a later page is clicked on once that page is shown, and one on the
+        first page at once.
+        """
+        driver = PagedDriver(PAGE_FILES)
+        ticket = scrape_amtrak.get_search_results(driver, "boston", "newyork", "08/24/2019",
+                                                  False, "169 Northeast Regional").results[0]
+        self.assertTrue(ticket.has_train("169 Northeast Regional"))
+        self.assertEqual(driver.clicks, ["page 2", ticket.minimum_fare_value_attribute,
+                                         ticket.add_to_cart_button_name_attribute])
+
+        driver = PagedDriver(PAGE_FILES)
+        ticket = scrape_amtrak.get_search_results(driver, "boston", "newyork", "08/24/2019",
+                                                  False, "161 Northeast Regional").results[0]
+        self.assertEqual(driver.clicks, [ticket.minimum_fare_value_attribute,
+                                         ticket.add_to_cart_button_name_attribute])
+        with self.assertRaises(scrape_amtrak.TrainNotFound):
+            scrape_amtrak.get_search_results(driver, "boston", "newyork", "08/24/2019",
+                                             False, "1 Nonexistent")
+
+class TestCsvTrips(unittest.TestCase):
+    """
+    Tests that CSV trips are priced in parallel but reported in order.
+    """
+
+    @mock.patch.object(scrape_amtrak, "load_amtrak_site")
+    @mock.patch.object(scrape_amtrak, "handle_specific_trip", side_effect=fake_specific_trip)
+    def test_parallel_trips(self, handle_specific_trip, load_amtrak_site):
+        """
+        Tests that trips come back in input order with the same totals as running serially.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "trips.csv")
+            with open(filename, "w") as trips_file:
+                trips_file.write("\n".join([",".join(trip) for trip in TRIPS]))
+            outputs = []
+            for jobs in [1, 3]:
+                with driver_pool.DriverPool(size=jobs, factory=UrlDriver) as pool:
+                    output = io.StringIO()
+                    with contextlib.redirect_stdout(output):
+                        scrape_amtrak.iterate_csv_trips(filename, False, pool, jobs)
+                    outputs.append(output.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertIn("Total point cost: 2484\nTotal dollar cost: 1108.5\n", outputs[1])
+        self.assertEqual(handle_specific_trip.call_count, 2 * len(TRIPS))
+        self.assertEqual(load_amtrak_site.call_count, 2 * len(TRIPS))
+        trip_lines = [line for line in outputs[1].splitlines() if line.startswith("[")]
+        self.assertEqual(trip_lines, [str(trip) for trip in TRIPS])
+
+    @mock.patch.object(scrape_amtrak, "load_amtrak_site")
+    def test_resume(self, load_amtrak_site):
+        """
+        Tests that failing trips are retried, that a run with a journal picks up where the last one
+        stopped, and that the totals include trips priced by earlier runs.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "trips.csv")
+            with open(filename, "w") as trips_file:
+                trips_file.write("\n".join([",".join(trip) for trip in TRIPS]))
+            journal = os.path.join(directory, "trips.journal")
+
+            def run(flaky_trips, retries):
+                output = io.StringIO()
+                with mock.patch.object(scrape_amtrak, "handle_specific_trip", flaky_trips), \
+                        driver_pool.DriverPool(size=2, factory=UrlDriver) as pool, \
+                        contextlib.redirect_stdout(output):
+                    failed = scrape_amtrak.iterate_csv_trips(filename, False, pool, 2, journal,
+                                                             retries, backoff=0)
+                return failed, output.getvalue()
+
+            flaky_trips = FlakyTrips(["3 Southwest Chief"], 2)
+            failed, output = run(flaky_trips, 1)
+            self.assertEqual(failed, 1)
+            self.assertEqual(flaky_trips.calls.count("3 Southwest Chief"), 2)
+            self.assertIn("Total point cost: 2484\nTotal dollar cost: 1053.5\n", output)
+            self.assertIn("Failed trips: 3\n", output)
+
+            flaky_trips = FlakyTrips(["3 Southwest Chief"], 1)
+            failed, output = run(flaky_trips, 1)
+            self.assertEqual(failed, 0)
+            self.assertEqual(flaky_trips.calls, ["3 Southwest Chief", "3 Southwest Chief"])
+            self.assertIn("Total point cost: 2484\nTotal dollar cost: 1108.5\n", output)
+            trip_lines = [line for line in output.splitlines() if line.startswith("[")]
+            self.assertEqual(trip_lines, [str(trip) for trip in TRIPS])
+
+            flaky_trips = FlakyTrips([], 0)
+            failed, output = run(flaky_trips, 0)
+            self.assertEqual((failed, flaky_trips.calls), (0, []))
+            self.assertIn("Total point cost: 2484\nTotal dollar cost: 1108.5\n", output)
+        self.assertEqual(load_amtrak_site.call_count, 4 + 1 + 2)
+
+    @mock.patch.object(scrape_amtrak, "load_amtrak_site")
+    def test_bug_not_retried(self, _):
+        """
+        Tests that a trip failing with something other than a search error is not retried.
+        """
+        handle_specific_trip = mock.Mock(side_effect=ZeroDivisionError)
+        with mock.patch.object(scrape_amtrak, "handle_specific_trip", handle_specific_trip), \
+                driver_pool.DriverPool(factory=UrlDriver) as pool:
+            (_, future), = scrape_amtrak.price_csv_trips(pool, TRIPS[:1], 1, retries=2, backoff=0)
+            with self.assertRaises(ZeroDivisionError):
+                future.result()
+        self.assertEqual(handle_specific_trip.call_count, 1)
+
+    @mock.patch.multiple(scrape_amtrak, load_amtrak_site=mock.DEFAULT,
+                         fill_search_parameters=mock.DEFAULT, select_dollars=mock.DEFAULT,
+                         search=mock.DEFAULT, skip_dog_page=mock.DEFAULT,
+                         fill_passenger_information=mock.DEFAULT,
+                         get_price=mock.Mock(return_value=mock.Mock(text="$49.00")))
+    def test_resume_priced_trip(self, **_):
+        """
+        Tests that the ticket a trip is priced with, as price_csv_trip returns it from clicking
+        through the results, is read back from the journal by a later run.
+        """
+        trip = ["boston", "newyork", "08/24/2019", "169 Northeast Regional", "dollars"]
+        with driver_pool.DriverPool(factory=lambda: PagedDriver(PAGE_FILES)) as pool:
+            ticket, price = scrape_amtrak.price_csv_trip(pool, trip)
+        self.assertIsInstance(ticket, amtrak_results.AmtrakResult)
+        self.assertTrue(ticket.has_train("169 Northeast Regional"))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trips.journal")
+            with batch.BatchJournal(path) as journal:
+                journal.record_done(0, trip, ticket, price, (49.0, 0))
+            with batch.BatchJournal(path) as journal:
+                self.assertEqual(journal.done(0, trip), batch.JournalEntry(ticket, "$49.00", 1))
+                self.assertIsNone(journal.done(1, trip))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+"""
+Test for the stand-in site and the load test harness.
+"""
+import json
+import os
+import pathlib
+import random
+import re
+import unittest
+import requests
+from bs4 import BeautifulSoup
+from click.testing import CliRunner
+from amtrakomatic import amtrak_results
+from amtrakomatic import cli
+from amtrakomatic import http_fetch
+from amtrakomatic import loadtest
+from amtrakomatic import readiness
+from amtrakomatic import scrape_amtrak
+from amtrakomatic import standin
+from tests import replay_server
+
+TEST_DATA_DIR = os.path.join(pathlib.Path(__file__).parent, 'test_data')
+
+SEARCH = ("BOS", "NYP", "08/24/2019", False)
+
+def load_page(page_file):
+    """
+    Returns the results parsed from a recorded page.
+    """
+    with open(os.path.join(TEST_DATA_DIR, page_file)) as html:
+        return amtrak_results.AmtrakResults.from_html(html.read())
+
+class TestStandIn(unittest.TestCase):
+    """
+    Tests walking through the stand-in site the way the scraper does.
+    """
+
+    def test_homepage(self):
+        """
+        Tests that the fields the scraper finds by position are the search form's.
+        """
+        soup = BeautifulSoup(standin.homepage(), "html.parser")
+
+        def following_input(text, position, offset):
+            label = [element for element in soup.find_all(string=True)
+                     if element.strip() == text][position - 1]
+            return label.find_all_next("input")[offset - 1]["name"]
+
+        self.assertEqual(following_input("From", 5, 2), "wdf_origin")
+        self.assertEqual(following_input("To", 5, 2), "wdf_destination")
+        self.assertEqual(following_input("Depart", 3, 1), standin.DATE_FIELD)
+        done = soup.find(string=re.compile("Done"))
+        self.assertEqual([span.text for span in done.find_all_next("span")[3:5]],
+                         ["Dollars", "Points"])
+        self.assertEqual(soup.find(id="findtrains")["name"], http_fetch.SEARCH_HANDLER)
+
+    def test_checkout(self):
+        """
+        Tests signing in, searching, paging through results and adding a trip to the cart.
+        """
+        with replay_server.serve_test_data() as base_url:
+            session = requests.Session()
+            session.get(base_url + standin.HOMEPAGE_PATH).raise_for_status()
+            self.assertIn('name="_password"', session.get(base_url + standin.SIGN_IN_PATH).text)
+            signed_in = session.post(base_url + standin.LOG_ON_PATH,
+                                     data={"_name": "rider", "_password": "secret"})
+            self.assertEqual(signed_in.url, base_url + standin.HOMEPAGE_PATH)
+
+            first_page = session.post(base_url + standin.SEARCH_PATH,
+                                      data=http_fetch.search_form(*SEARCH)).text
+            self.assertEqual(amtrak_results.AmtrakResults.from_html(first_page),
+                             load_page("boston_newyork_08_24_2019_False_1.html"))
+            self.assertEqual(amtrak_results.pagination_pages(first_page), [1, 2])
+            self.assertNotIn("https://tickets.amtrak.com", first_page)
+            # Like the site, the page holds every result and pages through them itself.
+            self.assertNotIn("/itd/amtrak/page", first_page)
+            self.assertEqual(standin.shown_results(first_page)[1],
+                             ["selectTrainForm%s" % form for form in range(1, 11)])
+            self.assertIn(json.dumps({"text": "Displaying 11 - 13 results of 13",
+                                      "shown": ["selectTrainForm11", "selectTrainForm12",
+                                                "selectTrainForm13"]}), first_page)
+
+            ticket = amtrak_results.AmtrakResults.from_html(first_page).results[11]
+            fare_field = ("/sessionWorkflow/productWorkflow[@product='Rail']/selectedJourney[1]/"
+                          + standin.FARE_FIELD_SUFFIX)
+            self.assertEqual(session.post(base_url + standin.SEARCH_PATH, data={
+                ticket.add_to_cart_button_name_attribute: "ADD TO CART"}).status_code, 400)
+            ancillary = session.post(base_url + standin.SEARCH_PATH, data={
+                fare_field: ticket.minimum_fare_value_attribute,
+                ticket.add_to_cart_button_name_attribute: "ADD TO CART"}).text
+            self.assertIn(readiness.ANCILLARY_HANDLER, ancillary)
+            passenger = session.post(base_url + standin.SEARCH_PATH,
+                                     data={readiness.ANCILLARY_HANDLER: "No, thanks"}).text
+            self.assertIn("No, I choose not to protect my", passenger)
+            checkout = session.post(base_url + standin.SEARCH_PATH,
+                                    data={standin.PASSENGER_HANDLER: "Continue"}).text
+            total = BeautifulSoup(checkout, "html.parser").find(id="amtrakTotal").text
+            self.assertEqual(total, ticket.cheapest().text)
+
+            self.assertEqual(requests.post(base_url + standin.SEARCH_PATH,
+                                           data=http_fetch.search_form(*SEARCH),
+                                           timeout=10).status_code, 403)
+
+    def test_faults(self):
+        """
+        Tests that answers are delayed and fail as configured, and that searches can be pointed
+        at the stand-in.
+        """
+        sleeps = []
+        with replay_server.serve_test_data(faults=standin.Faults(0.5, 0.25, 0.5),
+                                           rng=random.Random(1), sleep=sleeps.append) as base_url, \
+                standin.pointed_at(base_url):
+            statuses = []
+            for _ in range(20):
+                session = http_fetch.HttpSession()
+                self.assertEqual(session.homepage_url, base_url + standin.HOMEPAGE_PATH)
+                statuses.append(requests.get(session.homepage_url, timeout=10).status_code)
+        self.assertNotIn(http_fetch.SITE_URL_VARIABLE, os.environ)
+        self.assertEqual(set(statuses), {200, 503})
+        self.assertEqual(len(sleeps), 20)
+        for sleep in sleeps:
+            self.assertTrue(0.5 <= sleep <= 0.75)
+
+class TestLoadTest(unittest.TestCase):
+    """
+    Tests running searches concurrently and reporting on them.
+    """
+
+    def test_percentile(self):
+        """
+        Tests percentiles by nearest rank.
+        """
+        values = [15, 20, 35, 40, 50]
+        self.assertEqual([loadtest.percentile(values, wanted) for wanted in [0, 30, 40, 50, 100]],
+                         [15, 20, 20, 35, 50])
+        self.assertIsNone(loadtest.percentile([], 50))
+
+    def test_run(self):
+        """
+        Tests a load test against the stand-in, with some answers failing.
+        """
+        clock = iter(range(1000)).__next__
+        report = loadtest.run_load_test(None, [SEARCH], 5, 1,
+                                        search=lambda *args: None, clock=clock)
+        self.assertEqual((report.succeeded, report.failed, report.elapsed), (5, 0, 11))
+        self.assertEqual(report.percentiles([50, 100]), [1, 1])
+        self.assertIn("p50 1.000s", report.format())
+
+        with replay_server.serve_test_data(faults=standin.Faults(error_rate=0.3),
+                                           rng=random.Random(2)) as base_url, \
+                standin.pointed_at(base_url), \
+                scrape_amtrak.new_driver_pool(size=3, backend="http") as pool:
+            report = loadtest.run_load_test(pool, list(replay_server.RECORDED_SEARCHES), 12, 3)
+        self.assertEqual(report.succeeded + report.failed, 12)
+        self.assertGreater(report.failed, 0)
+        self.assertEqual(list(report.errors), ["HTTPError"])
+        self.assertGreater(report.throughput, 0)
+
+    def test_command(self):
+        """
+        Tests load testing from the command line, with a stand-in started for the run.
+        """
+        result = CliRunner().invoke(cli.amtrak_search, [
+            "loadtest", TEST_DATA_DIR, "--requests", "6", "--concurrency", "2",
+            "--percentiles", "50,95"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Searches: 6 succeeded, 0 failed, 2 at once", result.output)
+        self.assertIn("p95", result.output)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+Test for command line startup time.
+"""
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from amtrakomatic import fuzzy_match
+
+# Importing the command line should not take longer than this, in microseconds.
+IMPORT_TIME_BUDGET = 300000
+
+# These are only needed once a search actually runs.
+DEFERRED_MODULES = ["selenium", "bs4", "fuzzywuzzy", "amtrakomatic.scrape_amtrak"]
+
+# These are only needed by some searches, CSV runs or commands.
+SCRAPER_DEFERRED_MODULES = ["selenium", "bs4", "requests", "sqlite3", "concurrent.futures",
+                            "amtrakomatic.batch", "amtrakomatic.driver_pool",
+                            "amtrakomatic.http_fetch", "amtrakomatic.output"]
+
+def imported_modules(module):
+    """
+    Returns the cumulative import time of every module loaded by importing module in a fresh
+    interpreter, in microseconds, by name.
+    """
+    import_times = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % module],
+        check=True, stderr=subprocess.PIPE, universal_newlines=True).stderr
+    cumulative_times = {}
+    for line in import_times.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            cumulative_times[name.strip()] = int(cumulative)
+    return cumulative_times
+
+class TestStartup(unittest.TestCase):
+    """
+    Tests that the command line starts without loading everything up front.
+    """
+
+    def test_import_time(self):
+        """
+        Tests that importing the command line stays within budget and defers heavy modules.
+        """
+        cumulative_times = imported_modules("amtrakomatic.cli")
+        self.assertIn("amtrakomatic.cli", cumulative_times)
+        self.assertLess(cumulative_times["amtrakomatic.cli"], IMPORT_TIME_BUDGET)
+        for module in DEFERRED_MODULES:
+            self.assertNotIn(module, cumulative_times)
+
+    def test_scraper_imports(self):
+        """
+        Tests that importing the scraper leaves what only some of its functions need unloaded.
+        """
+        cumulative_times = imported_modules("amtrakomatic.scrape_amtrak")
+        self.assertIn("amtrakomatic.scrape_amtrak", cumulative_times)
+        for module in SCRAPER_DEFERRED_MODULES:
+            self.assertNotIn(module, cumulative_times)
+
+    def test_compiled_stations(self):
+        """
+        Tests that the precompiled station table matches the CSV.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "stations.pickle")
+            fuzzy_match.compile_stations(filename)
+            # pylint: disable=protected-access
+            fuzzy_match._station_tables.cache_clear()
+            try:
+                with mock.patch.object(fuzzy_match, "AMTRAK_STATIONS_PICKLE", filename):
+                    station_map, index = fuzzy_match._station_tables()
+            finally:
+                fuzzy_match._station_tables.cache_clear()
+        self.assertEqual(station_map, fuzzy_match.load_stations())
+        self.assertEqual(index.match("Denver"), "Denver, Colorado")
+
+    def test_stale_compiled_stations(self):
+        """
+        Tests that a station table compiled by an older version is rebuilt from the CSV instead.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "stations.pickle")
+            old_index = fuzzy_match.StationIndex({})
+            del old_index.locations
+            with open(filename, "wb") as compiled_stations:
+                pickle.dump(({}, old_index), compiled_stations)
+            # pylint: disable=protected-access
+            fuzzy_match._station_tables.cache_clear()
+            try:
+                with mock.patch.object(fuzzy_match, "AMTRAK_STATIONS_PICKLE", filename):
+                    station_map, index = fuzzy_match._station_tables()
+            finally:
+                fuzzy_match._station_tables.cache_clear()
+        self.assertEqual(station_map, fuzzy_match.load_stations())
+        self.assertEqual(index.match("Denver"), "Denver, Colorado")
+        self.assertTrue(index.locations)
+
+if __name__ == '__main__':
+    unittest.main()
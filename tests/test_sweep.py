@@ -0,0 +1,86 @@
+"""
+Test for date range and routing sweeps.
+"""
+import contextlib
+import io
+import unittest
+from unittest import mock
+from click.testing import CliRunner
+from amtrakomatic import amtrak_results
+from amtrakomatic import cli
+from amtrakomatic import scrape_amtrak
+from amtrakomatic import sweep
+
+def fake_results(*fares):
+    """
+    Builds search results with one result per list of fares.
+    """
+    return amtrak_results.AmtrakResults([
+        amtrak_results.AmtrakResult("1h", [], result_fares, "", "", "") for result_fares in fares])
+
+class TestSweep(unittest.TestCase):
+    """
+    Tests that sweeps plan, share and price their searches.
+    """
+
+    def test_plan(self):
+        """
+        Tests that dates and routings expand into distinct searches.
+        """
+        self.assertEqual(sweep.date_range("12/30/2019", "01/02/2020"),
+                         ["12/30/2019", "12/31/2019", "01/01/2020", "01/02/2020"])
+        with self.assertRaises(ValueError):
+            sweep.date_range("01/02/2020", "01/01/2020")
+        routings = sweep.plan_routings("Harrisburg", "kansascity",
+                                       ["pittsburgh, chicago", "KansasCity"])
+        self.assertEqual([str(routing) for routing in routings], [
+            "Harrisburg -> kansascity",
+            "Harrisburg -> pittsburgh -> chicago -> kansascity",
+            "Harrisburg -> KansasCity -> kansascity"])
+        searches, _ = sweep.SweepPlan(["08/31/2019"], routings).searches()
+        self.assertEqual(searches, [("HAR", "KCY", "08/31/2019"), ("HAR", "PGH", "08/31/2019"),
+                                    ("PGH", "CHI", "08/31/2019"), ("CHI", "KCY", "08/31/2019"),
+                                    ("KCY", "KCY", "08/31/2019")])
+
+    def test_run_sweep(self):
+        """
+        Tests that each routing is priced from the cheapest fare of each of its segments.
+        """
+        fares = {
+            ("GBB", "DEN", "09/15/2019"): fake_results(["$145.00", "$169.00"], ["$93.00", None]),
+            ("GBB", "DEN", "09/16/2019"): fake_results([None, None]),
+            ("GBB", "OMA", "09/15/2019"): fake_results(["$40.00"]),
+            ("GBB", "OMA", "09/16/2019"): fake_results(["$35.00"]),
+            ("OMA", "DEN", "09/15/2019"): fake_results(["$60.50"]),
+            ("OMA", "DEN", "09/16/2019"): fake_results(["$50.00"]),
+        }
+        plan = sweep.SweepPlan(sweep.date_range("09/15/2019", "09/16/2019"),
+                               sweep.plan_routings("galesburg", "denver", ["omaha"]))
+        with mock.patch.object(sweep.scrape_amtrak, "get_all_fares",
+                               side_effect=lambda *search, **options: fares[search[:3]]):
+            rows = sweep.run_sweep(plan, pool=None, jobs=2)
+        self.assertEqual([row.total for row in rows], [93.0, 100.5, None, 85.0])
+        self.assertEqual(sweep.cheapest(rows).date, "09/16/2019")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            sweep.print_sweep(rows)
+        self.assertIn("09/16/2019  galesburg -> omaha -> denver", output.getvalue())
+        self.assertIn("$85 ($35 + $50)", output.getvalue())
+
+    @mock.patch.object(sweep, "print_sweep")
+    @mock.patch.object(sweep, "run_sweep", return_value=[])
+    @mock.patch.object(scrape_amtrak, "new_driver_pool")
+    def test_date_from_alone(self, _, run_sweep, print_sweep):
+        """
+        Tests that a date range given only its first date sweeps that one day.
+        """
+        result = CliRunner().invoke(cli.amtrak_search, [
+            "--source", "galesburg", "--destination", "denver", "--date-from", "09/15/2019"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        plan = run_sweep.call_args.args[0]
+        self.assertEqual(plan.dates, ["09/15/2019"])
+        self.assertEqual([str(routing) for routing in plan.routings], ["galesburg -> denver"])
+        print_sweep.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+"""
+Test for watching searches for fare changes.
+"""
+import json
+import os
+import pathlib
+import unittest
+from unittest import mock
+from amtrakomatic import amtrak_results
+from amtrakomatic import driver_pool
+from amtrakomatic import http_fetch
+from amtrakomatic import metrics
+from amtrakomatic import scrape_amtrak
+from amtrakomatic import watch
+from tests import replay_server
+
+TEST_DATA_DIR = os.path.join(pathlib.Path(__file__).parent, 'test_data')
+
+SEARCH = watch.Search("boston", "newyork", "08/24/2019")
+
+def load_results():
+    """
+    Loads the results of the boston to new york fixture as dicts.
+    """
+    with open(os.path.join(TEST_DATA_DIR, 'boston_newyork_08_24_2019_False_1.json')) as expected:
+        return json.load(expected)
+
+class TestWatch(unittest.TestCase):
+    """
+    Tests diffing results and polling for changes.
+    """
+
+    def test_diff(self):
+        """
+        Tests that added and removed trips and fare changes are found, and nothing else.
+        """
+        old = load_results()
+        new = load_results()
+        new[0]["fares"][0] = "$65.00"
+        new[1]["fares"][1] = "Sold Out"
+        old[2]["fares"][2] = "Sold Out"
+        removed = new.pop(3)
+        new[4]["result_id"] = "changed in a new session"
+        added = old.pop(5)
+        changes = watch.diff_results(SEARCH,
+                                     [amtrak_results.AmtrakResult(**result) for result in old],
+                                     [amtrak_results.AmtrakResult(**result) for result in new])
+
+        def trip(result):
+            return watch.trip_key(amtrak_results.AmtrakResult(**result))
+
+        self.assertEqual(changes, [
+            watch.FareChange(SEARCH, trip(new[0]), watch.FARE_CHANGED, 1, "$55.00", "$65.00"),
+            watch.FareChange(SEARCH, trip(new[1]), watch.SOLD_OUT, 2, old[1]["fares"][1],
+                             "Sold Out"),
+            watch.FareChange(SEARCH, trip(new[2]), watch.AVAILABLE, 3, "Sold Out",
+                             new[2]["fares"][2]),
+            watch.FareChange(SEARCH, trip(added), watch.ADDED,
+                             new=amtrak_results.AmtrakResult(**added).cheapest().text),
+            watch.FareChange(SEARCH, trip(removed), watch.REMOVED),
+        ])
+        self.assertEqual(str(changes[0]),
+                         "boston -> newyork on 08/24/2019: %s fare changed in class 1 "
+                         "($55.00 -> $65.00)" % trip(new[0]))
+
+    def test_poll(self):
+        """
+        Tests that polling an unchanged search reports nothing, without parsing its page again.
+        """
+        metrics.REGISTRY.reset()
+        sleeps = []
+        reported = []
+        with replay_server.serve_test_data() as base_url, \
+                driver_pool.DriverPool(factory=lambda: http_fetch.HttpSession(
+                    base_url + replay_server.HOMEPAGE_PATH,
+                    base_url + replay_server.SEARCH_PATH)) as pool, \
+                mock.patch.object(scrape_amtrak, "parse_results",
+                                  wraps=scrape_amtrak.parse_results) as parse_results:
+            watcher = watch.Watcher([SEARCH], pool, interval=10, jitter=5, sleep=sleeps.append)
+            watcher.run(reported.append, polls=3)
+        self.assertEqual(reported, [])
+        self.assertEqual(parse_results.call_count, 1)
+        self.assertEqual(metrics.REGISTRY.snapshot()["counters"]["pages_unchanged"], 2)
+        self.assertEqual(len(sleeps), 2)
+        for sleep in sleeps:
+            self.assertTrue(10 <= sleep <= 15)
+        with open(os.path.join(TEST_DATA_DIR, replay_server.RECORDED_SEARCHES[
+                ("BOS", "NYP", "08/24/2019", False)])) as html:
+            self.assertEqual(watcher.previous[SEARCH],
+                             amtrak_results.AmtrakResults.from_html(html.read()).results)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,251 @@
+"""
+Test for the work queue, its SQLite broker and its workers.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from click.testing import CliRunner
+from selenium.common import exceptions
+from amtrakomatic import cli
+from amtrakomatic import metrics
+from amtrakomatic import scrape_amtrak
+from amtrakomatic import standin
+from amtrakomatic import workqueue
+from tests import replay_server
+
+SEARCH = workqueue.Job("BOS", "NYP", "08/24/2019")
+
+# pylint: disable=too-few-public-methods
+class Clock:
+    """
+    A clock that only moves when told to.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class TestBroker(unittest.TestCase):
+    """
+    Tests leasing, retrying and deduplicating jobs.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "queue.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_leases(self):
+        """
+        Tests that a job is only handed to one worker at a time, and goes to another once a
+        lease runs out or fails, until it has been tried max_attempts times.
+        """
+        clock = Clock()
+        with workqueue.SqliteBroker(self.path, max_attempts=2, backoff=10, clock=clock) as queue:
+            first = queue.enqueue(workqueue.Job.create("boston", "New York", "08/24/2019"))
+            self.assertEqual(queue.enqueue(SEARCH), first)
+            trip = queue.enqueue(workqueue.Job.create("chicago", "kansascity", "09/01/2019",
+                                                      train="3 Southwest Chief "))
+            self.assertNotEqual(trip, first)
+
+            self.assertEqual(queue.lease("one", 30), workqueue.Lease(first, SEARCH, 1))
+            leased = queue.lease("two", 30)
+            self.assertEqual((leased.job_id, leased.job.kind, leased.job.train),
+                             (trip, workqueue.TRIP, "3 Southwest Chief"))
+            self.assertIsNone(queue.lease("three", 30))
+            self.assertEqual(queue.enqueue(SEARCH), first)
+
+            self.assertFalse(queue.complete(first, "two", "[]"))
+            self.assertTrue(queue.complete(first, "one", "[]"))
+            self.assertEqual(queue.status(first).state, workqueue.DONE)
+            again = queue.enqueue(SEARCH)
+            self.assertNotEqual(again, first)
+
+            self.assertEqual(queue.fail(trip, "two", "RuntimeError: no train"), workqueue.QUEUED)
+            self.assertEqual(queue.lease("three", 30).job_id, again)
+            self.assertIsNone(queue.lease("three", 30))
+            clock.now = clock.now + 10
+            self.assertEqual(queue.lease("three", 30), workqueue.Lease(trip, leased.job, 2))
+
+            clock.now = clock.now + 20
+            self.assertTrue(queue.extend(trip, "three", 30))
+            self.assertFalse(queue.extend(again, "one", 30))
+            clock.now = clock.now + 30
+            # The first lease on the search ran out, the second on the trip was its last try.
+            self.assertEqual(queue.lease("four", 30), workqueue.Lease(again, SEARCH, 2))
+            status = queue.status(trip)
+            self.assertEqual((status.state, status.attempts, status.error),
+                             (workqueue.FAILED, 2, "Lease expired"))
+            self.assertFalse(queue.complete(trip, "three", "{}"))
+            self.assertIsNone(queue.fail(again, "three", "Lost"))
+
+            with workqueue.open_broker(self.path) as other:
+                self.assertEqual(other.counts(), {workqueue.DONE: 1, workqueue.FAILED: 1,
+                                                  workqueue.LEASED: 1})
+                self.assertEqual(other.status(again).job, SEARCH)
+                self.assertIsNone(other.status(100))
+
+    def test_workers(self):
+        """
+        Tests that workers on several threads run every job exactly once, retrying failures.
+        """
+        runs = []
+        lock = threading.Lock()
+
+        # pylint: disable=unused-argument
+        def job_runner(job, pool, history):
+            with lock:
+                runs.append(job.date)
+                if job.date == "08/03/2019" and runs.count(job.date) == 1:
+                    raise exceptions.TimeoutException("Slow page")
+            return '"%s"' % job.date
+
+        dates = ["08/%02d/2019" % day for day in range(1, 9)]
+        with workqueue.SqliteBroker(self.path, backoff=0) as queue:
+            job_ids = [queue.enqueue(workqueue.Job("BOS", "NYP", date)) for date in dates]
+            workers = [workqueue.Worker(queue, None, "worker %s" % number, job_runner=job_runner)
+                       for number in range(3)]
+            threads = [threading.Thread(target=worker.run, kwargs={"exit_when_idle": True})
+                       for worker in workers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            statuses = list(workqueue.wait_for(queue, job_ids))
+        self.assertEqual(sorted(runs), sorted(dates + ["08/03/2019"]))
+        self.assertEqual([status.result for status in statuses], ['"%s"' % date for date in dates])
+        self.assertEqual(statuses[2].attempts, 2)
+
+    def test_lease_renewal(self):
+        """
+        Tests that a job that runs longer than its lease keeps it.
+        """
+        started = threading.Event()
+
+        # pylint: disable=unused-argument
+        def job_runner(job, pool, history):
+            started.set()
+            time.sleep(0.5)
+            return "[]"
+
+        with workqueue.SqliteBroker(self.path) as queue:
+            job_id = queue.enqueue(SEARCH)
+            worker = workqueue.Worker(queue, None, "slow", lease_seconds=0.15,
+                                      job_runner=job_runner)
+            thread = threading.Thread(target=worker.run_once)
+            thread.start()
+            started.wait()
+            time.sleep(0.3)
+            self.assertIsNone(queue.lease("other", 0.15))
+            thread.join()
+            self.assertEqual(queue.status(job_id).state, workqueue.DONE)
+
+    def test_lost_lease(self):
+        """
+        Tests that the result of a job whose lease was lost is dropped, and not counted as done.
+        """
+        clock = Clock()
+
+        # pylint: disable=unused-argument
+        def job_runner(job, pool, history):
+            clock.now = clock.now + 60
+            self.assertEqual(queue.lease("other", 30).job, job)
+            return "[]"
+
+        metrics.REGISTRY.reset()
+        with workqueue.SqliteBroker(self.path, clock=clock) as queue:
+            job_id = queue.enqueue(SEARCH)
+            worker = workqueue.Worker(queue, None, "slow", lease_seconds=30,
+                                      job_runner=job_runner)
+            self.assertEqual(worker.run_once(), job_id)
+            self.assertEqual(queue.status(job_id).state, workqueue.LEASED)
+        counters = metrics.REGISTRY.snapshot()["counters"]
+        self.assertEqual(counters["jobs_dropped"], 1)
+        self.assertNotIn("jobs_done", counters)
+
+class TestCommands(unittest.TestCase):
+    """
+    Tests enqueueing jobs and running them on workers from the command line, against the stand-in
+    site.
+    """
+
+    def test_enqueue_and_work(self):
+        """
+        Tests that a worker writes back the results of a search, and that enqueue waits for them.
+        """
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as directory, \
+                replay_server.serve_test_data() as base_url, standin.pointed_at(base_url), \
+                scrape_amtrak.new_driver_pool(backend="http") as pool:
+            path = os.path.join(directory, "queue.sqlite")
+            expected = scrape_amtrak.get_all_fares("BOS", "NYP", "08/24/2019", False, pool)
+            result = runner.invoke(cli.amtrak_search, [
+                "enqueue", "--broker", path, "--source", "boston", "--destination", "newyork",
+                "--date", "08/24/2019"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            result = runner.invoke(cli.amtrak_search, [
+                "worker", "--broker", path, "--backend", "http", "--jobs", "2",
+                "--exit-when-idle"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("Ran 1 jobs", result.output)
+            with workqueue.SqliteBroker(path) as queue:
+                self.assertEqual(queue.counts(), {workqueue.DONE: 1})
+                self.assertEqual(queue.status(1).results(), expected)
+                worker = workqueue.Worker(queue, pool, poll_interval=0.05)
+                thread = threading.Thread(target=worker.run, kwargs={"max_jobs": 1})
+                thread.start()
+                result = runner.invoke(cli.amtrak_search, [
+                    "enqueue", "--broker", path, "--source", "BOS", "--destination", "NYP",
+                    "--date", "08/24/2019", "--wait", "--poll-interval", "0.05",
+                    "--format", "ndjson"])
+                thread.join()
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Queued 1 jobs: 2", result.output)
+        records = [json.loads(line) for line in result.output.splitlines()
+                   if line.startswith("{")]
+        self.assertEqual(len(records), len(expected.results))
+        self.assertEqual({record["source"] for record in records}, {"BOS"})
+
+    def test_enqueue_missing_job(self):
+        """
+        Tests that waiting for jobs that are gone from the queue reports them as failed.
+        """
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(workqueue.SqliteBroker, "status", return_value=None):
+            path = os.path.join(directory, "queue.sqlite")
+            runner = CliRunner()
+            search = runner.invoke(cli.amtrak_search, [
+                "enqueue", "--broker", path, "--source", "BOS", "--destination", "NYP",
+                "--date", "08/24/2019", "--wait"])
+            trip = runner.invoke(cli.amtrak_search, [
+                "enqueue", "--broker", path, "--source", "BOS", "--destination", "NYP",
+                "--date", "08/24/2019", "--train", "169 Northeast Regional", "--wait"])
+        self.assertEqual(search.exit_code, 1, search.output)
+        self.assertIn("Job 1 failed: no longer in the queue", search.output)
+        self.assertEqual(trip.exit_code, 1, trip.output)
+        self.assertIn("Failed: no longer in the queue", trip.output)
+
+    @mock.patch.object(scrape_amtrak, "new_driver_pool")
+    def test_worker_logs_in(self, new_driver_pool):
+        """
+        Tests that browser workers log in unless told not to, since any job may be a trip.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "queue.sqlite")
+            for options, log_in in [([], True), (["--no-log-in"], False),
+                                    (["--backend", "http"], False)]:
+                result = CliRunner().invoke(cli.amtrak_search, [
+                    "worker", "--broker", path, "--exit-when-idle"] + options)
+                self.assertEqual(result.exit_code, 0, result.output)
+                self.assertEqual(new_driver_pool.call_args.kwargs["log_in"], log_in)
+
+if __name__ == '__main__':
+    unittest.main()